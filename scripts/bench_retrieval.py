@@ -0,0 +1,127 @@
+"""Compare recall and latency of the vector, hybrid and lexical retrieval.
+
+The corpus is synthetic: a chunk for every person, with their room and the
+code of their course, so the queries on exact names and codes have a single
+relevant chunk. Queries are embedded with fake embeddings sleeping as long as
+a remote embedding call.
+
+Usage: python scripts/bench_retrieval.py [--people 500] [--output out.json]
+"""
+
+import argparse
+import json
+import random
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from langchain_chroma import Chroma
+from langchain_core.documents import Document
+
+from chatbot.fakes import FakeEmbeddings
+from chatbot.lexical import HybridRetriever, LexicalIndex
+from chatbot.manifest import chunk_id
+
+FIRST = ["Mario", "Anna", "Luca", "Giulia", "Marco", "Sara", "Paolo", "Elena"]
+LAST = ["Rossi", "Bianchi", "Ferrari", "Esposito", "Romano", "Colombo", "Ricci"]
+TOPICS = [
+    "sound synthesis",
+    "music information retrieval",
+    "audio restoration",
+    "spatial audio",
+    "sonification",
+    "music perception",
+]
+
+
+def corpus(people: int, seed: int) -> tuple[list[Document], list[tuple[str, int]]]:
+    """Build the chunks and the queries, with the index of their relevant chunk."""
+    rng = random.Random(seed)  # noqa: S311
+    docs, queries = [], []
+    for i in range(people):
+        name = f"{rng.choice(FIRST)} {rng.choice(LAST)} {i}"
+        room = f"{100 + i}"
+        course = f"CSC-{1000 + i}"
+        topic = rng.choice(TOPICS)
+        docs.append(
+            Document(
+                page_content=(
+                    f"{name} is a researcher at the center working on {topic}. "
+                    f"The office is room {room}, and {name.split()[0]} teaches "
+                    f"the course {course} about {topic}."
+                ),
+                metadata={"source": f"people-{i}", "page": 0},
+            ),
+        )
+        queries.append((f"Which course does researcher {i} teach?", i))
+        queries.append((f"Who teaches {course}?", i))
+        queries.append((f"Where is room {room}?", i))
+    rng.shuffle(queries)
+    return docs, queries
+
+
+def run(args: argparse.Namespace) -> dict[str, dict[str, float]]:
+    """Time every retrieval mode over the queries."""
+    docs, queries = corpus(args.people, args.seed)
+    queries = queries[: args.queries]
+    ids = [chunk_id(doc) for doc in docs]
+    embeddings = FakeEmbeddings(latency=args.embedding_latency)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Chroma.from_documents(
+            docs,
+            embeddings,
+            ids=ids,
+            persist_directory=str(Path(tmp) / "chroma"),
+        )
+        lexical = LexicalIndex(Path(tmp) / "lexical.sqlite")
+        lexical.add(dict(zip(ids, docs, strict=True)))
+
+        for mode in ("vector", "hybrid", "lexical"):
+            retriever = HybridRetriever(
+                vectorstore=db,
+                lexical=lexical,
+                mode=mode,
+                k=args.k,
+            )
+            hits, latencies = 0, []
+            for query, relevant in queries:
+                start = time.perf_counter()
+                found = retriever.invoke(query)
+                latencies.append(time.perf_counter() - start)
+                hits += ids[relevant] in {chunk_id(doc) for doc in found}
+            results[mode] = {
+                "recall": hits / len(queries),
+                "mean_ms": 1000 * statistics.mean(latencies),
+                "p95_ms": 1000 * statistics.quantiles(latencies, n=20)[-1],
+            }
+        lexical.close()
+    return results
+
+
+def main() -> None:
+    """Run the benchmark and print the results."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--people", type=int, default=500)
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--embedding-latency", type=float, default=0.02)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path)
+    args = parser.parse_args()
+
+    results = run(args)
+    print(f"{'mode':<10}{'recall@' + str(args.k):>10}{'mean ms':>10}{'p95 ms':>10}")
+    for mode, result in results.items():
+        print(
+            f"{mode:<10}{result['recall']:>10.3f}"
+            f"{result['mean_ms']:>10.2f}{result['p95_ms']:>10.2f}",
+        )
+    if args.output is not None:
+        args.output.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
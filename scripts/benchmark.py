@@ -0,0 +1,357 @@
+"""Benchmark the ingest and chat pipelines offline.
+
+Every case runs on a generated corpus with the fake models of chatbot.fakes,
+so the results only measure the code of the chatbot and can be compared
+between commits:
+
+    python scripts/benchmark.py --output before.json
+    git checkout other-branch
+    python scripts/benchmark.py --output after.json --compare before.json
+"""
+
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import multiprocessing
+import platform
+import resource
+import statistics
+import subprocess
+import tempfile
+import time
+from collections.abc import Callable, Iterator
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any
+
+from langchain.memory import ChatMessageHistory
+from langchain_chroma import Chroma
+from rich.console import Console
+
+from chatbot import chat, memory
+from chatbot.fakes import (
+    FakeChatModel,
+    FakeEmbeddings,
+    fake_web_pages,
+    iter_fake_web_pages,
+    write_pdf_corpus,
+)
+from chatbot.history import HistoryWindow
+from chatbot.lexical import HybridRetriever, LexicalIndex
+from chatbot.manifest import Manifest, chunk_id, text_hash
+from chatbot.settings import BatchSettings, HistorySettings
+from chatbot.vectorstore import CompactVectorStore
+
+CHUNK_SIZE = 2500
+OVERLAP = 150
+QUERIES = [
+    "Who works on sound synthesis?",
+    "Which thesis proposals are about music perception?",
+    "What does Mario Rossi study?",
+    "Tell me about the audio restoration of old tapes.",
+]
+
+# The ratio of the peak memory of the largest ingest to the smallest one,
+# above which the memory of the ingest is not considered flat.
+MAX_RSS_GROWTH = 1.5
+
+# The results compared between runs, lower is better.
+TIMINGS = ("median_s", "min_s", "median_ms", "max_ms")
+
+MEMORY_PATHS = {
+    "MEMORY": "",
+    "CHROMA_PATH": "chroma",
+    "MANIFEST_PATH": "manifest.json",
+    "CHECKPOINT_PATH": "ingest.checkpoint",
+    "LEXICAL_INDEX": "lexical.sqlite",
+    "CHAT_LOG": "history.jsonl",
+    "CHAT_SUMMARY": "summary.json",
+}
+
+
+@contextlib.contextmanager
+def memory_in(folder: Path) -> Iterator[None]:
+    """Point the memory of the chatbot to a folder."""
+    old = {name: getattr(memory, name) for name in MEMORY_PATHS}
+    for name, path in MEMORY_PATHS.items():
+        setattr(memory, name, folder / path)
+    try:
+        yield
+    finally:
+        for name, path in old.items():
+            setattr(memory, name, path)
+
+
+def timed(run: Callable[[], Any], repeat: int) -> dict[str, float]:
+    """Time the runs, returning the median and the best seconds."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    return {"median_s": statistics.median(times), "min_s": min(times)}
+
+
+def bench_split_text(args: argparse.Namespace, workers: int = 1) -> dict[str, Any]:
+    """Split the generated web pages in a pool of ``workers`` processes."""
+    pages = fake_web_pages(args.pages, seed=args.seed)
+    size = sum(len(page.page_content) for page in pages) / 1e6
+    result = timed(
+        lambda: memory.split_text(pages, CHUNK_SIZE, OVERLAP, workers=workers),
+        args.repeat,
+    )
+    return {**result, "mb": size, "mb_per_s": size / result["median_s"]}
+
+
+def bench_split_pdfs(args: argparse.Namespace, tmp: Path) -> dict[str, Any]:
+    """Parse and split the generated pdf files."""
+    pdfs = write_pdf_corpus(tmp / "pdf", args.pdfs, 5, seed=args.seed)
+    size = sum(pdf.stat().st_size for pdf in pdfs) / 1e6
+    result = timed(
+        lambda: list(memory.split_pdfs(pdfs, CHUNK_SIZE, OVERLAP)),
+        args.repeat,
+    )
+    return {**result, "files": len(pdfs), "mb": size}
+
+
+def bench_create_database(args: argparse.Namespace, tmp: Path) -> dict[str, Any]:
+    """Embed and store the chunks of the generated web pages."""
+    chunks = memory.split_text(fake_web_pages(args.pages), CHUNK_SIZE, OVERLAP)
+    runs = iter(range(args.repeat))
+
+    def run() -> None:
+        with memory_in(tmp / f"create-{next(runs)}"):
+            memory.create_database_from_docs(
+                chunks,
+                FakeEmbeddings(),
+                [chunk_id(chunk) for chunk in chunks],
+            )
+
+    result = timed(run, args.repeat)
+    return {**result, "chunks": len(chunks)}
+
+
+def bench_retrieval(args: argparse.Namespace, tmp: Path) -> dict[str, Any]:
+    """Retrieve from indexes of growing size, with every retrieval mode."""
+    results: dict[str, Any] = {}
+    embeddings = FakeEmbeddings()
+    for size in args.index_sizes:
+        docs = fake_web_pages(size, words=150, seed=args.seed)
+        ids = [chunk_id(doc) for doc in docs]
+        db = Chroma.from_documents(
+            docs,
+            embeddings,
+            ids=ids,
+            collection_name=f"bench-{size}",
+            persist_directory=str(tmp / f"retrieval-{size}"),
+        )
+        lexical = LexicalIndex(tmp / f"retrieval-{size}" / "lexical.sqlite")
+        lexical.add(dict(zip(ids, docs, strict=True)))
+        for mode in ("vector", "hybrid", "lexical"):
+            retriever = HybridRetriever(vectorstore=db, lexical=lexical, mode=mode)
+            latencies = []
+            for _ in range(args.repeat):
+                for query in QUERIES:
+                    start = time.perf_counter()
+                    retriever.invoke(query)
+                    latencies.append(time.perf_counter() - start)
+            results[f"{mode}@{size}"] = {
+                "median_ms": 1000 * statistics.median(latencies),
+                "max_ms": 1000 * max(latencies),
+            }
+        lexical.close()
+
+        stored = db.get(include=["embeddings", "documents", "metadatas"])
+        for dtype in ("float16", "int8"):
+            compact = CompactVectorStore(
+                tmp / f"compact-{size}-{dtype}",
+                embeddings,
+                dtype,
+            )
+            compact.upsert(
+                stored["ids"],
+                stored["embeddings"],
+                stored["metadatas"],
+                stored["documents"],
+            )
+            latencies = []
+            for _ in range(args.repeat):
+                for query in QUERIES:
+                    start = time.perf_counter()
+                    compact.similarity_search(query)
+                    latencies.append(time.perf_counter() - start)
+            results[f"compact_{dtype}@{size}"] = {
+                "median_ms": 1000 * statistics.median(latencies),
+                "max_ms": 1000 * max(latencies),
+            }
+    return results
+
+
+def bench_chat_loop(args: argparse.Namespace, tmp: Path) -> dict[str, Any]:
+    """Answer turns with the chat loop, streaming and not."""
+    embeddings = FakeEmbeddings()
+    docs = fake_web_pages(200, words=150, seed=args.seed)
+    retriever = Chroma.from_documents(
+        docs,
+        embeddings,
+        collection_name="bench-chat",
+        persist_directory=str(tmp / "chat"),
+    ).as_retriever()
+    chain = chat.create_chain(FakeChatModel(), "{context}")
+    questions = itertools.cycle(QUERIES)
+    ask = chat.Prompt.ask
+    chat.Prompt.ask = lambda *_, **__: next(questions)  # type: ignore
+
+    results: dict[str, Any] = {}
+    try:
+        for stream in (True, False):
+            history = HistoryWindow(ChatMessageHistory(), HistorySettings())
+            console = Console(file=io.StringIO(), width=100)
+            latencies = []
+            for _ in range(args.turns):
+                start = time.perf_counter()
+                chat.loop(history, chain, retriever, console, stream=stream)
+                latencies.append(time.perf_counter() - start)
+            results["stream" if stream else "invoke"] = {
+                "median_ms": 1000 * statistics.median(latencies),
+                "max_ms": 1000 * max(latencies),
+            }
+    finally:
+        chat.Prompt.ask = ask  # type: ignore
+    return results
+
+
+def ingest_pages(folder: Path, pages: int, seed: int) -> dict[str, Any]:
+    """Ingest the generated web pages through the streaming pipeline.
+
+    Run in a process of its own, so its peak memory is that of the ingest.
+    """
+    hashes: dict[str, str] = {}
+
+    def documents() -> Iterator[Any]:
+        for page in iter_fake_web_pages(pages, words=500, seed=seed):
+            hashes[page.metadata["source"]] = text_hash(page.page_content)
+            yield page
+
+    start = time.perf_counter()
+    with memory_in(folder):
+        memory.update_memory(
+            FakeEmbeddings(size=16),
+            Manifest(CHUNK_SIZE, OVERLAP),
+            "web",
+            hashes,
+            memory.split_stages(documents(), CHUNK_SIZE, OVERLAP),
+            BatchSettings(),
+        )
+    # kilobytes on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    scale = 1e6 if platform.system() == "Darwin" else 1e3
+    return {"s": time.perf_counter() - start, "peak_rss_mb": peak / scale}
+
+
+def bench_ingest_memory(args: argparse.Namespace, tmp: Path) -> dict[str, Any]:
+    """Ingest corpora of growing size, checking that the peak memory is flat."""
+    context = multiprocessing.get_context("spawn")
+    results: dict[str, Any] = {}
+    for size in args.ingest_sizes:
+        with ProcessPoolExecutor(1, mp_context=context) as pool:
+            run = pool.submit(ingest_pages, tmp / f"ingest-{size}", size, args.seed)
+            result = run.result()
+        results[f"{size}"] = {**result, "pages_per_s": size / result["s"]}
+    peaks = [results[f"{size}"]["peak_rss_mb"] for size in args.ingest_sizes]
+    results["peak_rss_growth"] = max(peaks) / min(peaks)
+    return results
+
+
+def commit() -> str:
+    """Get the commit being benchmarked."""
+    with contextlib.suppress(OSError, subprocess.CalledProcessError):
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],  # noqa: S603, S607
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.strip()
+    return ""
+
+
+def compare(
+    results: dict[str, Any],
+    baseline: dict[str, Any],
+    prefix: str = "",
+) -> None:
+    """Print the ratio of every timing to the baseline one."""
+    for key, value in results.items():
+        old = baseline.get(key)
+        if isinstance(value, dict) and isinstance(old, dict):
+            compare(value, old, f"{prefix}{key}.")
+        elif key in TIMINGS and isinstance(old, int | float) and old:
+            name = prefix + key
+            print(f"{name:<45} {old:>10.4f} -> {value:>10.4f} {value / old:>6.2f}x")
+
+
+def main() -> None:
+    """Run the benchmarks and write the results as JSON."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--pdfs", type=int, default=20)
+    parser.add_argument("--split-workers", type=int, default=4)
+    parser.add_argument(
+        "--index-sizes",
+        type=lambda value: [int(size) for size in value.split(",")],
+        default=[100, 1000, 5000],
+    )
+    parser.add_argument(
+        "--ingest-sizes",
+        type=lambda value: [int(size) for size in value.split(",")],
+        default=[100, 10000],
+    )
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, default=Path("benchmark.json"))
+    parser.add_argument("--compare", type=Path)
+    args = parser.parse_args()
+
+    results: dict[str, Any] = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp = Path(tmp_dir)
+        cases: dict[str, Callable[[], dict[str, Any]]] = {
+            "split_text": lambda: bench_split_text(args),
+            "split_text_parallel": lambda: bench_split_text(args, args.split_workers),
+            "split_pdfs": lambda: bench_split_pdfs(args, tmp),
+            "create_database_from_docs": lambda: bench_create_database(args, tmp),
+            "retrieval": lambda: bench_retrieval(args, tmp),
+            "chat_loop": lambda: bench_chat_loop(args, tmp),
+            "ingest_memory": lambda: bench_ingest_memory(args, tmp),
+        }
+        for name, case in cases.items():
+            print(f"Running {name}...")
+            results[name] = case()
+
+    report = {
+        "commit": commit(),
+        "date": datetime.now(tz=timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "args": {key: value for key, value in vars(args).items() if key != "output"},
+        "results": results,
+    }
+    args.output.write_text(json.dumps(report, indent=2, default=str))
+    print(json.dumps(results, indent=2))
+
+    if args.compare is not None:
+        baseline = json.loads(args.compare.read_text())
+        print(f"\nCompared to {baseline.get('commit') or args.compare}:")
+        compare(results, baseline["results"])
+
+    growth = results["ingest_memory"]["peak_rss_growth"]
+    if growth > MAX_RSS_GROWTH:
+        msg = f"The peak memory of the ingest grew {growth:.2f}x with the pages."
+        raise SystemExit(msg)
+
+
+if __name__ == "__main__":
+    main()
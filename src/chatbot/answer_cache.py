@@ -0,0 +1,202 @@
+"""Semantic cache of the answers to previously asked questions."""
+
+import json
+import sqlite3
+import threading
+import time
+from collections.abc import Sequence
+from pathlib import Path
+
+import numpy as np
+import numpy.typing as npt
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from chatbot.manifest import chunk_id
+from chatbot.settings import AnswerCacheSettings
+
+
+class AnswerCache:
+    """Answers stored by the embedding of their question.
+
+    A stored answer is served when its question is similar enough to the new
+    one and the retrieved context is made of the same chunks. Every stored
+    answer is dropped when the index changes. The cache can be used from any
+    thread, e.g. with ``asyncio.to_thread``.
+
+    Parameters
+    ----------
+    path : Path
+        The sqlite database file.
+    embeddings : Embeddings
+        The model embedding the questions.
+    settings : AnswerCacheSettings
+        The similarity threshold, time to live and size of the cache.
+    index_version : str
+        A fingerprint of the index the answers were generated from.
+
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        embeddings: Embeddings,
+        settings: AnswerCacheSettings,
+        index_version: str,
+    ) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.embeddings = embeddings
+        self.settings = settings
+        self.hits = 0
+        self.misses = 0
+        self._last: tuple[str, npt.NDArray[np.float32]] | None = None
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS answers (question TEXT, vector BLOB, "
+                "context TEXT, answer TEXT, created REAL)",
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)",
+            )
+            stored = self._conn.execute(
+                "SELECT value FROM meta WHERE name = 'index_version'",
+            ).fetchone()
+            if stored is None or stored[0] != index_version:
+                self._conn.execute("DELETE FROM answers")
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO meta VALUES ('index_version', ?)",
+                    (index_version,),
+                )
+            self._conn.execute(
+                "DELETE FROM answers WHERE created < ?",
+                (time.time() - settings.ttl,),
+            )
+        self._load()
+
+    def _load(self) -> None:
+        rows = self._conn.execute(
+            "SELECT rowid, vector, context, created FROM answers ORDER BY created",
+        ).fetchall()
+        self._rowids = [row[0] for row in rows]
+        self._contexts = [row[2] for row in rows]
+        self._created = np.array([row[3] for row in rows], dtype=np.float64)
+        self._vectors = np.array(
+            [np.frombuffer(row[1], dtype=np.float32) for row in rows],
+            dtype=np.float32,
+        )
+
+    @staticmethod
+    def _context_key(context: Sequence[Document]) -> str:
+        return json.dumps(sorted(chunk_id(doc) for doc in context))
+
+    def _embed(
+        self,
+        question: str,
+        vector: list[float] | None = None,
+    ) -> npt.NDArray[np.float32]:
+        if vector is None:
+            # a question is stored right after being looked up
+            if self._last is not None and self._last[0] == question:
+                return self._last[1]
+            vector = self.embeddings.embed_query(question)
+        normalized = np.array(vector, dtype=np.float32)
+        normalized /= np.linalg.norm(normalized) or 1.0
+        self._last = (question, normalized)
+        return normalized
+
+    def lookup(
+        self,
+        question: str,
+        context: Sequence[Document],
+        vector: list[float] | None = None,
+    ) -> str | None:
+        """Find the stored answer to a similar question with the same context.
+
+        Parameters
+        ----------
+        question : str
+            The question.
+        context : Sequence[Document]
+            The chunks retrieved for the question.
+        vector : list[float] | None
+            The embedding of the question, when already computed for the
+            retrieval. Otherwise the question is embedded by the cache.
+
+        Returns
+        -------
+        str | None
+            The stored answer, or ``None`` if there is none.
+
+        """
+        with self._lock:
+            answer = self._find(question, context, vector)
+            if answer is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return answer
+
+    def _find(
+        self,
+        question: str,
+        context: Sequence[Document],
+        vector: list[float] | None,
+    ) -> str | None:
+        if len(self._rowids) == 0:
+            return None
+        similarity = self._vectors @ self._embed(question, vector)
+        fresh = self._created >= time.time() - self.settings.ttl
+        key = self._context_key(context)
+        for i in np.argsort(-similarity):
+            if similarity[i] < self.settings.threshold:
+                break
+            if fresh[i] and self._contexts[i] == key:
+                (answer,) = self._conn.execute(
+                    "SELECT answer FROM answers WHERE rowid = ?",
+                    (self._rowids[i],),
+                ).fetchone()
+                return str(answer)
+        return None
+
+    def store(
+        self,
+        question: str,
+        context: Sequence[Document],
+        answer: str,
+        vector: list[float] | None = None,
+    ) -> None:
+        """Store the answer to a question, evicting the oldest over the cap.
+
+        The ``vector`` of the question is used if given, see :meth:`lookup`.
+        """
+        vector_bytes = self._embed(question, vector).tobytes()
+        with self._lock:
+            with self._conn:
+                self._conn.execute(
+                    "INSERT INTO answers VALUES (?, ?, ?, ?, ?)",
+                    (
+                        question,
+                        vector_bytes,
+                        self._context_key(context),
+                        answer,
+                        time.time(),
+                    ),
+                )
+                self._conn.execute(
+                    "DELETE FROM answers WHERE rowid NOT IN ("
+                    "SELECT rowid FROM answers ORDER BY created DESC LIMIT ?)",
+                    (self.settings.max_entries,),
+                )
+            self._load()
+
+    def report(self) -> str:
+        """Describe the hit ratio of the session."""
+        lookups = self.hits + self.misses
+        ratio = self.hits / lookups if lookups else 0.0
+        return f"Answer cache: {self.hits}/{lookups} hits ({ratio:.0%})."
+
+    def close(self) -> None:
+        """Close the underlying database."""
+        self._conn.close()
@@ -0,0 +1,263 @@
+"""Answer a batch of questions, for offline evaluation and bulk queries."""
+
+import asyncio
+import itertools
+import json
+import logging
+import time
+from collections.abc import Iterable, Iterator
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, TextIO
+
+import httpx
+from langchain_core.messages import HumanMessage
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.runnables import Runnable
+
+from chatbot.backends import create_chat_model, embedding_id
+from chatbot.chat import create_chain
+from chatbot.embeddings import PrimedEmbeddings, get_embeddings
+from chatbot.manifest import chunk_id
+from chatbot.memory import EMBEDDING_CACHE, get_retriever
+from chatbot.settings import (
+    AskSettings,
+    BackendSettings,
+    ContextSettings,
+    RerankSettings,
+    RetrievalMode,
+    VectorStoreSettings,
+)
+from chatbot.utils import estimate_tokens
+
+logger = logging.getLogger("app_logger")
+
+
+@dataclass
+class Question:
+    """A question of the batch.
+
+    Attributes
+    ----------
+    id : str
+        The id of the question, copied to its answer.
+    question : str
+        The text of the question.
+    error : str
+        Why the line of the question could not be read, empty if it was.
+
+    """
+
+    id: str
+    question: str
+    error: str = ""
+
+
+def read_questions(lines: Iterable[str]) -> Iterator[Question]:
+    """Parse the questions of a JSONL batch.
+
+    Every line is a JSON object with the ``question`` and optionally its
+    ``id``, the line number by default. Blank lines are skipped, and a line
+    that is not a JSON object with a question is yielded with its error, so
+    that it is answered with the error instead of stopping the batch.
+
+    """
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            data = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield Question(str(number), "", f"Line {number} is not valid JSON: {e}.")
+            continue
+        question = data.get("question") if isinstance(data, dict) else None
+        if not isinstance(question, str) or not question.strip():
+            id_ = data.get("id", number) if isinstance(data, dict) else number
+            yield Question(str(id_), "", f"Line {number} has no question.")
+            continue
+        yield Question(str(data.get("id", number)), question)
+
+
+class BatchAsker:
+    """Answer the questions of a batch, a bounded number at a time.
+
+    The questions are read lazily, and the questions of every batch are
+    embedded with a single request before they are retrieved. The answers are
+    written as JSONL in the order they complete, each with the ids of the
+    retrieved chunks and the time spent retrieving and generating.
+
+    Parameters
+    ----------
+    chain : Runnable
+        The chain answering the messages with the context, see
+        :func:`chatbot.chat.create_chain`.
+    retriever : BaseRetriever
+        The retriever of the context.
+    settings : AskSettings
+        The concurrency and the size of the embedding batches.
+    embeddings : PrimedEmbeddings | None
+        The embeddings of the retriever, primed with every batch. ``None``
+        when the retriever makes no embedding call.
+
+    """
+
+    def __init__(
+        self,
+        chain: Runnable[dict[str, Any], str],
+        retriever: BaseRetriever,
+        settings: AskSettings,
+        embeddings: PrimedEmbeddings | None = None,
+    ) -> None:
+        self.chain = chain
+        self.retriever = retriever
+        self.settings = settings
+        self.embeddings = embeddings
+        self.answered = 0
+        self.failed = 0
+
+    async def _answer(self, question: Question) -> dict[str, Any]:
+        record: dict[str, Any] = {"id": question.id, "question": question.question}
+        if question.error:
+            logger.warning(
+                "Could not read the question %s: %s",
+                question.id,
+                question.error,
+            )
+            self.failed += 1
+            record["error"] = question.error
+            return record
+        start = time.perf_counter()
+        try:
+            context = await self.retriever.ainvoke(question.question)
+            retrieved = time.perf_counter()
+            answer = await self.chain.ainvoke(
+                {
+                    "context": context,
+                    "messages": [HumanMessage(content=question.question)],
+                },
+            )
+        except Exception as e:  # noqa: BLE001
+            logger.warning("Could not answer the question %s: %s", question.id, e)
+            self.failed += 1
+            record["error"] = str(e)
+            return record
+
+        end = time.perf_counter()
+        self.answered += 1
+        record.update(
+            answer=answer,
+            chunks=[chunk_id(doc) for doc in context],
+            context_tokens=sum(estimate_tokens(doc.page_content) for doc in context),
+            timings={
+                "retrieve_ms": round(1000 * (retrieved - start), 1),
+                "generate_ms": round(1000 * (end - retrieved), 1),
+            },
+        )
+        return record
+
+    async def run(self, questions: Iterable[Question], output: TextIO) -> None:
+        """Answer the questions, writing every answer as soon as it is ready."""
+        slots = asyncio.Semaphore(self.settings.concurrency)
+        tasks: set[asyncio.Task[None]] = set()
+
+        async def answer(question: Question) -> None:
+            try:
+                record = await self._answer(question)
+                output.write(json.dumps(record, ensure_ascii=False) + "\n")
+                output.flush()
+            finally:
+                slots.release()
+
+        remaining = iter(questions)
+        while batch := list(itertools.islice(remaining, self.settings.batch_size)):
+            if self.embeddings is not None:
+                texts = [question.question for question in batch if not question.error]
+                try:
+                    await asyncio.to_thread(self.embeddings.prime, texts)
+                except Exception as e:  # noqa: BLE001
+                    # every question is embedded on its own instead
+                    logger.warning("Could not embed the batch: %s", e)
+            for question in batch:
+                await slots.acquire()
+                task = asyncio.create_task(answer(question))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        await asyncio.gather(*tasks)
+
+
+def ask_batch(  # noqa: PLR0913
+    model: str,
+    embedding: str,
+    temperature: float,
+    sys_prompt: str,
+    api_key: str,
+    source: Path,
+    output: TextIO,
+    embedding_cache_size: int = 0,
+    settings: AskSettings | None = None,
+    retrieval: RetrievalMode = "hybrid",
+    store: VectorStoreSettings | None = None,
+    context: ContextSettings | None = None,
+    collections: list[str] | None = None,
+    backends: BackendSettings | None = None,
+    rerank: RerankSettings | None = None,
+) -> BatchAsker:
+    """Answer the questions of a JSONL file, writing the answers to ``output``.
+
+    Returns
+    -------
+    BatchAsker
+        The asker, with the number of answered and failed questions.
+
+    """
+    if settings is None:
+        settings = AskSettings()
+    limits = httpx.Limits(
+        max_connections=settings.concurrency,
+        max_keepalive_connections=settings.concurrency,
+    )
+    llm_client = httpx.AsyncClient(limits=limits)
+    embedding_client = httpx.Client(limits=limits)
+    llm = create_chat_model(
+        model,
+        temperature,
+        api_key,
+        backends,
+        http_async_client=llm_client,
+    )
+    embeddings = PrimedEmbeddings(
+        get_embeddings(
+            embedding,
+            api_key,
+            EMBEDDING_CACHE,
+            embedding_cache_size,
+            embedding_client,
+            backends,
+        ),
+    )
+    retriever = get_retriever(
+        embeddings,
+        retrieval,
+        store=store,
+        context=context,
+        collections=collections,
+        model=embedding_id(embedding, backends),
+        rerank=rerank,
+    )
+    asker = BatchAsker(
+        create_chain(llm, sys_prompt),
+        retriever,
+        settings,
+        embeddings if retrieval != "lexical" else None,
+    )
+
+    async def main() -> None:
+        try:
+            with source.open() as lines:
+                await asker.run(read_questions(lines), output)
+        finally:
+            await llm_client.aclose()
+            embedding_client.close()
+
+    asyncio.run(main())
+    return asker
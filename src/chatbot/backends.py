@@ -0,0 +1,268 @@
+"""Registry of the backends of the embedding and chat models.
+
+A backend is a factory registered under a name, with the model it uses when
+none is configured. The configuration selects the backend. The "openai"
+backends call the OpenAI api, the "local" ones run the embedding model in
+process and send the chat requests to an OpenAI compatible server, e.g.
+Ollama or llama.cpp, so no request leaves the machine.
+
+The registry is light to import, so the CLI lists the backends without
+loading the clients of the models, which the factories import.
+"""
+
+from collections.abc import Callable
+from typing import TYPE_CHECKING, Any, TypeVar
+
+from chatbot.settings import BackendSettings
+
+if TYPE_CHECKING:
+    import httpx
+    from langchain_core.embeddings import Embeddings
+    from langchain_core.language_models import BaseChatModel
+
+    EmbeddingFactory = Callable[
+        [str, str, BackendSettings, httpx.Client | None],
+        Embeddings,
+    ]
+    ChatFactory = Callable[
+        [
+            str,
+            float,
+            str,
+            BackendSettings,
+            httpx.Client | None,
+            httpx.AsyncClient | None,
+        ],
+        BaseChatModel,
+    ]
+
+EMBEDDING_BACKENDS: dict[str, "EmbeddingFactory"] = {}
+CHAT_BACKENDS: dict[str, "ChatFactory"] = {}
+# The model of every backend when none is configured.
+EMBEDDING_MODELS: dict[str, str] = {}
+CHAT_MODELS: dict[str, str] = {}
+
+_Factory = TypeVar("_Factory", bound=Callable[..., Any])
+
+
+def register_embeddings(
+    name: str,
+    default_model: str,
+) -> Callable[[_Factory], _Factory]:
+    """Register a factory of embedding models under a backend name.
+
+    The factory takes the model name, the api key, the backend settings and
+    the http client, and returns the embeddings. ``default_model`` is used
+    when no model is configured.
+    """
+
+    def register(factory: _Factory) -> _Factory:
+        EMBEDDING_BACKENDS[name] = factory
+        EMBEDDING_MODELS[name] = default_model
+        return factory
+
+    return register
+
+
+def register_chat(name: str, default_model: str) -> Callable[[_Factory], _Factory]:
+    """Register a factory of chat models under a backend name.
+
+    The factory takes the model name, the temperature, the api key, the
+    backend settings and the sync and async http clients, and returns the
+    chat model. ``default_model`` is used when no model is configured.
+    """
+
+    def register(factory: _Factory) -> _Factory:
+        CHAT_BACKENDS[name] = factory
+        CHAT_MODELS[name] = default_model
+        return factory
+
+    return register
+
+
+def _backend(registry: dict[str, Any], kind: str, name: str) -> Any:
+    if name not in registry:
+        msg = f"Unknown {kind} backend: {name}, use one of {', '.join(registry)}."
+        raise ValueError(msg)
+    return registry[name]
+
+
+def embedding_model(model: str, settings: BackendSettings | None = None) -> str:
+    """Get the embedding model, the default of the backend if ``model`` is empty.
+
+    Raises
+    ------
+    ValueError
+        If the backend is not registered.
+
+    """
+    backend = settings.embedding_backend if settings is not None else "openai"
+    _backend(EMBEDDING_BACKENDS, "embedding", backend)
+    return model or EMBEDDING_MODELS[backend]
+
+
+def chat_model(model: str, settings: BackendSettings | None = None) -> str:
+    """Get the chat model, the default of the backend if ``model`` is empty.
+
+    Raises
+    ------
+    ValueError
+        If the backend is not registered.
+
+    """
+    backend = settings.chat_backend if settings is not None else "openai"
+    _backend(CHAT_BACKENDS, "chat", backend)
+    return model or CHAT_MODELS[backend]
+
+
+def embedding_id(model: str, settings: BackendSettings | None = None) -> str:
+    """Identify an embedding model, the OpenAI models by their bare name."""
+    backend = settings.embedding_backend if settings is not None else "openai"
+    model = embedding_model(model, settings)
+    return model if backend == "openai" else f"{backend}:{model}"
+
+
+def create_embeddings(
+    model: str,
+    api_key: str,
+    settings: BackendSettings | None = None,
+    http_client: "httpx.Client | None" = None,
+) -> "Embeddings":
+    """Create the embedding model with the configured backend.
+
+    Raises
+    ------
+    ValueError
+        If the backend is not registered.
+
+    """
+    if settings is None:
+        settings = BackendSettings()
+    factory = _backend(EMBEDDING_BACKENDS, "embedding", settings.embedding_backend)
+    embeddings: Embeddings = factory(
+        embedding_model(model, settings),
+        api_key,
+        settings,
+        http_client,
+    )
+    return embeddings
+
+
+def create_chat_model(
+    model: str,
+    temperature: float,
+    api_key: str,
+    settings: BackendSettings | None = None,
+    http_client: "httpx.Client | None" = None,
+    http_async_client: "httpx.AsyncClient | None" = None,
+) -> "BaseChatModel":
+    """Create the chat model with the configured backend.
+
+    Raises
+    ------
+    ValueError
+        If the backend is not registered.
+
+    """
+    if settings is None:
+        settings = BackendSettings()
+    factory = _backend(CHAT_BACKENDS, "chat", settings.chat_backend)
+    llm: BaseChatModel = factory(
+        chat_model(model, settings),
+        temperature,
+        api_key,
+        settings,
+        http_client,
+        http_async_client,
+    )
+    return llm
+
+
+@register_embeddings("openai", "text-embedding-3-large")
+def _openai_embeddings(
+    model: str,
+    api_key: str,
+    settings: BackendSettings,
+    http_client: "httpx.Client | None",
+) -> "Embeddings":
+    from langchain_openai import OpenAIEmbeddings
+
+    return OpenAIEmbeddings(
+        model=model,
+        api_key=api_key,  # type: ignore
+        http_client=http_client,
+    )
+
+
+@register_embeddings("local", "sentence-transformers/all-MiniLM-L6-v2")
+def _local_embeddings(
+    model: str,
+    api_key: str,
+    settings: BackendSettings,
+    http_client: "httpx.Client | None",
+) -> "Embeddings":
+    from chatbot.embeddings import LocalEmbeddings
+
+    return LocalEmbeddings(model, settings.device, settings.batch_size)
+
+
+@register_chat("openai", "gpt-4-turbo")
+def _openai_chat(
+    model: str,
+    temperature: float,
+    api_key: str,
+    settings: BackendSettings,
+    http_client: "httpx.Client | None",
+    http_async_client: "httpx.AsyncClient | None",
+) -> "BaseChatModel":
+    from langchain_openai import ChatOpenAI
+
+    return ChatOpenAI(
+        model=model,
+        temperature=temperature,
+        api_key=api_key,  # type: ignore
+        http_client=http_client,
+        http_async_client=http_async_client,
+    )
+
+
+@register_chat("local", "llama3")
+def _local_chat(
+    model: str,
+    temperature: float,
+    api_key: str,
+    settings: BackendSettings,
+    http_client: "httpx.Client | None",
+    http_async_client: "httpx.AsyncClient | None",
+) -> "BaseChatModel":
+    from langchain_openai import ChatOpenAI
+
+    return ChatOpenAI(
+        model=model,
+        temperature=temperature,
+        # local servers ignore the key, but the client requires one
+        api_key=api_key or "local",  # type: ignore
+        base_url=settings.chat_base_url,
+        http_client=http_client,
+        http_async_client=http_async_client,
+    )
+
+
+def import_sentence_transformers(feature: str) -> Any:
+    """Import sentence-transformers, the optional dependency of ``feature``.
+
+    Raises
+    ------
+    ImportError
+        If sentence-transformers is not installed.
+
+    """
+    try:
+        import sentence_transformers  # type: ignore[import-not-found]
+    except ImportError:
+        msg = (
+            f"The {feature} needs sentence-transformers, "
+            "install it with: pip install sentence-transformers"
+        )
+        raise ImportError(msg) from None
+    return sentence_transformers
@@ -0,0 +1,238 @@
+"""Batched, rate limited embedding of the chunks stored in the memory."""
+
+import json
+import logging
+import random
+import threading
+import time
+from collections.abc import Callable, Iterable, Iterator, Mapping
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Any, TextIO
+
+import numpy as np
+import openai
+from chromadb.api.models.Collection import Collection
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from chatbot import profiling
+from chatbot.settings import BatchSettings
+from chatbot.utils import estimate_tokens
+from chatbot.vectorstore import CompactVectorStore
+
+logger = logging.getLogger("app_logger")
+
+MAX_RETRIES = 6
+
+Batch = list[tuple[str, Document]]
+
+# Where the vectors are upserted, the compact store upserts like a collection.
+VectorSink = Collection | CompactVectorStore
+
+
+class TokenBucket:
+    """A thread-safe token bucket rate limiter.
+
+    Parameters
+    ----------
+    rate : float
+        The tokens added to the bucket every second.
+    capacity : int
+        The maximum number of tokens in the bucket.
+
+    """
+
+    def __init__(self, rate: float, capacity: int) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: int) -> None:
+        """Block until ``tokens`` tokens are available and take them."""
+        tokens = min(tokens, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity,
+                    self._tokens + (now - self._last) * self.rate,
+                )
+                self._last = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                delay = (tokens - self._tokens) / self.rate
+            time.sleep(delay)
+
+
+def token_batches(
+    chunks: Iterable[tuple[str, Document]],
+    settings: BatchSettings,
+) -> Iterator[Batch]:
+    """Group the chunks in batches bounded by size and number of tokens."""
+    batch: Batch = []
+    tokens = 0
+    for id_, chunk in chunks:
+        chunk_tokens = estimate_tokens(chunk.page_content)
+        if batch and (
+            len(batch) >= settings.batch_size
+            or tokens + chunk_tokens > settings.batch_tokens
+        ):
+            yield batch
+            batch, tokens = [], 0
+        batch.append((id_, chunk))
+        tokens += chunk_tokens
+    if batch:
+        yield batch
+
+
+def _embed_batch(
+    model: Embeddings,
+    batch: Batch,
+    limiter: TokenBucket | None,
+) -> list[list[float]]:
+    texts = [chunk.page_content for _, chunk in batch]
+    if limiter is not None:
+        with profiling.span("rate_limit"):
+            limiter.acquire(sum(estimate_tokens(text) for text in texts))
+
+    for attempt in range(MAX_RETRIES - 1):
+        try:
+            return model.embed_documents(texts)
+        # the timeouts are connection errors too
+        except (openai.RateLimitError, openai.APIConnectionError) as e:
+            delay = min(60, 2**attempt) + random.random()  # noqa: S311
+            logger.warning("%s, retrying in %.1f seconds.", e, delay)
+            time.sleep(delay)
+    return model.embed_documents(texts)
+
+
+def _store_completed(
+    sink: VectorSink,
+    running: dict[Future[list[list[float]]], Batch],
+    log: TextIO,
+    on_stored: Callable[[Batch], None] | None,
+) -> int:
+    completed, _ = wait(running, return_when=FIRST_COMPLETED)
+    stored = 0
+    for future in completed:
+        batch = running.pop(future)
+        ids = [id_ for id_, _ in batch]
+        with profiling.span("upsert", chunks=len(batch)):
+            sink.upsert(
+                ids=ids,
+                embeddings=np.asarray(future.result()),
+                metadatas=[chunk.metadata for _, chunk in batch],
+                documents=[chunk.page_content for _, chunk in batch],
+            )
+        # a chunk is checkpointed once everything about it is stored
+        if on_stored is not None:
+            on_stored(batch)
+        log.write(json.dumps(ids) + "\n")
+        log.flush()
+        stored += len(batch)
+    return stored
+
+
+def load_checkpoint(path: Path) -> set[str]:
+    """Load the ids of the chunks already stored by an interrupted ingest."""
+    if not path.exists():
+        return set()
+    with path.open() as f:
+        lines = (json.loads(line) for line in f)
+        return {id_ for ids in lines if isinstance(ids, list) for id_ in ids}
+
+
+def checkpoint_params(path: Path) -> dict[str, Any]:
+    """Load the parameters an interrupted ingest was started with.
+
+    Returns
+    -------
+    dict[str, Any]
+        The parameters, empty if there is no checkpoint or it has none.
+
+    """
+    if not path.exists():
+        return {}
+    with path.open() as f:
+        first = f.readline()
+    params = json.loads(first) if first else None
+    return params if isinstance(params, dict) else {}
+
+
+def embed_and_store(  # noqa: PLR0913
+    sink: VectorSink,
+    model: Embeddings,
+    chunks: Mapping[str, Document] | Iterable[tuple[str, Document]],
+    settings: BatchSettings,
+    checkpoint: Path,
+    on_stored: Callable[[Batch], None] | None = None,
+    params: Mapping[str, Any] | None = None,
+) -> int:
+    """Embed the chunks in batches and upsert them in the database.
+
+    Batches are embedded by ``settings.concurrency`` threads, while the upserts
+    happen in the calling thread. The ids of every stored batch are appended to
+    the ``checkpoint`` file, and the chunks listed there are skipped, so an
+    interrupted ingest resumes where it stopped. The ``params`` the chunks
+    were made with are written first, see :func:`checkpoint_params`.
+
+    The chunks are consumed lazily, at most ``settings.concurrency`` batches
+    ahead of the upserts.
+
+    Parameters
+    ----------
+    sink : VectorSink
+        Where the vectors are upserted.
+    model : Embeddings
+        The embedding model.
+    chunks : Mapping[str, Document] | Iterable[tuple[str, Document]]
+        The chunks to store, by id, or the pairs of id and chunk.
+    settings : BatchSettings
+        The batching settings.
+    checkpoint : Path
+        The checkpoint file.
+    on_stored : Callable[[Batch], None] | None
+        Called with every batch once it is upserted, before it is added to
+        the checkpoint.
+    params : Mapping[str, Any] | None
+        The parameters of the chunks, written to a new checkpoint.
+
+    Returns
+    -------
+    int
+        The number of chunks embedded.
+
+    """
+    done = load_checkpoint(checkpoint)
+    pairs = chunks.items() if isinstance(chunks, Mapping) else chunks
+    pending = ((id_, chunk) for id_, chunk in pairs if id_ not in done)
+    if done:
+        logger.info("Resuming ingest, %d chunks already stored.", len(done))
+
+    limiter = None
+    if settings.tokens_per_minute > 0:
+        limiter = TokenBucket(
+            settings.tokens_per_minute / 60,
+            max(settings.tokens_per_minute, settings.batch_tokens),
+        )
+
+    stored = 0
+    checkpoint.parent.mkdir(parents=True, exist_ok=True)
+    with ThreadPoolExecutor(settings.concurrency) as pool, checkpoint.open("a") as log:
+        if params is not None and log.tell() == 0:
+            log.write(json.dumps(dict(params)) + "\n")
+        running: dict[Future[list[list[float]]], Batch] = {}
+        for batch in token_batches(pending, settings):
+            if len(running) >= settings.concurrency:
+                stored += _store_completed(sink, running, log, on_stored)
+                logger.debug("Stored %d chunks.", stored)
+            running[pool.submit(_embed_batch, model, batch, limiter)] = batch
+        while running:
+            stored += _store_completed(sink, running, log, on_stored)
+            logger.debug("Stored %d chunks.", stored)
+
+    return stored
@@ -1,93 +1,502 @@
 """Play with chatbot main loop."""
 
+import asyncio
+import logging
 import os
+import signal
+import threading
+import time
+from collections.abc import Coroutine
 from typing import Any
 
+import httpx
 from langchain.chains.combine_documents import create_stuff_documents_chain
-from langchain.memory import ChatMessageHistory
 from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.documents import Document
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import BaseMessage
 from langchain_core.output_parsers import StrOutputParser
+from langchain_core.retrievers import BaseRetriever
 from langchain_core.runnables import RunnableSerializable
-from langchain_core.vectorstores import VectorStoreRetriever
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 from rich.console import Console
+from rich.live import Live
 from rich.markdown import Markdown
 from rich.prompt import Prompt
 
-from chatbot.memory import get_memory, load_chat_messages, save_chat_messages
+from chatbot import profiling
+from chatbot.answer_cache import AnswerCache
+from chatbot.backends import create_chat_model, embedding_id
+from chatbot.context import CompressedRetriever
+from chatbot.embeddings import CachedEmbeddings, PrimedEmbeddings, get_embeddings
+from chatbot.history import (
+    HistoryWindow,
+    create_summarizer,
+    load_history,
+)
+from chatbot.memory import (
+    ANSWER_CACHE,
+    EMBEDDING_CACHE,
+    get_retriever,
+    index_version,
+    load_chat_summary,
+    open_chat_log,
+    save_chat_summary,
+)
+from chatbot.settings import (
+    AnswerCacheSettings,
+    BackendSettings,
+    ContextSettings,
+    HistorySettings,
+    RerankSettings,
+    RetrievalMode,
+    VectorStoreSettings,
+)
+from chatbot.utils import estimate_tokens
 
+# How often the markdown of a streamed answer is rendered again.
+REFRESH_INTERVAL = 0.1
 
-def main_loop(
+# The query retrieved at the start of a session, to load the index.
+WARM_UP_QUERY = "Computational Sonology"
+
+OPENAI_API = "https://api.openai.com/v1"
+
+logger = logging.getLogger("app_logger")
+
+
+def create_chain(
+    llm: BaseChatModel,
+    sys_prompt: str,
+) -> RunnableSerializable[dict[str, Any], str]:
+    """Create the chain answering the last message with the retrieved context."""
+    prompt = ChatPromptTemplate.from_messages(
+        [
+            (
+                "system",
+                sys_prompt,
+            ),
+            MessagesPlaceholder(variable_name="messages"),
+        ],
+    )
+    return create_stuff_documents_chain(llm, prompt) | StrOutputParser()
+
+
+def main_loop(  # noqa: PLR0913
     model: str,
     embedding: str,
     temperature: float,
     sys_prompt: str,
     api_key: str,
+    embedding_cache_size: int = 0,
+    stream: bool = True,
+    history_settings: HistorySettings | None = None,
+    answer_cache_settings: AnswerCacheSettings | None = None,
+    retrieval: RetrievalMode = "hybrid",
+    store: VectorStoreSettings | None = None,
+    context: ContextSettings | None = None,
+    collections: list[str] | None = None,
+    backends: BackendSettings | None = None,
+    rerank: RerankSettings | None = None,
 ) -> int:
-    """Chat with the chatbot."""
+    """Chat with the chatbot.
+
+    The questions are answered with the chunks of ``collections``, by default
+    the collection of ``store``, and the models are served by ``backends``,
+    OpenAI by default. With ``rerank`` the retrieved chunks are reranked by a
+    cross-encoder before they are compressed.
+
+    The retriever is warmed up in background while the history is loaded and
+    the first question is typed, so the first answer is as fast as the next.
+    The answers are generated on an event loop, and CTRL+C while answering
+    cancels only the answer: a second CTRL+C, or one at the prompt, ends the
+    session.
+    """
     console = Console()
+    if history_settings is None:
+        history_settings = HistorySettings()
+    collections = collections or [(store or VectorStoreSettings()).collection]
 
-    # create models
-    llm = ChatOpenAI(
-        model=model,
-        temperature=temperature,
-        api_key=api_key,  # type: ignore
+    # create models, sharing the connections to the api
+    http_client = httpx.Client()
+    event_loop = asyncio.new_event_loop()
+    async_client = httpx.AsyncClient()
+    llm = create_chat_model(
+        model,
+        temperature,
+        api_key,
+        backends,
+        http_client,
+        async_client,
     )
-    embeddings = OpenAIEmbeddings(
-        model=embedding,
-        api_key=api_key,  # type: ignore
+    embeddings = get_embeddings(
+        embedding,
+        api_key,
+        EMBEDDING_CACHE,
+        embedding_cache_size,
+        http_client,
+        backends,
     )
-    out_parser = StrOutputParser()
-
-    messages = load_chat_messages()
-    history = ChatMessageHistory(messages=messages)
+    profiled = profiling.profile_embeddings(embeddings)
+    # the question is embedded once, for the answer cache and the retrieval
+    primed = None
+    if answer_cache_settings is not None and retrieval != "lexical":
+        primed = PrimedEmbeddings(profiled)
+    retriever = get_retriever(
+        primed or profiled,
+        retrieval,
+        store=store,
+        context=context,
+        collections=collections,
+        model=embedding_id(embedding, backends),
+        rerank=rerank,
+    )
+    api_base = getattr(llm, "openai_api_base", None) or OPENAI_API
+    # the event loop of the answers warms up in background until the first one
+    warming = threading.Thread(
+        target=event_loop.run_until_complete,
+        args=(warm_up(retriever, async_client, f"{api_base}/models"),),
+        name="warm-up",
+        daemon=True,
+    )
+    warming.start()
 
-    prompt = ChatPromptTemplate.from_messages(
-        [
-            (
-                "system",
-                sys_prompt,
+    summarizer = None
+    if history_settings.summary_model:
+        summarizer = create_summarizer(
+            create_chat_model(
+                history_settings.summary_model,
+                0,
+                api_key,
+                backends,
+                http_client,
             ),
-            MessagesPlaceholder(variable_name="messages"),
-        ],
+        )
+    history = load_history(
+        open_chat_log(),
+        history_settings,
+        summarizer,
+        load_chat_summary(),
     )
 
-    retriever = get_memory(embeddings).as_retriever(k=4)
-    document_chain = create_stuff_documents_chain(llm, prompt) | out_parser
+    answer_cache = None
+    if answer_cache_settings is not None:
+        answer_cache = AnswerCache(
+            ANSWER_CACHE,
+            profiled,
+            answer_cache_settings,
+            index_version(collections),
+        )
+
+    document_chain = create_chain(llm, sys_prompt)
 
-    console.print("[bold]Session started, press CTRL+C to quit.")
+    console.print(
+        "[bold]Session started, press CTRL+C to stop an answer or, at the prompt, "
+        "to quit.",
+    )
     while True:
         try:
-            loop(history, document_chain, retriever, console)
+            loop(
+                history,
+                document_chain,
+                retriever,
+                console,
+                stream=stream,
+                answer_cache=answer_cache,
+                event_loop=event_loop,
+                embeddings=primed,
+                warming=warming,
+            )
         except KeyboardInterrupt:
             console.print("\n[bold]Shutting down... Goodbye!")
+            if isinstance(embeddings, CachedEmbeddings):
+                console.print(embeddings.save_stats())
+            if answer_cache is not None:
+                console.print(answer_cache.report())
+                answer_cache.close()
+            if isinstance(retriever, CompressedRetriever):
+                console.print(retriever.report())
+            http_client.close()
+            warming.join()
+            event_loop.run_until_complete(async_client.aclose())
+            event_loop.close()
             return exit_handler(history)
 
 
-def loop(
-    history: ChatMessageHistory,
+async def warm_up(
+    retriever: BaseRetriever,
+    http_client: httpx.AsyncClient | None = None,
+    url: str = "",
+) -> None:
+    """Prepare the retriever and the connections for the first question.
+
+    A throwaway query opens the vector store, loads its index in memory and
+    connects to the embedding model, while a request to ``url`` opens the
+    connection the language model reuses. It must run on the event loop of
+    the answers, which owns the connections of ``http_client``. Failures are
+    only logged, the first question pays the cost instead.
+    """
+    with profiling.span("warm_up"):
+        await asyncio.gather(
+            _connect(http_client, url),
+            _warm_up_retriever(retriever),
+        )
+
+
+async def _connect(http_client: httpx.AsyncClient | None, url: str) -> None:
+    if http_client is None or not url:
+        return
+    try:
+        await http_client.get(url)
+    except httpx.HTTPError as e:
+        logger.debug("Could not connect to %s: %s", url, e)
+
+
+async def _warm_up_retriever(retriever: BaseRetriever) -> None:
+    try:
+        await retriever.ainvoke(WARM_UP_QUERY)
+    except Exception as e:  # noqa: BLE001
+        logger.debug("Could not warm up the retriever: %s", e)
+
+
+def retrieve(retriever: BaseRetriever, question: str) -> list[Document]:
+    """Retrieve the context of a question, timing the retrieval."""
+    with profiling.span("retrieve") as attrs:
+        context = retriever.invoke(question)
+        attrs["chunks"] = len(context)
+        attrs["context_tokens"] = sum(
+            estimate_tokens(doc.page_content) for doc in context
+        )
+    return context
+
+
+async def aretrieve(retriever: BaseRetriever, question: str) -> list[Document]:
+    """Retrieve the context of a question asynchronously, see :func:`retrieve`."""
+    with profiling.span("retrieve") as attrs:
+        context = await retriever.ainvoke(question)
+        attrs["chunks"] = len(context)
+        attrs["context_tokens"] = sum(
+            estimate_tokens(doc.page_content) for doc in context
+        )
+    return context
+
+
+async def _retrieve_primed(
+    retriever: BaseRetriever,
+    question: str,
+    embeddings: PrimedEmbeddings | None,
+) -> tuple[list[Document], list[float] | None]:
+    vector = None
+    if embeddings is not None:
+        vector = await asyncio.to_thread(embeddings.prime_query, question)
+    return await aretrieve(retriever, question), vector
+
+
+def run_cancellable(
+    event_loop: asyncio.AbstractEventLoop,
+    coro: Coroutine[Any, Any, None],
+) -> bool:
+    """Run a coroutine on the event loop until it completes or CTRL+C is pressed.
+
+    The first CTRL+C cancels the coroutine, the next one raises
+    ``KeyboardInterrupt`` as usual. Where the event loop cannot handle the
+    signals, e.g. on Windows, CTRL+C always raises ``KeyboardInterrupt``.
+
+    Returns
+    -------
+    bool
+        False if the coroutine was cancelled.
+
+    """
+    task = event_loop.create_task(coro)
+
+    def cancel() -> None:
+        event_loop.remove_signal_handler(signal.SIGINT)
+        task.cancel()
+
+    try:
+        event_loop.add_signal_handler(signal.SIGINT, cancel)
+        handled = True
+    except (NotImplementedError, RuntimeError):
+        handled = False
+    try:
+        event_loop.run_until_complete(task)
+    except asyncio.CancelledError:
+        return False
+    except KeyboardInterrupt:
+        task.cancel()
+        event_loop.run_until_complete(asyncio.wait([task]))
+        raise
+    finally:
+        if handled:
+            event_loop.remove_signal_handler(signal.SIGINT)
+    return True
+
+
+def loop(  # noqa: PLR0913
+    history: HistoryWindow,
     chain: RunnableSerializable[Any, Any],
-    retriever: VectorStoreRetriever,
+    retriever: BaseRetriever,
     console: Console,
+    *,
+    stream: bool = False,
+    answer_cache: AnswerCache | None = None,
+    event_loop: asyncio.AbstractEventLoop | None = None,
+    embeddings: PrimedEmbeddings | None = None,
+    warming: threading.Thread | None = None,
 ) -> None:
-    """Chatbot loop."""
+    """Chatbot loop.
+
+    The question is answered on ``event_loop``, a new one when it is not given,
+    once the ``warming`` thread is done running it. With an ``answer_cache``,
+    the question is embedded once by ``embeddings``, the embeddings of the
+    retriever, and its vector is reused by the cache.
+    """
     question = Prompt.ask("\n[bold cyan]>>> You")
+    if warming is not None:
+        warming.join()
 
-    history.add_user_message(question)
+    profiler = profiling.active()
+    mark = profiler.mark() if profiler is not None else 0
+    own_loop = event_loop is None
+    if event_loop is None:
+        event_loop = asyncio.new_event_loop()
+    try:
+        with profiling.span("turn", question_tokens=estimate_tokens(question)):
+            answered = run_cancellable(
+                event_loop,
+                answer(
+                    history,
+                    chain,
+                    retriever,
+                    console,
+                    question,
+                    stream=stream,
+                    answer_cache=answer_cache,
+                    embeddings=embeddings,
+                ),
+            )
+    finally:
+        if own_loop:
+            event_loop.close()
+    if not answered:
+        console.print("\n[bold]Answer cancelled.")
+    if profiler is not None:
+        profiler.report(console, mark, title="Turn breakdown")
+
+
+async def answer(  # noqa: PLR0913
+    history: HistoryWindow,
+    chain: RunnableSerializable[Any, Any],
+    retriever: BaseRetriever,
+    console: Console,
+    question: str,
+    *,
+    stream: bool = False,
+    answer_cache: AnswerCache | None = None,
+    embeddings: PrimedEmbeddings | None = None,
+) -> None:
+    """Answer a question, adding the turn to the history.
+
+    The context is retrieved while the question is logged and the history
+    window is assembled, and the answer is logged after it is shown. If the
+    answer is cancelled, only the question is kept in the history.
+    """
     with console.status("[bold green]Generating answer..."):
-        response = chain.invoke(
-            {
-                "context": retriever.invoke(question),
-                "messages": history.messages,
-            },
+        (context, vector), _ = await asyncio.gather(
+            _retrieve_primed(retriever, question, embeddings),
+            asyncio.to_thread(history.add_user_message, question),
+        )
+        messages = history.messages
+        response = None
+        if answer_cache is not None:
+            with profiling.span("answer_cache") as attrs:
+                if vector is None:
+                    vector = await answer_cache.embeddings.aembed_query(question)
+                response = await asyncio.to_thread(
+                    answer_cache.lookup,
+                    question,
+                    context,
+                    vector,
+                )
+                attrs["hit"] = response is not None
+
+    if response is not None:
+        console.print(Markdown(response))
+        await asyncio.to_thread(history.add_ai_message, response)
+        return
+
+    with profiling.span("generate", stream=stream):
+        if stream:
+            response = await stream_answer(messages, chain, context, console)
+        else:
+            with console.status("[bold green]Generating answer..."):
+                response = await chain.ainvoke(
+                    {
+                        "context": context,
+                        "messages": messages,
+                    },
+                    config={"callbacks": profiling.callbacks()},
+                )
+                md = Markdown(response)
+            console.print(md)
+
+    await asyncio.to_thread(history.add_ai_message, response)
+    if answer_cache is not None:
+        await asyncio.to_thread(
+            answer_cache.store,
+            question,
+            context,
+            response,
+            vector,
         )
-        history.add_ai_message(response)
-        md = Markdown(response)
+    history.summarize()
+
+
+async def stream_answer(
+    messages: list[BaseMessage],
+    chain: RunnableSerializable[Any, Any],
+    context: list[Document],
+    console: Console,
+) -> str:
+    """Render the answer progressively, while the model generates it.
+
+    Returns
+    -------
+    str
+        The complete answer.
+
+    """
+    start = time.perf_counter()
+    tokens = chain.astream(
+        {
+            "context": context,
+            "messages": messages,
+        },
+        config={"callbacks": profiling.callbacks()},
+    )
+    with console.status("[bold green]Generating answer..."):
+        response = await anext(tokens, "")
+    logger.debug("Time to first token: %.3f s.", time.perf_counter() - start)
+
+    with Live(
+        Markdown(response),
+        console=console,
+        vertical_overflow="visible",
+    ) as live:
+        rendered = time.monotonic()
+        async for token in tokens:
+            response += token
+            # parsing the markdown at every token is quadratic in its length
+            if time.monotonic() - rendered >= REFRESH_INTERVAL:
+                live.update(Markdown(response))
+                rendered = time.monotonic()
+        live.update(Markdown(response))
 
-    console.print(md)
+    return response
 
 
-def exit_handler(history: ChatMessageHistory) -> int:
-    """Save chat history on exit."""
-    save_chat_messages(history.messages)
+def exit_handler(history: HistoryWindow) -> int:
+    """Save the history summary on exit, messages are saved as they come."""
+    history.close()
+    save_chat_summary(history.summary, history.offset + history.summarized)
     return os.EX_OK
@@ -2,23 +2,52 @@
 
 import logging
 from pathlib import Path
-from typing import Annotated
+from typing import Annotated, Any, TextIO
 
 import click
 import click_extra
 from rich.console import Console
 from rich.prompt import Confirm, Prompt
 
-from chatbot.chat import main_loop
+from chatbot.backends import CHAT_BACKENDS, EMBEDDING_BACKENDS, embedding_model
 from chatbot.cli import __app_name__
 from chatbot.cli.constants import HEADER, LICENSE
 from chatbot.cli.custom_decorators import docstring_decorator
-from chatbot.config import create_default, load_config, set_config_value
-from chatbot.memory import create_memory
-from chatbot.utils import flatten_dict
+from chatbot.config import (
+    DEFAULT_CONFIG,
+    create_default,
+    load_chat_config,
+    load_config,
+    set_config_value,
+)
+from chatbot.settings import (
+    EMBEDDING_CACHE_SIZE,
+    AnswerCacheSettings,
+    AskSettings,
+    BackendSettings,
+    BatchSettings,
+    ContextSettings,
+    FetchSettings,
+    HistorySettings,
+    LengthUnit,
+    RerankSettings,
+    RetrievalMode,
+    ServeSettings,
+    VectorBackend,
+    VectorDtype,
+    VectorStoreSettings,
+)
+from chatbot.utils import flatten_dict, split_names
+
+# The commands import langchain, chroma and openai when they run, since
+# loading them takes seconds and most commands do not need them.
 
 APP_DIR = Path(click.get_app_dir(__app_name__))
 
+_DEFAULTS = DEFAULT_CONFIG["chatbot"]
+_CHAT_DEFAULTS = _DEFAULTS["chat"]
+_INGEST_DEFAULTS = _DEFAULTS["ingest"]
+
 
 @click.group(
     context_settings={"show_default": True},
@@ -29,20 +58,113 @@ APP_DIR = Path(click.get_app_dir(__app_name__))
 @click.option(
     "-e",
     "--embedding",
-    help="The model used to encode and retrieve embeddings.",
+    help="The model used to encode and retrieve embeddings, empty for the "
+    "default of the embedding backend.",
+    default=_DEFAULTS["embedding"],
 )
 @click.option(
     "-api",
     "--openai-api-key",
     help="The OpenAI api key.",
 )
+@click.option(
+    "--embedding-cache-size",
+    help="The maximum number of embeddings cached on disk, 0 disables the cache.",
+    type=click.IntRange(min=0),
+    default=EMBEDDING_CACHE_SIZE,
+    metavar="<int>",
+)
+@click.option(
+    "--vector-store",
+    help="Where the vectors are stored, compact for memory mapped NumPy files.",
+    type=click.Choice(["chroma", "compact"]),
+    default=VectorStoreSettings.backend,
+)
+@click.option(
+    "--vector-dtype",
+    help="The type of the vectors in a new compact store.",
+    type=click.Choice(["float32", "float16", "int8"]),
+    default=VectorStoreSettings.dtype,
+)
+@click.option(
+    "--vector-dimensions",
+    help="The leading dimensions kept in a new compact store, 0 for all.",
+    type=click.IntRange(min=0),
+    default=VectorStoreSettings.dimensions,
+    metavar="<int>",
+)
+@click.option(
+    "--collection",
+    help="The collection of the memory that is ingested, converted or chatted with.",
+    default=VectorStoreSettings.collection,
+    metavar="<name>",
+)
+@click.option(
+    "--max-open-collections",
+    help="The maximum number of collections kept open while chatting or serving.",
+    type=click.IntRange(min=1),
+    default=VectorStoreSettings.max_open,
+    metavar="<int>",
+)
+@click.option(
+    "--embedding-backend",
+    help="Who computes the embeddings, local for a sentence-transformers model.",
+    type=click.Choice(list(EMBEDDING_BACKENDS)),
+    default=BackendSettings.embedding_backend,
+)
+@click.option(
+    "--chat-backend",
+    help="Who answers, local for an OpenAI compatible server at --chat-base-url.",
+    type=click.Choice(list(CHAT_BACKENDS)),
+    default=BackendSettings.chat_backend,
+)
+@click.option(
+    "--chat-base-url",
+    help="The url of the api of the local chat server.",
+    default=BackendSettings.chat_base_url,
+    metavar="<url>",
+)
+@click.option(
+    "--device",
+    help="The device running the local embedding model, e.g. cpu or cuda.",
+    default=BackendSettings.device,
+)
 @click_extra.verbosity_option
 @click_extra.config_option
 @click.pass_context
-def chatbot(ctx: click.Context, embedding: str, openai_api_key: str) -> None:
+def chatbot(  # noqa: PLR0913
+    ctx: click.Context,
+    embedding: str,
+    openai_api_key: str,
+    embedding_cache_size: int,
+    vector_store: VectorBackend,
+    vector_dtype: VectorDtype,
+    vector_dimensions: int,
+    collection: str,
+    max_open_collections: int,
+    embedding_backend: str,
+    chat_backend: str,
+    chat_base_url: str,
+    device: str,
+) -> None:
     """Manage the chatbot with memories."""
     ctx.ensure_object(dict)
-    ctx.obj["embedding"] = embedding
+    backends = BackendSettings(
+        embedding_backend,
+        chat_backend,
+        chat_base_url,
+        device,
+    )
+    ctx.obj["embedding"] = embedding_model(embedding, backends)
+    ctx.obj["embedding_cache_size"] = embedding_cache_size
+    ctx.obj["vector_store"] = VectorStoreSettings(
+        vector_store,
+        vector_dtype,
+        vector_dimensions,
+        collection,
+        max_open_collections,
+    )
+    ctx.obj["backends"] = backends
 
     logger = logging.getLogger("app_logger")
     logger.debug("API_KEY: %s", openai_api_key)
@@ -52,7 +174,8 @@ def chatbot(ctx: click.Context, embedding: str, openai_api_key: str) -> None:
         create_default(APP_DIR)
         logger.info("Configuration file created at %s/config.toml.", APP_DIR)
 
-    if openai_api_key == "":
+    # the local backends need no key
+    if openai_api_key == "" and "openai" in (embedding_backend, chat_backend):
         openai_api_key = Prompt.ask("Insert OpenAI API key")
         if openai_api_key == "":
             logger.critical("OpenAI API key is has not been set correctly.")
@@ -67,7 +190,12 @@ def chatbot(ctx: click.Context, embedding: str, openai_api_key: str) -> None:
 
 @chatbot.command()
 @click.help_option("-h", "--help")
-@click.option("-m", "--model", help="The model to chat with.")
+@click.option(
+    "-m",
+    "--model",
+    help="The model to chat with, empty for the default of the chat backend.",
+    default=_CHAT_DEFAULTS["model"],
+)
 @click.option(
     "-t",
     "--temperature",
@@ -82,16 +210,165 @@ def chatbot(ctx: click.Context, embedding: str, openai_api_key: str) -> None:
     "--sys-prompt",
     help="The prompt given to the model.",
 )
+@click.option(
+    "--stream/--no-stream",
+    help="Show the answer while it is generated.",
+    default=_CHAT_DEFAULTS["stream"],
+)
+@click.option(
+    "--history-turns",
+    help="The maximum number of past turns sent verbatim to the model.",
+    type=click.IntRange(min=1),
+    default=HistorySettings.max_turns,
+    metavar="<int>",
+)
+@click.option(
+    "--history-tokens",
+    help="The maximum number of tokens of the past turns sent verbatim.",
+    type=click.IntRange(min=0),
+    default=HistorySettings.max_tokens,
+    metavar="<int>",
+)
+@click.option(
+    "--summary-model",
+    help="The model of the chat backend summarizing older turns, empty to "
+    "forget them.",
+    default=HistorySettings.summary_model,
+)
+@click.option(
+    "--answer-cache/--no-answer-cache",
+    help="Answer again with the stored answer to a similar question.",
+    default=_CHAT_DEFAULTS["answer_cache"],
+)
+@click.option(
+    "--answer-cache-threshold",
+    help="The minimum cosine similarity of a question to a stored one.",
+    type=click.FloatRange(min=0.0, max=1.0),
+    default=AnswerCacheSettings.threshold,
+    metavar="<float>",
+)
+@click.option(
+    "--answer-cache-ttl",
+    help="The number of seconds a stored answer is served for.",
+    type=click.IntRange(min=0),
+    default=AnswerCacheSettings.ttl,
+    metavar="<seconds>",
+)
+@click.option(
+    "--answer-cache-size",
+    help="The maximum number of stored answers.",
+    type=click.IntRange(min=1),
+    default=AnswerCacheSettings.max_entries,
+    metavar="<int>",
+)
+@click.option(
+    "--retrieval",
+    help="How the context is retrieved, lexical needs no embedding call.",
+    type=click.Choice(["hybrid", "vector", "lexical"]),
+    default=_CHAT_DEFAULTS["retrieval"],
+)
+@click.option(
+    "--collections",
+    help="The comma separated collections searched, --collection by default.",
+    default=_CHAT_DEFAULTS["collections"],
+    metavar="<names>",
+)
+@click.option(
+    "--compress-context/--no-compress-context",
+    help="Merge, deduplicate and diversify the retrieved chunks.",
+    default=_CHAT_DEFAULTS["compress_context"],
+)
+@click.option(
+    "--context-candidates",
+    help="The number of chunks retrieved before the compression.",
+    type=click.IntRange(min=1),
+    default=ContextSettings.candidates,
+    metavar="<int>",
+)
+@click.option(
+    "--context-tokens",
+    help="The maximum number of tokens of the compressed context, 0 for no limit.",
+    type=click.IntRange(min=0),
+    default=ContextSettings.max_tokens,
+    metavar="<int>",
+)
+@click.option(
+    "--rerank/--no-rerank",
+    help="Rerank the retrieved chunks with a local cross-encoder.",
+    default=_CHAT_DEFAULTS["rerank"],
+)
+@click.option(
+    "--rerank-candidates",
+    help="The number of chunks retrieved before the reranking.",
+    type=click.IntRange(min=1),
+    default=RerankSettings.candidates,
+    metavar="<int>",
+)
+@click.option(
+    "--rerank-k",
+    help="The number of best reranked chunks kept.",
+    type=click.IntRange(min=1),
+    default=RerankSettings.k,
+    metavar="<int>",
+)
+@click.option(
+    "--rerank-model",
+    help="The cross-encoder reranking the chunks.",
+    default=RerankSettings.model,
+)
+@click.option(
+    "--rerank-budget",
+    help="The milliseconds the reranking may take before the retrieval order "
+    "is kept, 0 for no limit.",
+    type=click.IntRange(min=0),
+    default=RerankSettings.budget_ms,
+    metavar="<ms>",
+)
+@click.option(
+    "--profile",
+    is_flag=True,
+    help="Print the time spent in every stage.",
+)
+@click.option(
+    "--trace-file",
+    help="Write the timed stages as a Chrome trace, implies --profile.",
+    type=click.Path(dir_okay=False, writable=True, path_type=Path),
+    metavar="<path>",
+)
 @click.pass_context
-def chat(
+def chat(  # noqa: PLR0913
     ctx: click.Context,
     model: str,
     temperature: float,
     sys_prompt: str,
+    stream: bool,
+    history_turns: int,
+    history_tokens: int,
+    summary_model: str,
+    answer_cache: bool,
+    answer_cache_threshold: float,
+    answer_cache_ttl: int,
+    answer_cache_size: int,
+    retrieval: RetrievalMode,
+    collections: str,
+    compress_context: bool,
+    context_candidates: int,
+    context_tokens: int,
+    rerank: bool,
+    rerank_candidates: int,
+    rerank_k: int,
+    rerank_model: str,
+    rerank_budget: int,
+    profile: bool,
+    trace_file: Path | None,
 ) -> None:
     """Chat with the chatbot."""
+    from chatbot import profiling
+    from chatbot.chat import main_loop
+
     embedding = ctx.obj["embedding"]
     api_key = ctx.obj["openai_api_key"]
+    profiler = profiling.enable() if profile or trace_file else None
 
     click.echo(HEADER)
     click.echo("Starting a chat session...")
@@ -101,7 +378,41 @@ def chat(
         temperature,
         sys_prompt,
         api_key,
+        ctx.obj["embedding_cache_size"],
+        stream,
+        HistorySettings(history_turns, history_tokens, summary_model),
+        (
+            AnswerCacheSettings(
+                answer_cache_threshold,
+                answer_cache_ttl,
+                answer_cache_size,
+            )
+            if answer_cache
+            else None
+        ),
+        retrieval,
+        ctx.obj["vector_store"],
+        (
+            ContextSettings(context_candidates, max_tokens=context_tokens)
+            if compress_context
+            else None
+        ),
+        split_names(collections),
+        ctx.obj["backends"],
+        (
+            RerankSettings(
+                rerank_candidates,
+                rerank_k,
+                rerank_model,
+                ctx.obj["backends"].device,
+                budget_ms=rerank_budget,
+            )
+            if rerank
+            else None
+        ),
     )
+    if profiler is not None and trace_file is not None:
+        profiler.write_trace(trace_file)
 
 
 @chatbot.command()
@@ -121,21 +432,99 @@ def chat(
 )
 @click.option(
     "--chunk-size",
-    help="The number of chars for each chunk.",
+    help="The length of each chunk, in --length-unit.",
     type=click.IntRange(min=0),
     metavar="<size>",
 )
 @click.option(
     "-o",
     "--overlap",
-    help="The number of characters each chunk overlaps with the previous.",
+    help="The length each chunk overlaps with the previous, in --length-unit.",
     type=click.IntRange(min=0),
     metavar="<int>",
 )
+@click.option(
+    "--length-unit",
+    help="How the length of the chunks is measured.",
+    type=click.Choice(["chars", "tokens"]),
+    default=_INGEST_DEFAULTS["length_unit"],
+)
+@click.option(
+    "-w",
+    "--workers",
+    help="The number of processes used to parse and split the documents.",
+    type=click.IntRange(min=1),
+    default=_INGEST_DEFAULTS["workers"],
+    metavar="<int>",
+)
+@click.option(
+    "-i",
+    "--incremental",
+    is_flag=True,
+    help="Update an existing memory, embedding only new or changed chunks.",
+)
+@click.option(
+    "--batch-size",
+    help="The maximum number of chunks embedded by a single request.",
+    type=click.IntRange(min=1),
+    default=BatchSettings.batch_size,
+    metavar="<int>",
+)
+@click.option(
+    "--batch-tokens",
+    help="The maximum number of tokens embedded by a single request.",
+    type=click.IntRange(min=1),
+    default=BatchSettings.batch_tokens,
+    metavar="<int>",
+)
+@click.option(
+    "--concurrency",
+    help="The maximum number of embedding requests in flight.",
+    type=click.IntRange(min=1),
+    default=BatchSettings.concurrency,
+    metavar="<int>",
+)
+@click.option(
+    "--tokens-per-minute",
+    help="The rate limit of the embedding model, 0 for no limit.",
+    type=click.IntRange(min=0),
+    default=BatchSettings.tokens_per_minute,
+    metavar="<int>",
+)
+@click.option(
+    "--fetch-concurrency",
+    help="The maximum number of web pages downloaded at the same time.",
+    type=click.IntRange(min=1),
+    default=FetchSettings.concurrency,
+    metavar="<int>",
+)
+@click.option(
+    "--fetch-per-host",
+    help="The maximum number of web pages downloaded at the same time from a host.",
+    type=click.IntRange(min=1),
+    default=FetchSettings.per_host,
+    metavar="<int>",
+)
+@click.option(
+    "--progress/--no-progress",
+    help="Show the items processed by every stage and their throughput.",
+    default=_INGEST_DEFAULTS["progress"],
+)
+@click.option(
+    "--profile",
+    is_flag=True,
+    help="Print the time spent in every stage.",
+)
+@click.option(
+    "--trace-file",
+    help="Write the timed stages as a Chrome trace, implies --profile.",
+    type=click.Path(dir_okay=False, writable=True, path_type=Path),
+    metavar="<path>",
+)
 @click.help_option("-h", "--help")
 @click.pass_context
 @docstring_decorator(help_text="Setup the chatbot.")
-def ingest(  # noqa: D103
+def ingest(  # noqa: D103, PLR0913
     ctx: click.Context,
     resource: Annotated[
         Path,
@@ -144,10 +533,235 @@ def ingest(  # noqa: D103
     file_format: str,
     chunk_size: int,
     overlap: int,
+    length_unit: LengthUnit,
+    workers: int,
+    incremental: bool,
+    batch_size: int,
+    batch_tokens: int,
+    concurrency: int,
+    tokens_per_minute: int,
+    fetch_concurrency: int,
+    fetch_per_host: int,
+    progress: bool,
+    profile: bool,
+    trace_file: Path | None,
 ) -> None:
+    from chatbot import profiling
+    from chatbot.backends import embedding_id
+    from chatbot.embeddings import CachedEmbeddings, get_embeddings
+    from chatbot.memory import EMBEDDING_CACHE, create_memory
+    from chatbot.pipeline import IngestProgress
+
     click.echo("Setting up the chatbot memories...")
-    api_key = ctx.obj["openai_api_key"]
-    create_memory(api_key, resource, file_format, chunk_size, overlap)
+    profiler = profiling.enable() if profile or trace_file else None
+    embeddings = get_embeddings(
+        ctx.obj["embedding"],
+        ctx.obj["openai_api_key"],
+        EMBEDDING_CACHE,
+        ctx.obj["embedding_cache_size"],
+        settings=ctx.obj["backends"],
+    )
+    with IngestProgress(enabled=progress) as stages:
+        create_memory(
+            profiling.profile_embeddings(embeddings),
+            resource,
+            file_format,
+            chunk_size,
+            overlap,
+            workers,
+            incremental,
+            BatchSettings(batch_size, batch_tokens, concurrency, tokens_per_minute),
+            FetchSettings(fetch_concurrency, fetch_per_host),
+            ctx.obj["vector_store"],
+            length_unit,
+            embedding_id(ctx.obj["embedding"], ctx.obj["backends"]),
+            stages,
+        )
+    if isinstance(embeddings, CachedEmbeddings):
+        click.echo(embeddings.save_stats())
+    if profiler is not None:
+        profiler.summary(Console(), title="Ingest breakdown")
+        if trace_file is not None:
+            profiler.write_trace(trace_file)
+
+
+@chatbot.command()
+@click.help_option("-h", "--help")
+@click.option(
+    "--host",
+    help="The interface the server listens on.",
+    default=ServeSettings.host,
+)
+@click.option(
+    "-p",
+    "--port",
+    help="The port the server listens on.",
+    type=click.IntRange(min=0, max=65535),
+    default=ServeSettings.port,
+    metavar="<int>",
+)
+@click.option(
+    "--max-in-flight",
+    help="The maximum number of answers generated at the same time.",
+    type=click.IntRange(min=1),
+    default=ServeSettings.max_in_flight,
+    metavar="<int>",
+)
+@click.option(
+    "--max-sessions",
+    help="The maximum number of chat sessions kept in memory.",
+    type=click.IntRange(min=1),
+    default=ServeSettings.max_sessions,
+    metavar="<int>",
+)
+@click.option(
+    "--fake",
+    is_flag=True,
+    help="Answer with fake models and documents, to load test offline.",
+)
+@click.pass_context
+def serve(
+    ctx: click.Context,
+    host: str,
+    port: int,
+    max_in_flight: int,
+    max_sessions: int,
+    fake: bool,
+) -> None:
+    """Serve the chatbot over HTTP, with the model settings of the chat.
+
+    POST a JSON object with a question, and optionally a session id, to /chat
+    to get the answer streamed as plain text.
+    """
+    from aiohttp import web
+
+    from chatbot.serve import create_app
+
+    chat_config = _chat_config(ctx)
+    settings = ServeSettings(host, port, max_in_flight, max_sessions)
+    app = create_app(
+        chat_config["model"],
+        ctx.obj["embedding"],
+        float(chat_config["temperature"]),
+        chat_config["sys-prompt"],
+        ctx.obj["openai_api_key"],
+        ctx.obj["embedding_cache_size"],
+        HistorySettings(
+            int(chat_config["history_turns"]),
+            int(chat_config["history_tokens"]),
+        ),
+        settings,
+        retrieval=chat_config["retrieval"],
+        store=ctx.obj["vector_store"],
+        collections=split_names(chat_config["collections"]),
+        context=_context_settings(chat_config),
+        backends=ctx.obj["backends"],
+        rerank=_rerank_settings(chat_config, ctx.obj["backends"].device),
+        fake=fake,
+    )
+    web.run_app(app, host=settings.host, port=settings.port)
+
+
+def _chat_config(ctx: click.Context) -> dict[str, Any]:
+    """Get the settings of the chat, from the configuration file of the group."""
+    return load_chat_config(ctx.parent.default_map if ctx.parent else None)
+
+
+def _context_settings(chat_config: dict[str, Any]) -> ContextSettings | None:
+    """Get the compression of the context configured for the chat."""
+    # the values set by ``configure set`` are strings
+    if not click.BOOL.convert(chat_config["compress_context"], None, None):
+        return None
+    return ContextSettings(
+        int(chat_config["context_candidates"]),
+        max_tokens=int(chat_config["context_tokens"]),
+    )
+
+
+def _rerank_settings(chat_config: dict[str, Any], device: str) -> RerankSettings | None:
+    """Get the reranking of the chunks configured for the chat."""
+    # the values set by ``configure set`` are strings
+    if not click.BOOL.convert(chat_config["rerank"], None, None):
+        return None
+    return RerankSettings(
+        int(chat_config["rerank_candidates"]),
+        int(chat_config["rerank_k"]),
+        chat_config["rerank_model"],
+        device,
+        budget_ms=int(chat_config["rerank_budget"]),
+    )
+
+
+@chatbot.command()
+@click.help_option("-h", "--help")
+@click.option(
+    "--batch",
+    help="The JSONL file of the questions, an object with a question and an id "
+    "per line.",
+    type=click.Path(exists=True, dir_okay=False, path_type=Path),
+    required=True,
+    metavar="<path>",
+)
+@click.option(
+    "-o",
+    "--output",
+    help="The JSONL file of the answers.",
+    type=click.File("w"),
+    default="-",
+    metavar="<path>",
+)
+@click.option(
+    "--concurrency",
+    help="The maximum number of questions answered at the same time.",
+    type=click.IntRange(min=1),
+    default=AskSettings.concurrency,
+    metavar="<int>",
+)
+@click.option(
+    "--embedding-batch-size",
+    help="The number of questions embedded by a single request.",
+    type=click.IntRange(min=1),
+    default=AskSettings.batch_size,
+    metavar="<int>",
+)
+@click.pass_context
+def ask(
+    ctx: click.Context,
+    batch: Path,
+    output: TextIO,
+    concurrency: int,
+    embedding_batch_size: int,
+) -> None:
+    """Answer a batch of questions, with the model settings of the chat.
+
+    Every answer is written as a JSON object with the id of the question, the
+    ids of the retrieved chunks and the time spent retrieving and generating.
+    The answers are written as soon as they are ready, not in order.
+    """
+    from chatbot.ask import ask_batch
+
+    chat_config = _chat_config(ctx)
+    asker = ask_batch(
+        chat_config["model"],
+        ctx.obj["embedding"],
+        float(chat_config["temperature"]),
+        chat_config["sys-prompt"],
+        ctx.obj["openai_api_key"],
+        batch,
+        output,
+        ctx.obj["embedding_cache_size"],
+        AskSettings(concurrency, embedding_batch_size),
+        chat_config["retrieval"],
+        ctx.obj["vector_store"],
+        _context_settings(chat_config),
+        split_names(chat_config["collections"]),
+        ctx.obj["backends"],
+        _rerank_settings(chat_config, ctx.obj["backends"].device),
+    )
+    click.echo(
+        f"Answered {asker.answered} questions, {asker.failed} failed.",
+        err=True,
+    )
 
 
 @chatbot.group()
@@ -191,3 +805,145 @@ def edit() -> None:
     logger = logging.getLogger("app_logger")
     click.edit(filename=str(APP_DIR / "config.toml"))
     logger.debug("Edited config file.")
+
+
+@chatbot.group()
+@click.help_option("-h", "--help")
+def cache() -> None:
+    """Handle the embedding cache."""
+
+
+@cache.command(name="show")
+@click.help_option("-h", "--help")
+@click.pass_context
+def show_cache(ctx: click.Context) -> None:
+    """Display the embedding cache size and its hit and miss counters."""
+    from chatbot.embeddings import EmbeddingCache
+    from chatbot.memory import EMBEDDING_CACHE
+
+    console = Console()
+
+    embedding_cache = EmbeddingCache(EMBEDDING_CACHE, ctx.obj["embedding_cache_size"])
+    for key, value in embedding_cache.stats().items():
+        console.print(f"[cyan]{key}[/cyan]: [bold white]{value}")
+    embedding_cache.close()
+
+
+@cache.command()
+@click.help_option("-h", "--help")
+@click.pass_context
+def clear(ctx: click.Context) -> None:
+    """Remove every cached embedding."""
+    from chatbot.embeddings import EmbeddingCache
+    from chatbot.memory import EMBEDDING_CACHE
+
+    embedding_cache = EmbeddingCache(EMBEDDING_CACHE, ctx.obj["embedding_cache_size"])
+    embedding_cache.clear()
+    embedding_cache.close()
+
+
+@chatbot.group()
+@click.help_option("-h", "--help")
+def index() -> None:
+    """Handle the vector store of the memory."""
+
+
+@index.command()
+@click.help_option("-h", "--help")
+@click.option(
+    "--source",
+    help="The chroma database to convert, the one of the memory by default.",
+    type=click.Path(exists=True, file_okay=False, path_type=Path),
+    metavar="<path>",
+)
+@click.pass_context
+def convert(ctx: click.Context, source: Path | None) -> None:
+    """Copy a chroma database into a compact vector store.
+
+    The vectors are stored with the --vector-dtype and --vector-dimensions of
+    the chatbot, use --vector-store compact to chat with them.
+    """
+    from chatbot.memory import collection_paths, convert_chroma
+
+    store = ctx.obj["vector_store"]
+    paths = collection_paths(store.collection)
+    copied = convert_chroma(source or paths.chroma, store)
+    click.echo(f"Copied {copied} vectors to {paths.vectors}.")
+
+
+@index.command(name="export")
+@click.help_option("-h", "--help")
+@click.argument(
+    "target",
+    type=click.Path(dir_okay=False, path_type=Path),
+    metavar="<path>",
+)
+@click.pass_context
+def export_(ctx: click.Context, target: Path) -> None:
+    """Write the collection to a snapshot file.
+
+    The snapshot holds the vectors, the chunks, the embedding model and the
+    chunking parameters, and does not depend on the version of chroma.
+    """
+    from chatbot.memory import export_snapshot
+
+    exported = export_snapshot(target, ctx.obj["vector_store"])
+    click.echo(f"Exported {exported} chunks to {target}.")
+
+
+@index.command(name="import")
+@click.help_option("-h", "--help")
+@click.argument(
+    "source",
+    type=click.Path(exists=True, dir_okay=False, path_type=Path),
+    metavar="<path>",
+)
+@click.pass_context
+def import_(ctx: click.Context, source: Path) -> None:
+    """Create the collection from a snapshot file, written by index export.
+
+    The vectors are stored with the --vector-store, --vector-dtype and
+    --vector-dimensions of the chatbot.
+    """
+    from chatbot.memory import collection_paths, import_snapshot
+
+    store = ctx.obj["vector_store"]
+    imported = import_snapshot(source, store)
+    click.echo(
+        f"Imported {imported} chunks to the collection {store.collection} "
+        f"in {collection_paths(store.collection).manifest.parent}.",
+    )
+
+
+@index.command(name="list")
+@click.help_option("-h", "--help")
+def list_() -> None:
+    """List the ingested collections."""
+    from chatbot.memory import list_collections
+
+    for name in list_collections():
+        click.echo(name)
+
+
+@chatbot.group()
+@click.help_option("-h", "--help")
+def history() -> None:
+    """Handle the chat history."""
+
+
+@history.command()
+@click.help_option("-h", "--help")
+@click.option(
+    "-k",
+    "--keep-sessions",
+    help="The number of most recent chat sessions to keep.",
+    type=click.IntRange(min=0),
+    default=10,
+    metavar="<int>",
+)
+def compact(keep_sessions: int) -> None:
+    """Rewrite the chat history, dropping the older sessions."""
+    from chatbot.memory import open_chat_log
+
+    dropped = open_chat_log().compact(keep_sessions)
+    click.echo(f"Dropped {dropped} messages.")
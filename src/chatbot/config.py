@@ -1,10 +1,24 @@
 """Configuration constants for the chatbot."""
 
+from collections.abc import Mapping
 from pathlib import Path
 from typing import Any
 
 import toml
 
+from chatbot.settings import (
+    EMBEDDING_CACHE_SIZE,
+    AnswerCacheSettings,
+    AskSettings,
+    BackendSettings,
+    BatchSettings,
+    ContextSettings,
+    FetchSettings,
+    HistorySettings,
+    RerankSettings,
+    ServeSettings,
+    VectorStoreSettings,
+)
 from chatbot.utils import depth_set
 
 CONFIG_FILE = Path("config.toml")
@@ -21,12 +35,68 @@ If the context does not contain information to answer the user's question, ask t
 """  # noqa: E501
 
 
-DEFAULT_CONFIG = {
+# The defaults of the settings come from their dataclasses, and the command
+# line takes the others from here, so that each is set in a single place.
+DEFAULT_CONFIG: dict[str, Any] = {
     "chatbot": {
         "openai_api_key": "",
-        "embedding": "text-embedding-3-large",
-        "chat": {"sys-prompt": PROMPT, "temperature": 0.6, "model": "gpt-4-turbo"},
-        "ingest": {"chunk_size": 2500, "overlap": 150},
+        "embedding": "",
+        "embedding_cache_size": EMBEDDING_CACHE_SIZE,
+        "vector_store": VectorStoreSettings.backend,
+        "vector_dtype": VectorStoreSettings.dtype,
+        "vector_dimensions": VectorStoreSettings.dimensions,
+        "collection": VectorStoreSettings.collection,
+        "max_open_collections": VectorStoreSettings.max_open,
+        "embedding_backend": BackendSettings.embedding_backend,
+        "chat_backend": BackendSettings.chat_backend,
+        "chat_base_url": BackendSettings.chat_base_url,
+        "device": BackendSettings.device,
+        "chat": {
+            "sys-prompt": PROMPT,
+            "temperature": 0.6,
+            "model": "",
+            "stream": True,
+            "history_turns": HistorySettings.max_turns,
+            "history_tokens": HistorySettings.max_tokens,
+            "summary_model": HistorySettings.summary_model,
+            "answer_cache": False,
+            "answer_cache_threshold": AnswerCacheSettings.threshold,
+            "answer_cache_ttl": AnswerCacheSettings.ttl,
+            "answer_cache_size": AnswerCacheSettings.max_entries,
+            "retrieval": "hybrid",
+            "collections": "",
+            "compress_context": True,
+            "context_candidates": ContextSettings.candidates,
+            "context_tokens": ContextSettings.max_tokens,
+            "rerank": False,
+            "rerank_candidates": RerankSettings.candidates,
+            "rerank_k": RerankSettings.k,
+            "rerank_model": RerankSettings.model,
+            "rerank_budget": RerankSettings.budget_ms,
+        },
+        "ingest": {
+            "chunk_size": 2500,
+            "overlap": 150,
+            "length_unit": "chars",
+            "workers": 1,
+            "batch_size": BatchSettings.batch_size,
+            "batch_tokens": BatchSettings.batch_tokens,
+            "concurrency": BatchSettings.concurrency,
+            "tokens_per_minute": BatchSettings.tokens_per_minute,
+            "fetch_concurrency": FetchSettings.concurrency,
+            "fetch_per_host": FetchSettings.per_host,
+            "progress": True,
+        },
+        "ask": {
+            "concurrency": AskSettings.concurrency,
+            "embedding_batch_size": AskSettings.batch_size,
+        },
+        "serve": {
+            "host": ServeSettings.host,
+            "port": ServeSettings.port,
+            "max_in_flight": ServeSettings.max_in_flight,
+            "max_sessions": ServeSettings.max_sessions,
+        },
     },
 }
 
@@ -56,6 +126,24 @@ def load_config(folder: Path) -> dict[str, Any]:
         return toml.load(f)
 
 
+def load_chat_config(config: Mapping[str, Any] | None) -> dict[str, Any]:
+    """Get the settings of the chat, shared by the commands answering questions.
+
+    Parameters
+    ----------
+    config : Mapping[str, Any] | None
+        The ``chatbot`` section of the configuration file, if any.
+
+    Returns
+    -------
+    dict[str, Any]
+        The default settings of the chat, updated with the configured ones.
+
+    """
+    chat: dict[str, Any] = DEFAULT_CONFIG["chatbot"]["chat"]
+    return {**chat, **(config or {}).get("chat", {})}
+
+
 def set_config_value(folder: Path, key: str, value: str) -> None:
     """Set a configuration value."""
     config = load_config(folder)
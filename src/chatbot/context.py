@@ -0,0 +1,209 @@
+"""Compression of the retrieved chunks before they fill the prompt."""
+
+import logging
+import threading
+from typing import Any
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.pydantic_v1 import PrivateAttr
+from langchain_core.retrievers import BaseRetriever
+
+from chatbot import profiling
+from chatbot.lexical import tokenize
+from chatbot.settings import ContextSettings
+from chatbot.utils import CHARS_PER_TOKEN, estimate_tokens
+
+logger = logging.getLogger("app_logger")
+
+
+def _key(doc: Document) -> tuple[str, Any]:
+    return doc.metadata.get("source", ""), doc.metadata.get("page")
+
+
+def merge_adjacent(docs: list[Document]) -> list[Document]:
+    """Merge the chunks of the same page that overlap or touch.
+
+    Chunks are placed by their ``start_index`` metadata and the text they
+    share is kept once. A merged chunk takes the rank of its best part, and
+    chunks without ``start_index`` are left as they are.
+    """
+    groups: dict[tuple[str, Any], list[tuple[int, Document]]] = {}
+    merged: list[tuple[int, Document]] = []
+    for rank, doc in enumerate(docs):
+        if isinstance(doc.metadata.get("start_index"), int):
+            groups.setdefault(_key(doc), []).append((rank, doc))
+        else:
+            merged.append((rank, doc))
+
+    for group in groups.values():
+        group.sort(key=lambda item: item[1].metadata["start_index"])
+        rank, current = group[0]
+        for next_rank, doc in group[1:]:
+            start = current.metadata["start_index"]
+            end = start + len(current.page_content)
+            if doc.metadata["start_index"] > end:
+                merged.append((rank, current))
+                rank, current = next_rank, doc
+                continue
+            overlap = end - doc.metadata["start_index"]
+            current = Document(
+                page_content=current.page_content + doc.page_content[overlap:],
+                metadata=current.metadata,
+            )
+            rank = min(rank, next_rank)
+        merged.append((rank, current))
+
+    return [doc for _, doc in sorted(merged, key=lambda item: item[0])]
+
+
+def _overlap(a: set[str], b: set[str]) -> float:
+    # the share of the words of the shorter text found in the other
+    if not a or not b:
+        return 0.0
+    return len(a & b) / min(len(a), len(b))
+
+
+def _jaccard(a: set[str], b: set[str]) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def drop_duplicates(docs: list[Document], threshold: float) -> list[Document]:
+    """Drop the chunks whose words are mostly found in a better ranked chunk."""
+    kept: list[Document] = []
+    words: list[set[str]] = []
+    for doc in docs:
+        terms = set(tokenize(doc.page_content))
+        if all(_overlap(terms, other) < threshold for other in words):
+            kept.append(doc)
+            words.append(terms)
+    return kept
+
+
+def diversify(docs: list[Document], k: int, mmr_lambda: float) -> list[Document]:
+    """Select ``k`` chunks by maximal marginal relevance.
+
+    The relevance of a chunk is given by its rank, and its redundancy by the
+    word overlap with the chunks already selected, so no embedding call is
+    made.
+    """
+    words = [set(tokenize(doc.page_content)) for doc in docs]
+    remaining = list(range(len(docs)))
+    selected: list[int] = []
+    while remaining and len(selected) < k:
+        scores = {
+            i: mmr_lambda * (1 - i / len(docs))
+            - (1 - mmr_lambda)
+            * max((_jaccard(words[i], words[j]) for j in selected), default=0)
+            for i in remaining
+        }
+        best = max(remaining, key=scores.__getitem__)
+        selected.append(best)
+        remaining.remove(best)
+    return [docs[i] for i in selected]
+
+
+def fit_budget(docs: list[Document], max_tokens: int) -> list[Document]:
+    """Keep the chunks fitting in ``max_tokens``, in order.
+
+    The first chunk is always kept, cut to the budget if it is too long.
+    """
+    if max_tokens <= 0 or not docs:
+        return docs
+    first = docs[0]
+    if estimate_tokens(first.page_content) > max_tokens:
+        first = Document(
+            page_content=first.page_content[: (max_tokens - 1) * CHARS_PER_TOKEN],
+            metadata=first.metadata,
+        )
+    kept = [first]
+    total = estimate_tokens(first.page_content)
+    for doc in docs[1:]:
+        tokens = estimate_tokens(doc.page_content)
+        if total + tokens <= max_tokens:
+            kept.append(doc)
+            total += tokens
+    return kept
+
+
+def compress(docs: list[Document], settings: ContextSettings) -> list[Document]:
+    """Merge, deduplicate, diversify and cut the retrieved chunks."""
+    docs = merge_adjacent(docs)
+    docs = drop_duplicates(docs, settings.duplicate_threshold)
+    docs = diversify(docs, settings.k, settings.mmr_lambda)
+    return fit_budget(docs, settings.max_tokens)
+
+
+class CompressedRetriever(BaseRetriever):
+    """Retrieve more chunks than needed and compress them into the context.
+
+    The wrapped retriever should return ``settings.candidates`` chunks, best
+    first. The tokens of the chunks before and after the compression are
+    counted over the session.
+
+    Attributes
+    ----------
+    retriever : BaseRetriever
+        The retriever of the candidate chunks.
+    settings : ContextSettings
+        How the chunks are compressed.
+    turns : int
+        The number of compressed retrievals.
+    tokens_before : int
+        The tokens of the candidate chunks.
+    tokens_after : int
+        The tokens of the compressed context.
+
+    """
+
+    retriever: BaseRetriever
+    settings: ContextSettings
+    turns: int = 0
+    tokens_before: int = 0
+    tokens_after: int = 0
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    def _get_relevant_documents(
+        self,
+        query: str,
+        *,
+        run_manager: CallbackManagerForRetrieverRun,
+    ) -> list[Document]:
+        candidates = self.retriever.invoke(
+            query,
+            config={"callbacks": run_manager.get_child()},
+        )
+        with profiling.span("compress") as attrs:
+            context = compress(candidates, self.settings)
+            before = sum(estimate_tokens(doc.page_content) for doc in candidates)
+            after = sum(estimate_tokens(doc.page_content) for doc in context)
+            attrs.update(
+                chunks_before=len(candidates),
+                chunks_after=len(context),
+                tokens_before=before,
+                tokens_after=after,
+            )
+        logger.info(
+            "Context: %d chunks of %d tokens, from %d chunks of %d tokens.",
+            len(context),
+            after,
+            len(candidates),
+            before,
+        )
+        with self._lock:
+            self.turns += 1
+            self.tokens_before += before
+            self.tokens_after += after
+        return context
+
+    def report(self) -> str:
+        """Describe the tokens saved by the compression."""
+        with self._lock:
+            saved = self.tokens_before - self.tokens_after
+            ratio = saved / self.tokens_before if self.tokens_before else 0.0
+            return (
+                f"Context: {saved}/{self.tokens_before} retrieved tokens saved "
+                f"({ratio:.0%}) over {self.turns} questions."
+            )
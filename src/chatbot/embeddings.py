@@ -0,0 +1,339 @@
+"""Embedding models, local or cached, and the persistent embedding cache."""
+
+import functools
+import sqlite3
+import threading
+import time
+from array import array
+from collections.abc import Iterable, Iterator, Sequence
+from pathlib import Path
+from typing import Any
+
+import httpx
+from langchain_core.embeddings import Embeddings
+
+from chatbot.backends import (
+    create_embeddings,
+    embedding_id,
+    import_sentence_transformers,
+)
+from chatbot.manifest import text_hash
+from chatbot.settings import BackendSettings
+
+# Keep the number of bound parameters of a query below the sqlite limit.
+_SQL_BATCH = 500
+
+_models_lock = threading.Lock()
+
+
+def _batched(items: Sequence[str], size: int) -> Iterator[Sequence[str]]:
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
+
+
+@functools.cache
+def _load_model(model: str, device: str) -> Any:
+    module = import_sentence_transformers("local embedding backend")
+    return module.SentenceTransformer(model, device=device)
+
+
+class LocalEmbeddings(Embeddings):
+    """Embeddings computed in process by a sentence-transformers model.
+
+    The model is loaded at the first call, once per process, and the texts
+    are encoded ``batch_size`` at a time. The vectors are normalized, like
+    those of the OpenAI models.
+
+    Parameters
+    ----------
+    model : str
+        The name of the model on the Hugging Face hub, or its folder.
+    device : str
+        The device running the model, e.g. "cpu" or "cuda".
+    batch_size : int
+        The number of texts encoded at a time.
+
+    """
+
+    def __init__(self, model: str, device: str = "cpu", batch_size: int = 32) -> None:
+        self.model = model
+        self.device = device
+        self.batch_size = batch_size
+
+    def _model(self) -> Any:
+        with _models_lock:
+            return _load_model(self.model, self.device)
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        """Embed search docs."""
+        if not texts:
+            return []
+        vectors = self._model().encode(
+            texts,
+            batch_size=self.batch_size,
+            normalize_embeddings=True,
+            convert_to_numpy=True,
+        )
+        return [[float(x) for x in vector] for vector in vectors]
+
+    def embed_query(self, text: str) -> list[float]:
+        """Embed query text."""
+        return self.embed_documents([text])[0]
+
+
+class EmbeddingCache:
+    """A sqlite store of embedding vectors keyed by model and text hash.
+
+    The store keeps at most ``max_entries`` vectors, evicting the least
+    recently used ones. Hits and misses are accumulated across sessions.
+
+    Parameters
+    ----------
+    path : Path
+        The sqlite database file.
+    max_entries : int
+        The maximum number of vectors kept in the cache.
+
+    """
+
+    def __init__(self, path: Path, max_entries: int) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "model TEXT, hash TEXT, vector BLOB, last_used INTEGER, "
+                "PRIMARY KEY (model, hash))",
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS embeddings_lru ON embeddings (last_used)",
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS stats "
+                "(name TEXT PRIMARY KEY, value INTEGER)",
+            )
+
+    def get_many(self, model: str, hashes: Iterable[str]) -> dict[str, list[float]]:
+        """Fetch the cached vectors of the hashes, marking them as recently used."""
+        found: dict[str, list[float]] = {}
+        now = time.time_ns()
+        with self._lock, self._conn:
+            for batch in _batched(list(hashes), _SQL_BATCH):
+                marks = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    "SELECT hash, vector FROM embeddings "  # noqa: S608
+                    f"WHERE model = ? AND hash IN ({marks})",
+                    (model, *batch),
+                )
+                for hash_, blob in rows:
+                    found[hash_] = array("f", blob).tolist()
+                self._conn.execute(
+                    "UPDATE embeddings SET last_used = ? "  # noqa: S608
+                    f"WHERE model = ? AND hash IN ({marks})",
+                    (now, model, *batch),
+                )
+        return found
+
+    def put_many(self, model: str, vectors: dict[str, list[float]]) -> None:
+        """Store the vectors and evict the least recently used ones over the cap."""
+        now = time.time_ns()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)",
+                (
+                    (model, hash_, array("f", vector).tobytes(), now)
+                    for hash_, vector in vectors.items()
+                ),
+            )
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+            if count > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM embeddings WHERE rowid IN ("
+                    "SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)",
+                    (count - self.max_entries,),
+                )
+
+    def record(self, hits: int, misses: int) -> None:
+        """Add the hits and misses of a session to the cumulative counters."""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT INTO stats VALUES (?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET value = value + excluded.value",
+                (("hits", hits), ("misses", misses)),
+            )
+
+    def stats(self) -> dict[str, int]:
+        """Get the number of cached vectors and the cumulative hits and misses."""
+        with self._lock:
+            stats = dict(self._conn.execute("SELECT name, value FROM stats"))
+            (entries,) = self._conn.execute(
+                "SELECT COUNT(*) FROM embeddings",
+            ).fetchone()
+        return {
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "hits": stats.get("hits", 0),
+            "misses": stats.get("misses", 0),
+        }
+
+    def clear(self) -> None:
+        """Remove every cached vector and reset the counters."""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM embeddings")
+            self._conn.execute("DELETE FROM stats")
+
+    def close(self) -> None:
+        """Close the underlying database."""
+        self._conn.close()
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings that look up an :class:`EmbeddingCache` before the model.
+
+    Parameters
+    ----------
+    embeddings : Embeddings
+        The wrapped embedding model.
+    model : str
+        The name of the embedding model, part of the cache key.
+    cache : EmbeddingCache
+        The cache of the vectors.
+
+    """
+
+    def __init__(self, embeddings: Embeddings, model: str, cache: EmbeddingCache):
+        self.embeddings = embeddings
+        self.model = model
+        self.cache = cache
+        self.hits = 0
+        self.misses = 0
+
+    def _embed(
+        self,
+        namespace: str,
+        texts: list[str],
+        *,
+        query: bool,
+    ) -> list[list[float]]:
+        hashes = [text_hash(text) for text in texts]
+        vectors = self.cache.get_many(namespace, set(hashes))
+
+        missing = {
+            h: text for h, text in zip(hashes, texts, strict=True) if h not in vectors
+        }
+        if missing:
+            if query:
+                new = [self.embeddings.embed_query(text) for text in missing.values()]
+            else:
+                new = self.embeddings.embed_documents(list(missing.values()))
+            # Vectors are stored as float32, round the new ones the same way so
+            # that a text always gets the same vector, cached or not.
+            computed = {
+                h: array("f", vector).tolist()
+                for h, vector in zip(missing, new, strict=True)
+            }
+            self.cache.put_many(namespace, computed)
+            vectors.update(computed)
+
+        self.misses += len(missing)
+        self.hits += len(texts) - len(missing)
+        return [vectors[h] for h in hashes]
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        """Embed search docs."""
+        return self._embed(self.model, texts, query=False)
+
+    def embed_query(self, text: str) -> list[float]:
+        """Embed query text."""
+        return self._embed(f"{self.model}:query", [text], query=True)[0]
+
+    def save_stats(self) -> str:
+        """Add the session hits and misses to the cache counters and describe them."""
+        self.cache.record(self.hits, self.misses)
+        report = f"Embedding cache: {self.hits} hits, {self.misses} misses."
+        self.hits = self.misses = 0
+        return report
+
+
+class PrimedEmbeddings(Embeddings):
+    """Embeddings answering the queries embedded ahead of time, in batches.
+
+    The vectors of the queries passed to :meth:`prime` are computed with a
+    single request, and every one of them is served once by
+    :meth:`embed_query`. Other queries are embedded by the wrapped model.
+
+    Parameters
+    ----------
+    embeddings : Embeddings
+        The wrapped embedding model.
+
+    """
+
+    def __init__(self, embeddings: Embeddings) -> None:
+        self.embeddings = embeddings
+        self._primed: dict[str, list[list[float]]] = {}
+        self._lock = threading.Lock()
+
+    def prime(self, texts: list[str]) -> None:
+        """Embed the queries that will be asked, with a single request."""
+        if not texts:
+            return
+        vectors = self.embeddings.embed_documents(texts)
+        with self._lock:
+            for text, vector in zip(texts, vectors, strict=True):
+                self._primed.setdefault(text, []).append(vector)
+
+    def prime_query(self, text: str) -> list[float]:
+        """Embed a query now, serving its vector to the next :meth:`embed_query`.
+
+        Returns
+        -------
+        list[float]
+            The vector of the query, to be used elsewhere too.
+
+        """
+        vector = self.embeddings.embed_query(text)
+        with self._lock:
+            self._primed.setdefault(text, []).append(vector)
+        return vector
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        """Embed search docs."""
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> list[float]:
+        """Embed query text, using the primed vector if any."""
+        with self._lock:
+            vectors = self._primed.get(text)
+            if vectors:
+                vector = vectors.pop()
+                if not vectors:
+                    del self._primed[text]
+                return vector
+        return self.embeddings.embed_query(text)
+
+
+def get_embeddings(
+    model: str,
+    api_key: str,
+    cache_path: Path,
+    cache_size: int,
+    http_client: httpx.Client | None = None,
+    settings: BackendSettings | None = None,
+) -> Embeddings:
+    """Create the embedding model, cached on disk when ``cache_size`` is positive.
+
+    The model is served by the backend of ``settings``, OpenAI by default. The
+    requests go through ``http_client`` when given, so that its connection
+    pool can be shared.
+    """
+    embeddings = create_embeddings(model, api_key, settings, http_client)
+    if cache_size <= 0:
+        return embeddings
+    return CachedEmbeddings(
+        embeddings,
+        embedding_id(model, settings),
+        EmbeddingCache(cache_path, cache_size),
+    )
@@ -0,0 +1,311 @@
+"""Fake models, to run and load test the chatbot offline."""
+
+import asyncio
+import hashlib
+import random
+import re
+import time
+from collections.abc import AsyncIterator, Iterator
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForLLMRun,
+    CallbackManagerForLLMRun,
+)
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+FAKE_ANSWER = (
+    "The Center for Computational Sonology studies sound and music with "
+    "computational methods. Please ask again once a real model is configured."
+)
+
+_WORD = re.compile(r"\w+")
+
+_NAMES = (
+    "Mario Rossi",
+    "Anna Bianchi",
+    "Luca Ferrari",
+    "Giulia Esposito",
+    "Marco Romano",
+    "Sara Colombo",
+)
+
+_WORDS = (
+    "the center studies sound and music with computational methods while "
+    "students write a thesis on signal processing machine learning and "
+    "acoustics in the laboratory of the university with old tapes and "
+    "instruments recorded in the studio"
+).split()
+
+# The fraction of generated sentences naming a person.
+_NAME_RATE = 0.3
+
+_TOPICS = (
+    "sound synthesis",
+    "music information retrieval",
+    "audio restoration",
+    "spatial audio",
+    "sonification",
+    "music perception",
+    "acoustic modelling",
+    "thesis proposals",
+)
+
+
+class FakeEmbeddings(Embeddings):
+    """Deterministic bag of words embeddings, with an optional latency.
+
+    Every word is hashed to a signed dimension of the vector, so texts sharing
+    words have similar embeddings and retrieval behaves sensibly.
+
+    Parameters
+    ----------
+    size : int
+        The dimension of the vectors.
+    latency : float
+        The seconds every call sleeps, to simulate a remote model.
+
+    """
+
+    def __init__(self, size: int = 256, latency: float = 0.0) -> None:
+        self.size = size
+        self.latency = latency
+
+    def _vector(self, text: str) -> list[float]:
+        vector = np.zeros(self.size, dtype=np.float32)
+        for word in _WORD.findall(text.lower()):
+            digest = hashlib.blake2b(word.encode(), digest_size=8).digest()
+            index = int.from_bytes(digest[:4], "little") % self.size
+            vector[index] += 1.0 if digest[4] & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector /= norm
+        return [float(x) for x in vector]
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        """Embed search docs."""
+        if self.latency > 0:
+            time.sleep(self.latency)
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text: str) -> list[float]:
+        """Embed query text."""
+        return self.embed_documents([text])[0]
+
+
+class FakeChatModel(BaseChatModel):
+    """A chat model streaming a canned answer word by word.
+
+    Attributes
+    ----------
+    answer : str
+        The answer to every question.
+    first_token_latency : float
+        The seconds before the first token.
+    token_latency : float
+        The seconds between two tokens.
+
+    """
+
+    answer: str = FAKE_ANSWER
+    first_token_latency: float = 0.0
+    token_latency: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def _tokens(self) -> list[str]:
+        return [token for token in re.split(r"(\s+)", self.answer) if token]
+
+    def _generate(
+        self,
+        messages: list[BaseMessage],
+        stop: list[str] | None = None,
+        run_manager: CallbackManagerForLLMRun | None = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        time.sleep(
+            self.first_token_latency + self.token_latency * len(self._tokens()),
+        )
+        return ChatResult(
+            generations=[ChatGeneration(message=AIMessage(content=self.answer))],
+        )
+
+    async def _agenerate(
+        self,
+        messages: list[BaseMessage],
+        stop: list[str] | None = None,
+        run_manager: AsyncCallbackManagerForLLMRun | None = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        await asyncio.sleep(
+            self.first_token_latency + self.token_latency * len(self._tokens()),
+        )
+        return ChatResult(
+            generations=[ChatGeneration(message=AIMessage(content=self.answer))],
+        )
+
+    def _stream(
+        self,
+        messages: list[BaseMessage],
+        stop: list[str] | None = None,
+        run_manager: CallbackManagerForLLMRun | None = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        time.sleep(self.first_token_latency)
+        for i, token in enumerate(self._tokens()):
+            if i > 0:
+                time.sleep(self.token_latency)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager is not None:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+    async def _astream(
+        self,
+        messages: list[BaseMessage],
+        stop: list[str] | None = None,
+        run_manager: AsyncCallbackManagerForLLMRun | None = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        await asyncio.sleep(self.first_token_latency)
+        for i, token in enumerate(self._tokens()):
+            if i > 0:
+                await asyncio.sleep(self.token_latency)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager is not None:
+                await run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+
+def fake_documents(count: int) -> list[Document]:
+    """Generate short documents about the topics of the center."""
+    return [
+        Document(
+            page_content=(
+                f"Document {i} is about {_TOPICS[i % len(_TOPICS)]}. "
+                f"It describes project {i} of the Center for Computational "
+                "Sonology and the people working on it."
+            ),
+            metadata={"source": f"fake-{i}", "page": 0},
+        )
+        for i in range(count)
+    ]
+
+
+def fake_text(rng: random.Random, words: int) -> str:
+    """Generate a text of ``words`` words about the center."""
+    sentences = []
+    while words > 0:
+        length = min(words, rng.randint(8, 20))
+        sentence = rng.choices(_WORDS, k=length)
+        sentence[rng.randrange(length)] = rng.choice(_TOPICS)
+        if rng.random() < _NAME_RATE:
+            sentence[rng.randrange(length)] = rng.choice(_NAMES)
+        sentences.append(" ".join(sentence).capitalize() + ".")
+        words -= length
+    return " ".join(sentences)
+
+
+def write_pdf(path: Path, pages: list[str]) -> None:
+    """Write a minimal pdf with one line of text per page."""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", b""]
+    kids = []
+    for text in pages:
+        content = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET".encode()
+        page_id = len(objects) + 1
+        kids.append(f"{page_id} 0 R")
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Contents {page_id + 1} 0 R "
+            f"/Resources << /Font << /F1 << /Type /Font /Subtype /Type1 "
+            f"/BaseFont /Helvetica >> >> >> >>".encode(),
+        )
+        objects.append(
+            b"<< /Length %d >>\nstream\n%s\nendstream" % (len(content), content),
+        )
+    objects[1] = (
+        f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>".encode()
+    )
+
+    out = b"%PDF-1.4\n"
+    offsets = []
+    for i, obj in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (i, obj)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (
+        len(objects) + 1,
+        xref,
+    )
+    path.write_bytes(out)
+
+
+def write_pdf_corpus(
+    folder: Path,
+    files: int,
+    pages: int,
+    words: int = 400,
+    seed: int = 0,
+) -> list[Path]:
+    """Write a folder of pdf files with generated text.
+
+    Parameters
+    ----------
+    folder : Path
+        The folder of the pdf files, created if missing.
+    files : int
+        The number of pdf files.
+    pages : int
+        The number of pages of every file.
+    words : int
+        The number of words of every page.
+    seed : int
+        The seed of the generated text, the same seed writes the same files.
+
+    Returns
+    -------
+    list[Path]
+        The pdf files.
+
+    """
+    rng = random.Random(seed)  # noqa: S311
+    folder.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for i in range(files):
+        path = folder / f"doc_{i:04d}.pdf"
+        write_pdf(path, [fake_text(rng, words) for _ in range(pages)])
+        paths.append(path)
+    return paths
+
+
+def iter_fake_web_pages(
+    count: int,
+    words: int = 1500,
+    seed: int = 0,
+) -> Iterator[Document]:
+    """Generate lazily the documents of :func:`fake_web_pages`."""
+    rng = random.Random(seed)  # noqa: S311
+    for i in range(count):
+        yield Document(
+            page_content=fake_text(rng, words),
+            metadata={
+                "source": f"https://csc.example.org/page/{i}",
+                "title": f"Page {i}",
+                "language": "en",
+            },
+        )
+
+
+def fake_web_pages(count: int, words: int = 1500, seed: int = 0) -> list[Document]:
+    """Generate documents shaped like the web pages loaded by ``ingest``."""
+    return list(iter_fake_web_pages(count, words, seed))
@@ -0,0 +1,230 @@
+"""Concurrent download of the web pages, with an on-disk HTTP cache."""
+
+import logging
+import sqlite3
+import threading
+from collections import deque
+from collections.abc import Iterable, Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+from urllib.parse import urlsplit
+
+import httpx
+from bs4 import BeautifulSoup, Tag
+from langchain_core.documents import Document
+
+from chatbot import profiling
+from chatbot.settings import FetchSettings
+
+logger = logging.getLogger("app_logger")
+
+
+@dataclass
+class CachedResponse:
+    """The validators and the body of a downloaded page."""
+
+    etag: str
+    last_modified: str
+    text: str
+
+
+@dataclass
+class Page:
+    """A web page, downloaded or taken from the cache.
+
+    Attributes
+    ----------
+    url : str
+        The address of the page.
+    text : str
+        The html of the page.
+    not_modified : bool
+        Whether the server reported the cached page as still current.
+
+    """
+
+    url: str
+    text: str
+    not_modified: bool = False
+
+
+class ResponseCache:
+    """A sqlite store of the downloaded pages and of their HTTP validators.
+
+    Parameters
+    ----------
+    path : Path
+        The sqlite database file.
+
+    """
+
+    def __init__(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses "
+                "(url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, text TEXT)",
+            )
+
+    def get(self, url: str) -> CachedResponse | None:
+        """Get the cached response of the url, if any."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT etag, last_modified, text FROM responses WHERE url = ?",
+                (url,),
+            ).fetchone()
+        return CachedResponse(*row) if row is not None else None
+
+    def put(self, url: str, response: CachedResponse) -> None:
+        """Store the response of the url, replacing the previous one."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                (url, response.etag, response.last_modified, response.text),
+            )
+
+    def close(self) -> None:
+        """Close the underlying database."""
+        self._conn.close()
+
+
+class WebFetcher:
+    """Download web pages over a pool of connections.
+
+    Pages are requested concurrently, but never more than
+    ``settings.per_host`` at a time from the same host. With a cache, the
+    requests are conditional: a page reported as not modified is taken from
+    the cache instead of being downloaded again.
+
+    Parameters
+    ----------
+    settings : FetchSettings
+        The limits of the concurrent requests.
+    cache : ResponseCache | None
+        The cache of the downloaded pages.
+    client : httpx.Client | None
+        The client sending the requests, a new one when not given.
+
+    """
+
+    def __init__(
+        self,
+        settings: FetchSettings,
+        cache: ResponseCache | None = None,
+        client: httpx.Client | None = None,
+    ) -> None:
+        self.settings = settings
+        self.cache = cache
+        self._owns_client = client is None
+        self._client = client or httpx.Client(
+            timeout=settings.timeout,
+            follow_redirects=True,
+            limits=httpx.Limits(
+                max_connections=settings.concurrency,
+                max_keepalive_connections=settings.concurrency,
+            ),
+        )
+        self._hosts: dict[str, threading.BoundedSemaphore] = {}
+        self._lock = threading.Lock()
+
+    def _host_slots(self, url: str) -> threading.BoundedSemaphore:
+        host = urlsplit(url).netloc
+        with self._lock:
+            return self._hosts.setdefault(
+                host,
+                threading.BoundedSemaphore(self.settings.per_host),
+            )
+
+    def fetch_page(self, url: str) -> Page:
+        """Download a page, unless the cached one is still current.
+
+        Raises
+        ------
+        httpx.HTTPError
+            If the page could not be downloaded.
+
+        """
+        cached = self.cache.get(url) if self.cache is not None else None
+        headers = {}
+        if cached is not None and cached.etag:
+            headers["If-None-Match"] = cached.etag
+        if cached is not None and cached.last_modified:
+            headers["If-Modified-Since"] = cached.last_modified
+
+        with self._host_slots(url), profiling.span("fetch") as attrs:
+            response = self._client.get(url, headers=headers)
+            attrs["status"] = response.status_code
+
+        if cached is not None and response.status_code == httpx.codes.NOT_MODIFIED:
+            return Page(url, cached.text, not_modified=True)
+        response.raise_for_status()
+        if self.cache is not None:
+            self.cache.put(
+                url,
+                CachedResponse(
+                    response.headers.get("ETag", ""),
+                    response.headers.get("Last-Modified", ""),
+                    response.text,
+                ),
+            )
+        return Page(url, response.text)
+
+    def fetch(self, urls: Iterable[str]) -> Iterator[Page]:
+        """Download the pages, yielding them in the order of ``urls``.
+
+        At most twice ``settings.concurrency`` pages are downloaded ahead of
+        the consumer. A page that cannot be downloaded is taken from the cache,
+        or reported and skipped when it was never downloaded before.
+
+        Yields
+        ------
+        Page
+            The downloaded pages.
+
+        """
+        with ThreadPoolExecutor(max_workers=self.settings.concurrency) as pool:
+            pending: deque[tuple[str, Future[Page]]] = deque()
+            remaining = iter(urls)
+            while True:
+                while len(pending) < 2 * self.settings.concurrency:
+                    url = next(remaining, None)
+                    if url is None:
+                        break
+                    pending.append((url, pool.submit(self.fetch_page, url)))
+                if not pending:
+                    return
+                url, future = pending.popleft()
+                try:
+                    page = future.result()
+                except httpx.HTTPError as e:
+                    cached = self.cache.get(url) if self.cache is not None else None
+                    if cached is None:
+                        logger.warning("Could not fetch %s: %s", url, e)
+                        continue
+                    logger.warning("Could not fetch %s, using the cache: %s", url, e)
+                    page = Page(url, cached.text)
+                yield page
+
+    def close(self) -> None:
+        """Close the connections, if the client was created by the fetcher."""
+        if self._owns_client:
+            self._client.close()
+
+
+def parse_page(page: Page) -> Document:
+    """Extract the text and the metadata of a page, as ``WebBaseLoader`` does."""
+    soup = BeautifulSoup(page.text, "html.parser")
+    metadata: dict[str, Any] = {"source": page.url}
+    if title := soup.find("title"):
+        metadata["title"] = title.get_text()
+    description = soup.find("meta", attrs={"name": "description"})
+    if isinstance(description, Tag):
+        metadata["description"] = description.get("content", "No description found.")
+    html = soup.find("html")
+    if isinstance(html, Tag):
+        metadata["language"] = html.get("lang", "No language found.")
+    return Document(page_content=soup.get_text(), metadata=metadata)
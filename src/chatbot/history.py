@@ -0,0 +1,383 @@
+"""Token budgeted window over the chat history, with a rolling summary."""
+
+import json
+import logging
+import os
+import threading
+import uuid
+from collections.abc import Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any
+
+from langchain.memory import ChatMessageHistory
+from langchain.prompts import ChatPromptTemplate
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import (
+    AIMessage,
+    BaseMessage,
+    HumanMessage,
+    SystemMessage,
+    message_to_dict,
+    messages_from_dict,
+)
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.runnables import Runnable
+
+from chatbot.settings import HistorySettings
+from chatbot.utils import estimate_tokens
+
+logger = logging.getLogger("app_logger")
+
+# The size of the blocks read from the end of the chat log.
+_BLOCK_SIZE = 1 << 16
+
+SUMMARY_PROMPT = """Progressively summarize the lines of conversation provided, \
+adding onto the previous summary and returning a new summary. \
+Keep the names, facts and requests the user may refer to later.
+
+Current summary:
+{summary}
+
+New lines of conversation:
+{new_lines}
+
+New summary:"""
+
+
+def create_summarizer(llm: BaseChatModel) -> Runnable[dict[str, str], str]:
+    """Create the chain folding new lines of conversation into a summary."""
+    prompt = ChatPromptTemplate.from_messages([("human", SUMMARY_PROMPT)])
+    return prompt | llm | StrOutputParser()
+
+
+def _format_lines(messages: list[BaseMessage]) -> str:
+    names = {"human": "User", "ai": "Assistant"}
+    return "\n".join(
+        f"{names.get(message.type, message.type)}: {message.content}"
+        for message in messages
+    )
+
+
+class ChatLog:
+    """An append-only chat log, stored as one JSON record per line.
+
+    Every message is written as soon as it is added, with its sequence number
+    and the id of the session that produced it, so a crash loses nothing.
+    Loading reads the file backwards from the end, parsing only the messages
+    that are actually needed.
+
+    Parameters
+    ----------
+    path : Path
+        The log file.
+
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.session = uuid.uuid4().hex
+        last = self._read_tail(1)
+        self.next_seq: int = last[0]["seq"] + 1 if last else 0
+
+    def _read_tail(self, count: int) -> list[dict[str, Any]]:
+        if count <= 0 or not self.path.exists():
+            return []
+
+        with self.path.open("rb") as f:
+            end = f.seek(0, os.SEEK_END)
+            data = b""
+            while end > 0 and data.count(b"\n") <= count:
+                start = max(0, end - _BLOCK_SIZE)
+                f.seek(start)
+                data = f.read(end - start) + data
+                end = start
+
+        lines = [line for line in data.split(b"\n") if line.strip()]
+        return [json.loads(line) for line in lines[-count:]]
+
+    def tail(self, count: int) -> list[tuple[int, BaseMessage]]:
+        """Load the last messages of the log.
+
+        Parameters
+        ----------
+        count : int
+            The maximum number of messages to load.
+
+        Returns
+        -------
+        list[tuple[int, BaseMessage]]
+            The sequence number and the message, oldest first.
+
+        """
+        records = self._read_tail(count)
+        messages = messages_from_dict([record["message"] for record in records])
+        return [
+            (record["seq"], message)
+            for record, message in zip(records, messages, strict=True)
+        ]
+
+    def append(self, message: BaseMessage) -> int:
+        """Append a message to the log and return its sequence number."""
+        seq = self.next_seq
+        record = {
+            "seq": seq,
+            "session": self.session,
+            "time": datetime.now(tz=timezone.utc).isoformat(),
+            "message": message_to_dict(message),
+        }
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self.path.open("a") as f:
+            f.write(json.dumps(record) + "\n")
+        self.next_seq += 1
+        return seq
+
+    def _records(self) -> Iterator[dict[str, Any]]:
+        with self.path.open() as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    def compact(self, keep_sessions: int) -> int:
+        """Rewrite the log keeping only the last sessions.
+
+        Parameters
+        ----------
+        keep_sessions : int
+            The number of most recent sessions to keep.
+
+        Returns
+        -------
+        int
+            The number of messages dropped.
+
+        """
+        if not self.path.exists():
+            return 0
+
+        sessions = list(dict.fromkeys(record["session"] for record in self._records()))
+        keep = (
+            set(sessions[len(sessions) - keep_sessions :]) if keep_sessions else set()
+        )
+
+        dropped = 0
+        tmp = self.path.with_suffix(".tmp")
+        with tmp.open("w") as f:
+            for record in self._records():
+                if record["session"] in keep:
+                    f.write(json.dumps(record) + "\n")
+                else:
+                    dropped += 1
+        tmp.replace(self.path)
+        return dropped
+
+    def migrate(self, messages: list[BaseMessage]) -> None:
+        """Import the messages of the old pickled history as a single session."""
+        session = self.session
+        self.session = "migrated"
+        for message in messages:
+            self.append(message)
+        self.session = session
+
+
+class HistoryWindow:
+    """The last turns of a chat history that fit a token budget.
+
+    Turns falling out of the window are folded into a running summary by a
+    background thread, after the answer has been shown, so summarizing never
+    adds to the latency of a turn. Until the summary catches up, the turns
+    being summarized are left out of the prompt.
+
+    Parameters
+    ----------
+    history : ChatMessageHistory
+        The complete chat history.
+    settings : HistorySettings
+        The size of the window.
+    summarizer : Runnable | None
+        The chain that folds turns into the summary, see
+        :func:`create_summarizer`. Without it, older turns are just dropped.
+    summary : str
+        The summary of the first ``summarized`` messages of the history.
+    summarized : int
+        The number of messages covered by ``summary``.
+    log : ChatLog | None
+        The log where every new message is appended.
+
+    Attributes
+    ----------
+    offset : int
+        The sequence number in the log of the first message of ``history``.
+
+    """
+
+    def __init__(  # noqa: PLR0913
+        self,
+        history: ChatMessageHistory,
+        settings: HistorySettings,
+        summarizer: Runnable[dict[str, str], str] | None = None,
+        summary: str = "",
+        summarized: int = 0,
+        log: ChatLog | None = None,
+    ) -> None:
+        self.history = history
+        self.settings = settings
+        self.summarizer = summarizer
+        self.summary = summary
+        self.summarized = summarized
+        self.log = log
+        self.offset = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._pending: Future[Any] | None = None
+
+    def add_message(self, message: BaseMessage) -> None:
+        """Add a message to the history and to the log."""
+        self.history.add_message(message)
+        if self.log is not None:
+            self.log.append(message)
+
+    def add_user_message(self, message: str) -> None:
+        """Add a user message to the history."""
+        self.add_message(HumanMessage(content=message))
+
+    def add_ai_message(self, message: str) -> None:
+        """Add an AI message to the history."""
+        self.add_message(AIMessage(content=message))
+
+    def window_start(self) -> int:
+        """Get the index of the first message of the window.
+
+        The window always contains the last message, and always starts with a
+        user message.
+        """
+        messages = self.history.messages
+        start = len(messages)
+        tokens = turns = 0
+        for i in range(len(messages) - 1, -1, -1):
+            tokens += estimate_tokens(str(messages[i].content))
+            turns += isinstance(messages[i], HumanMessage)
+            if start < len(messages) and (
+                tokens > self.settings.max_tokens or turns > self.settings.max_turns
+            ):
+                break
+            start = i
+
+        while start < len(messages) - 1 and not isinstance(
+            messages[start],
+            HumanMessage,
+        ):
+            start += 1
+        return start
+
+    @property
+    def messages(self) -> list[BaseMessage]:
+        """Get the summary of the older turns followed by the window."""
+        window = self.history.messages[self.window_start() :]
+        with self._lock:
+            summary = self.summary
+        if not summary:
+            return window
+        return [
+            SystemMessage(content=f"Summary of the earlier conversation:\n{summary}"),
+            *window,
+        ]
+
+    def summarize(self) -> None:
+        """Fold the turns that left the window into the summary, in background."""
+        if self.summarizer is None:
+            return
+        if self._pending is not None and not self._pending.done():
+            # the next call catches up with the turns left behind
+            return
+
+        start = self.window_start()
+        with self._lock:
+            if start <= self.summarized:
+                return
+            new = self.history.messages[self.summarized : start]
+
+        # bound the cost of a summary, e.g. when loading a long history
+        tokens = 0
+        for i in range(len(new) - 1, -1, -1):
+            tokens += estimate_tokens(str(new[i].content))
+            if tokens > self.settings.max_tokens:
+                logger.warning(
+                    "Left %d messages out of the summary, over %d tokens.",
+                    i + 1,
+                    self.settings.max_tokens,
+                )
+                new = new[i + 1 :]
+                break
+
+        self._pending = self._executor.submit(
+            self._fold,
+            self.summarizer,
+            new,
+            start,
+        )
+
+    def _fold(
+        self,
+        summarizer: Runnable[dict[str, str], str],
+        messages: list[BaseMessage],
+        summarized: int,
+    ) -> None:
+        try:
+            summary = summarizer.invoke(
+                {"summary": self.summary, "new_lines": _format_lines(messages)},
+            )
+        except Exception:
+            logger.exception("Could not summarize the chat history.")
+            return
+        with self._lock:
+            self.summary = summary
+            self.summarized = summarized
+        logger.debug("Summarized the first %d messages.", summarized)
+
+    def close(self) -> None:
+        """Wait for the running summary to complete."""
+        self._executor.shutdown(wait=True)
+
+
+def load_history(
+    log: ChatLog,
+    settings: HistorySettings,
+    summarizer: Runnable[dict[str, str], str] | None,
+    summary: tuple[str, int],
+) -> HistoryWindow:
+    """Load from the log the messages needed by a history window.
+
+    Parameters
+    ----------
+    log : ChatLog
+        The chat log.
+    settings : HistorySettings
+        The size of the window.
+    summarizer : Runnable | None
+        The chain that folds turns into the summary.
+    summary : tuple[str, int]
+        The saved summary and the sequence number of the first message it does
+        not cover.
+
+    Returns
+    -------
+    HistoryWindow
+        The history window, appending new messages to the log.
+
+    """
+    # the window, and as many messages waiting to be summarized
+    records = log.tail(4 * settings.max_turns)
+    offset = records[0][0] if records else log.next_seq
+    text, summary_seq = summary
+    window = HistoryWindow(
+        ChatMessageHistory(messages=[message for _, message in records]),
+        settings,
+        summarizer,
+        text,
+        min(max(summary_seq - offset, 0), len(records)),
+        log,
+    )
+    window.offset = offset
+    return window
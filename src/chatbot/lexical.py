@@ -0,0 +1,239 @@
+"""Lexical inverted index of the chunks, and the hybrid retriever using it."""
+
+import json
+import math
+import re
+import sqlite3
+import threading
+from collections import Counter
+from collections.abc import Iterable
+from pathlib import Path
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.vectorstores import VectorStore
+
+from chatbot import profiling
+from chatbot.manifest import chunk_id
+from chatbot.settings import RetrievalMode
+
+_TOKEN = re.compile(r"\w+")
+
+# Keep the number of bound parameters of a query below the sqlite limit.
+_SQL_BATCH = 500
+
+
+def tokenize(text: str) -> list[str]:
+    """Split a text in lowercase words, keeping numbers and codes whole."""
+    return _TOKEN.findall(text.lower())
+
+
+class LexicalIndex:
+    """An inverted index of the chunks, stored in sqlite and ranked with BM25.
+
+    The index keeps the content and the metadata of every chunk, so lexical
+    searches are answered without the vector store and without embedding the
+    query.
+
+    Parameters
+    ----------
+    path : Path
+        The sqlite database file.
+    k1 : float
+        The BM25 term frequency saturation.
+    b : float
+        The BM25 length normalization.
+
+    """
+
+    def __init__(self, path: Path, k1: float = 1.2, b: float = 0.75) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS chunks "
+                "(id TEXT PRIMARY KEY, length INTEGER, content TEXT, metadata TEXT)",
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS postings (term TEXT, chunk TEXT, "
+                "tf INTEGER, PRIMARY KEY (term, chunk)) WITHOUT ROWID",
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS postings_chunk ON postings (chunk)",
+            )
+
+    def __len__(self) -> int:
+        """Count the indexed chunks."""
+        with self._lock:
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()
+        return int(count)
+
+    def _delete(self, ids: list[str]) -> None:
+        for i in range(0, len(ids), _SQL_BATCH):
+            batch = ids[i : i + _SQL_BATCH]
+            marks = ",".join("?" * len(batch))
+            self._conn.execute(
+                f"DELETE FROM postings WHERE chunk IN ({marks})",  # noqa: S608
+                batch,
+            )
+            self._conn.execute(
+                f"DELETE FROM chunks WHERE id IN ({marks})",  # noqa: S608
+                batch,
+            )
+
+    def add(self, chunks: dict[str, Document]) -> None:
+        """Index the chunks by id, replacing the chunks with the same id."""
+        with self._lock, self._conn:
+            self._delete(list(chunks))
+            for id_, chunk in chunks.items():
+                terms = Counter(tokenize(chunk.page_content))
+                self._conn.execute(
+                    "INSERT INTO chunks VALUES (?, ?, ?, ?)",
+                    (
+                        id_,
+                        sum(terms.values()),
+                        chunk.page_content,
+                        json.dumps(chunk.metadata),
+                    ),
+                )
+                self._conn.executemany(
+                    "INSERT INTO postings VALUES (?, ?, ?)",
+                    ((term, id_, tf) for term, tf in terms.items()),
+                )
+
+    def delete(self, ids: Iterable[str]) -> None:
+        """Remove the chunks from the index."""
+        with self._lock, self._conn:
+            self._delete(list(ids))
+
+    def search(self, query: str, k: int) -> list[tuple[str, float]]:
+        """Rank the chunks matching the words of the query.
+
+        Parameters
+        ----------
+        query : str
+            The query.
+        k : int
+            The maximum number of chunks returned.
+
+        Returns
+        -------
+        list[tuple[str, float]]
+            The id and the BM25 score of the best chunks, best first.
+
+        """
+        scores: dict[str, float] = {}
+        with self._lock:
+            count, average = self._conn.execute(
+                "SELECT COUNT(*), AVG(length) FROM chunks",
+            ).fetchone()
+            if not count:
+                return []
+            for term, query_tf in Counter(tokenize(query)).items():
+                rows = self._conn.execute(
+                    "SELECT chunk, tf, length FROM postings "
+                    "JOIN chunks ON chunks.id = postings.chunk WHERE term = ?",
+                    (term,),
+                ).fetchall()
+                idf = math.log(1 + (count - len(rows) + 0.5) / (len(rows) + 0.5))
+                for id_, tf, length in rows:
+                    norm = self.k1 * (1 - self.b + self.b * length / (average or 1))
+                    scores[id_] = scores.get(id_, 0.0) + (
+                        query_tf * idf * tf * (self.k1 + 1) / (tf + norm)
+                    )
+        return sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:k]
+
+    def documents(self, ids: list[str]) -> dict[str, Document]:
+        """Get the indexed chunks by id, leaving out the unknown ids."""
+        found: dict[str, Document] = {}
+        with self._lock:
+            for i in range(0, len(ids), _SQL_BATCH):
+                batch = ids[i : i + _SQL_BATCH]
+                marks = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    "SELECT id, content, metadata FROM chunks "  # noqa: S608
+                    f"WHERE id IN ({marks})",
+                    batch,
+                )
+                for id_, content, metadata in rows:
+                    found[id_] = Document(
+                        page_content=content,
+                        metadata=json.loads(metadata),
+                    )
+        return found
+
+    def close(self) -> None:
+        """Close the underlying database."""
+        self._conn.close()
+
+
+class HybridRetriever(BaseRetriever):
+    """Retrieve chunks by fusing a vector search with a lexical search.
+
+    The two rankings are combined with reciprocal rank fusion, so exact names,
+    room numbers and course codes are found even when the embeddings miss
+    them. The ``lexical`` mode searches only the lexical index and makes no
+    embedding call, the ``vector`` mode only the vector store.
+
+    Attributes
+    ----------
+    vectorstore : VectorStore
+        The store of the chunk vectors.
+    lexical : LexicalIndex
+        The lexical index of the same chunks.
+    mode : RetrievalMode
+        Which searches are run, "hybrid", "vector" or "lexical".
+    k : int
+        The number of chunks retrieved.
+    fetch_k : int
+        The number of chunks ranked by each search before the fusion.
+    rrf_k : int
+        The rank constant of the reciprocal rank fusion.
+
+    """
+
+    vectorstore: VectorStore
+    lexical: LexicalIndex
+    mode: RetrievalMode = "hybrid"
+    k: int = 4
+    fetch_k: int = 20
+    rrf_k: int = 60
+
+    def _get_relevant_documents(
+        self,
+        query: str,
+        *,
+        run_manager: CallbackManagerForRetrieverRun,
+    ) -> list[Document]:
+        if self.mode == "vector":
+            with profiling.span("vector_search"):
+                return self.vectorstore.similarity_search(query, k=self.k)
+        if self.mode == "lexical":
+            with profiling.span("lexical_search"):
+                ranked = [id_ for id_, _ in self.lexical.search(query, self.k)]
+                found = self.lexical.documents(ranked)
+            return [found[id_] for id_ in ranked if id_ in found]
+
+        with profiling.span("vector_search"):
+            dense = {
+                chunk_id(doc): doc
+                for doc in self.vectorstore.similarity_search(query, k=self.fetch_k)
+            }
+        with profiling.span("lexical_search"):
+            lexical = [id_ for id_, _ in self.lexical.search(query, self.fetch_k)]
+
+        scores: dict[str, float] = {}
+        for ranking in (list(dense), lexical):
+            for rank, id_ in enumerate(ranking, start=1):
+                scores[id_] = scores.get(id_, 0.0) + 1 / (self.rrf_k + rank)
+        best = sorted(scores, key=lambda id_: -scores[id_])[: self.k]
+
+        found = {
+            **self.lexical.documents([id_ for id_ in best if id_ not in dense]),
+            **dense,
+        }
+        return [found[id_] for id_ in best if id_ in found]
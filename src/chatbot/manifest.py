@@ -0,0 +1,125 @@
+"""Manifest of the ingested sources, used to update the memory incrementally."""
+
+import hashlib
+import json
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any
+
+from langchain_core.documents import Document
+
+MANIFEST_VERSION = 1
+
+
+@dataclass
+class SourceEntry:
+    """The ingested state of a single source (a pdf file or a web page)."""
+
+    file_format: str
+    hash: str
+    chunks: list[str] = field(default_factory=list)
+
+
+@dataclass
+class Manifest:
+    """The hashes of every ingested source and of the chunks built from it."""
+
+    chunk_size: int
+    overlap: int
+    length_unit: str = "chars"
+    embedding: str = ""
+    sources: dict[str, SourceEntry] = field(default_factory=dict)
+
+    def is_changed(self, source: str, source_hash: str) -> bool:
+        """Check if a source is new or differs from the ingested one."""
+        entry = self.sources.get(source)
+        return entry is None or entry.hash != source_hash
+
+    def removed(self, file_format: str, current: set[str]) -> list[str]:
+        """List the ingested sources of a format that are not in ``current``."""
+        return [
+            source
+            for source, entry in self.sources.items()
+            if entry.file_format == file_format and source not in current
+        ]
+
+
+def load_manifest(path: Path) -> Manifest | None:
+    """Load the manifest, if it exists.
+
+    Parameters
+    ----------
+    path : Path
+        The manifest file.
+
+    Returns
+    -------
+    Manifest | None
+        The manifest or ``None`` if the file does not exist.
+
+    """
+    if not path.exists():
+        return None
+    with path.open() as f:
+        return parse_manifest(json.load(f))
+
+
+def parse_manifest(data: dict[str, Any]) -> Manifest:
+    """Build the manifest from its JSON data.
+
+    Raises
+    ------
+    ValueError
+        If the data is of another version of the manifest.
+
+    """
+    if data.get("version") != MANIFEST_VERSION:
+        msg = f"Unsupported manifest version: {data.get('version')}."
+        raise ValueError(msg)
+    return Manifest(
+        chunk_size=data["chunk_size"],
+        overlap=data["overlap"],
+        length_unit=data.get("length_unit", "chars"),
+        embedding=data.get("embedding", ""),
+        sources={
+            source: SourceEntry(**entry) for source, entry in data["sources"].items()
+        },
+    )
+
+
+def manifest_data(manifest: Manifest) -> dict[str, Any]:
+    """Get the JSON data of the manifest, read by :func:`parse_manifest`."""
+    return {"version": MANIFEST_VERSION, **asdict(manifest)}
+
+
+def save_manifest(manifest: Manifest, path: Path) -> None:
+    """Atomically write the manifest to the path."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    with tmp.open("w") as f:
+        json.dump(manifest_data(manifest), f)
+    tmp.replace(path)
+
+
+def file_hash(path: Path) -> str:
+    """Compute the sha256 digest of a file."""
+    digest = hashlib.sha256()
+    with path.open("rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def text_hash(text: str) -> str:
+    """Compute the sha256 digest of a text."""
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def chunk_id(chunk: Document) -> str:
+    """Compute the id of a chunk from its content and metadata.
+
+    The id is used as the Chroma document id, so an unchanged chunk keeps its
+    vector across ingests.
+    """
+    metadata = json.dumps(chunk.metadata, sort_keys=True, default=str)
+    return text_hash(metadata + "\0" + chunk.page_content)
@@ -1,39 +1,221 @@
 """Memory management for the chatbot."""
 
+import itertools
+import json
+import logging
 import pickle
+import re
+from collections import deque
+from collections.abc import Iterable, Iterator
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass, replace
 from pathlib import Path
+from typing import Any
 
+import chromadb
 import click
+import numpy as np
 import yaml
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+from chromadb.api.models.Collection import Collection
 from langchain_chroma import Chroma
-from langchain_community.document_loaders.pdf import PyPDFDirectoryLoader
-from langchain_community.document_loaders.web_base import WebBaseLoader
+from langchain_community.document_loaders.pdf import PyPDFLoader
 from langchain_core.documents import Document
 from langchain_core.embeddings import Embeddings
 from langchain_core.messages import BaseMessage
-from langchain_openai import OpenAIEmbeddings
+from langchain_core.retrievers import BaseRetriever
 
+from chatbot import profiling
+from chatbot.batching import Batch, VectorSink, checkpoint_params, embed_and_store
 from chatbot.cli import __app_name__
+from chatbot.context import CompressedRetriever
+from chatbot.fetch import Page, ResponseCache, WebFetcher, parse_page
+from chatbot.history import ChatLog
+from chatbot.lexical import HybridRetriever, LexicalIndex
+from chatbot.manifest import (
+    Manifest,
+    SourceEntry,
+    chunk_id,
+    file_hash,
+    load_manifest,
+    save_manifest,
+    text_hash,
+)
+from chatbot.pipeline import IngestProgress, stage
+from chatbot.rerank import CrossEncoderScorer, RerankingRetriever
+from chatbot.routing import RetrieverPool, RoutingRetriever
+from chatbot.settings import (
+    DEFAULT_COLLECTION,
+    BatchSettings,
+    ContextSettings,
+    FetchSettings,
+    LengthUnit,
+    RerankSettings,
+    RetrievalMode,
+    VectorStoreSettings,
+)
+from chatbot.snapshot import read_chunks, read_header, write_snapshot
+from chatbot.splitting import get_text_splitter, iter_split
+from chatbot.vectorstore import CompactVectorStore
 
 APP_DIR = Path(click.get_app_dir(__app_name__))
 MEMORY = APP_DIR / "memory"
 CHAT_MEMORY = MEMORY / "history.pkl"
+CHAT_LOG = MEMORY / "history.jsonl"
+CHAT_SUMMARY = MEMORY / "summary.json"
 CHROMA_PATH = MEMORY / "chroma"
+MANIFEST_PATH = MEMORY / "manifest.json"
+EMBEDDING_CACHE = MEMORY / "embedding_cache.sqlite"
+CHECKPOINT_PATH = MEMORY / "ingest.checkpoint"
+ANSWER_CACHE = MEMORY / "answer_cache.sqlite"
+LEXICAL_INDEX = MEMORY / "lexical.sqlite"
+WEB_CACHE = MEMORY / "web_cache.sqlite"
+VECTOR_PATH = MEMORY / "vectors"
+COLLECTIONS = MEMORY / "collections"
 
+# The file listing the web pages, in the folder given to ``ingest -f web``.
+PAGES_FILE = "csc.yml"
 
-def load_documents() -> list[Document]:
-    """Load the documents from filesystem."""
-    path = ""
-    with Path(path).open() as f:
+# The collection of the chunks in a chroma database, named as langchain does.
+CHROMA_COLLECTION = "langchain"
+
+# The chunks read at a time from the vector store to build the lexical index.
+LEXICAL_BATCH = 1000
+
+logger = logging.getLogger("app_logger")
+
+MemoryStore = Chroma | CompactVectorStore
+
+STORE_NAMES = {"chroma": "Chroma database", "compact": "Compact vector store"}
+
+_COLLECTION_NAME = re.compile(r"[A-Za-z0-9][A-Za-z0-9_-]*")
+
+
+@dataclass
+class CollectionPaths:
+    """The files of the chunks of a collection."""
+
+    chroma: Path
+    vectors: Path
+    manifest: Path
+    checkpoint: Path
+    lexical: Path
+
+
+def collection_paths(name: str = DEFAULT_COLLECTION) -> CollectionPaths:
+    """Get the files of a collection.
+
+    The default collection is stored in the memory folder itself, the others
+    in a folder of their own under ``COLLECTIONS``.
+
+    Raises
+    ------
+    ValueError
+        If the name is not made of letters, digits, dashes and underscores.
+
+    """
+    if name == DEFAULT_COLLECTION:
+        return CollectionPaths(
+            CHROMA_PATH,
+            VECTOR_PATH,
+            MANIFEST_PATH,
+            CHECKPOINT_PATH,
+            LEXICAL_INDEX,
+        )
+    if not _COLLECTION_NAME.fullmatch(name):
+        msg = f"Invalid collection name: {name!r}."
+        raise ValueError(msg)
+    folder = COLLECTIONS / name
+    return CollectionPaths(
+        folder / "chroma",
+        folder / "vectors",
+        folder / "manifest.json",
+        folder / "ingest.checkpoint",
+        folder / "lexical.sqlite",
+    )
+
+
+def list_collections() -> list[str]:
+    """List the collections that have been ingested."""
+    names = [DEFAULT_COLLECTION] if MANIFEST_PATH.exists() else []
+    if COLLECTIONS.is_dir():
+        names.extend(
+            sorted(
+                folder.name
+                for folder in COLLECTIONS.iterdir()
+                if (folder / "manifest.json").exists()
+            ),
+        )
+    return names
+
+
+def load_pages(path: Path) -> list[str]:
+    """Load the urls of the web pages listed in a yaml file."""
+    with path.open() as f:
         data = yaml.safe_load(f)
-    pages = data["pages"]
-    loader = WebBaseLoader(pages)
-    return loader.load()
+    return list(data["pages"])
+
+
+def fetch_pages(urls: Iterable[str], settings: FetchSettings) -> Iterator[Page]:
+    """Download the web pages, asking again only for the modified ones.
+
+    The downloaded pages are kept in a cache, and a page the server reports
+    as not modified is taken from there.
+    """
+    cache = ResponseCache(WEB_CACHE)
+    fetcher = WebFetcher(settings, cache)
+    fetched = not_modified = 0
+    try:
+        for page in fetcher.fetch(urls):
+            fetched += 1
+            not_modified += page.not_modified
+            yield page
+    finally:
+        fetcher.close()
+        cache.close()
+    logger.info("Fetched %d pages, %d not modified.", fetched, not_modified)
+
+
+def load_changed_pages(
+    path: Path,
+    manifest: Manifest,
+    settings: FetchSettings,
+) -> tuple[dict[str, str], Iterator[Document]]:
+    """Download the web pages listed in a yaml file, parsing the changed ones.
+
+    Parameters
+    ----------
+    path : Path
+        The yaml file listing the pages.
+    manifest : Manifest
+        The manifest of the ingested sources.
+    settings : FetchSettings
+        The limits of the concurrent downloads.
+
+    Returns
+    -------
+    tuple[dict[str, str], Iterator[Document]]
+        The hash of every listed page and the documents of the new and changed
+        ones, downloaded and parsed lazily. The hash of a page is added when
+        it is downloaded, and a page that could not be downloaded keeps its
+        ingested hash.
+
+    """
+    urls = load_pages(path)
+    hashes = {
+        url: manifest.sources[url].hash for url in urls if url in manifest.sources
+    }
+
+    def changed() -> Iterator[Document]:
+        for page in fetch_pages(urls, settings):
+            hashes[page.url] = text_hash(page.text)
+            if manifest.is_changed(page.url, hashes[page.url]):
+                yield parse_page(page)
+
+    return hashes, changed()
 
 
 def load_chat_messages() -> list[BaseMessage]:
-    """Load the chat messages from the memory.
+    """Load the chat messages pickled by older versions.
 
     Returns
     -------
@@ -47,95 +229,922 @@ def load_chat_messages() -> list[BaseMessage]:
         return pickle.load(f)  # noqa: S301
 
 
-def save_chat_messages(messages: list[BaseMessage]) -> None:
-    """Save the chat messages to the memory.
+def open_chat_log() -> ChatLog:
+    """Open the chat log, migrating the pickled history of older versions.
+
+    Returns
+    -------
+    ChatLog
+        The chat log.
+
+    """
+    log = ChatLog(CHAT_LOG)
+    if CHAT_MEMORY.exists():
+        log.migrate(load_chat_messages())
+        CHAT_MEMORY.rename(CHAT_MEMORY.with_suffix(".pkl.migrated"))
+        logger.info("Migrated the chat history to %s.", CHAT_LOG)
+    return log
+
+
+def load_chat_summary() -> tuple[str, int]:
+    """Load the summary of the older chat messages.
+
+    Returns
+    -------
+    tuple[str, int]
+        The summary and the sequence number of the first message it does not
+        cover.
+
+    """
+    if not CHAT_SUMMARY.exists():
+        return "", 0
+    with CHAT_SUMMARY.open() as f:
+        data = json.load(f)
+    return data["summary"], data["seq"]
+
+
+def save_chat_summary(summary: str, seq: int) -> None:
+    """Save the summary of the older chat messages.
 
     Parameters
     ----------
-    messages : list[BaseMessage]
-        The list of chat messages to save.
+    summary : str
+        The summary.
+    seq : int
+        The sequence number of the first message it does not cover.
 
     """
-    if not CHAT_MEMORY.parent.exists():
-        CHAT_MEMORY.parent.mkdir()
-    with CHAT_MEMORY.open("wb") as f:
-        pickle.dump(messages, f)
+    CHAT_SUMMARY.parent.mkdir(parents=True, exist_ok=True)
+    with CHAT_SUMMARY.open("w") as f:
+        json.dump({"summary": summary, "seq": seq}, f)
+
+
+def list_pdfs(path: str | Path) -> list[Path]:
+    """List the visible pdf files under the path, in a stable order."""
+    root = Path(path)
+    return sorted(
+        pdf
+        for pdf in root.glob("**/[!.]*.pdf")
+        if pdf.is_file()
+        and not any(part.startswith(".") for part in pdf.relative_to(root).parts)
+    )
+
+
+def load_pdf(path: Path) -> list[Document]:
+    """Load the pages of a single pdf file."""
+    docs = PyPDFLoader(str(path)).load()
+    for doc in docs:
+        doc.metadata["source"] = str(path)
+    return docs
 
 
 def load_pdfs(path: str | Path) -> list[Document]:
     """Load the pdfs from the path."""
-    loader = PyPDFDirectoryLoader(path)
-    return loader.load()
+    docs = []
+    for pdf in list_pdfs(path):
+        docs.extend(load_pdf(pdf))
+    return docs
 
 
 def split_text(
     documents: list[Document],
     chunk_size: int,
     overlap: int,
+    unit: LengthUnit = "chars",
+    workers: int = 1,
+) -> list[Document]:
+    """Split the text into chunks, see :func:`chatbot.splitting.iter_split`."""
+    chunks = list(iter_split(documents, chunk_size, overlap, unit, workers))
+    logger.info("Split %d documents in %d chunks.", len(documents), len(chunks))
+    return chunks
+
+
+def split_stages(
+    documents: Iterable[Document],
+    chunk_size: int,
+    overlap: int,
+    unit: LengthUnit = "chars",
+    workers: int = 1,
+    progress: IngestProgress | None = None,
+) -> Iterator[Document]:
+    """Load and split the documents in two stages of the ingest pipeline.
+
+    The documents are loaded in a thread and split in another, each ahead of
+    the next stage by a bounded queue, see :func:`chatbot.pipeline.stage`.
+    """
+    pages = stage(documents, "load", progress, "pages")
+    return stage(
+        iter_split(pages, chunk_size, overlap, unit, workers),
+        "split",
+        progress,
+        "chunks",
+    )
+
+
+def _load_and_split_pdf(
+    path: Path,
+    chunk_size: int,
+    overlap: int,
+    unit: LengthUnit,
 ) -> list[Document]:
-    """Split the text into chunks."""
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=chunk_size,
-        chunk_overlap=overlap,
-        length_function=len,
-        add_start_index=True,
+    text_splitter = get_text_splitter(chunk_size, overlap, unit)
+    return text_splitter.split_documents(load_pdf(path))
+
+
+def split_pdfs(
+    pdfs: list[Path],
+    chunk_size: int,
+    overlap: int,
+    workers: int = 1,
+    unit: LengthUnit = "chars",
+) -> Iterator[Document]:
+    """Parse and split the pdf files, yielding their chunks.
+
+    Files are processed by a pool of ``workers`` processes, at most two files
+    per worker ahead of the consumer, but the chunks are always yielded in the
+    order of ``pdfs``, so the result is the same as a serial run. A file that
+    cannot be parsed is reported and skipped.
+
+    Parameters
+    ----------
+    pdfs : list[Path]
+        The pdf files.
+    chunk_size : int
+        The maximum length of each chunk.
+    overlap : int
+        The length each chunk overlaps with the previous.
+    workers : int
+        The number of processes used to parse the files.
+    unit : LengthUnit
+        "chars" or "tokens", how the lengths are measured.
+
+    Yields
+    ------
+    Document
+        The chunks of each pdf file.
+
+    """
+    if workers <= 1:
+        for pdf in pdfs:
+            try:
+                chunks = _load_and_split_pdf(pdf, chunk_size, overlap, unit)
+            except Exception as e:  # noqa: BLE001
+                logger.warning("Could not parse %s: %s", pdf, e)
+                continue
+            yield from chunks
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending: deque[tuple[Path, Future[list[Document]]]] = deque()
+        remaining = iter(pdfs)
+        while True:
+            for pdf in itertools.islice(remaining, 2 * workers - len(pending)):
+                args = (pdf, chunk_size, overlap, unit)
+                pending.append((pdf, pool.submit(_load_and_split_pdf, *args)))
+            if not pending:
+                return
+            pdf, future = pending.popleft()
+            try:
+                chunks = future.result()
+            except Exception as e:  # noqa: BLE001
+                logger.warning("Could not parse %s: %s", pdf, e)
+                continue
+            yield from chunks
+
+
+def iter_pdf_chunks(
+    path: str | Path,
+    chunk_size: int,
+    overlap: int,
+    workers: int = 1,
+    unit: LengthUnit = "chars",
+) -> Iterator[Document]:
+    """Parse and split the pdfs under the path, see :func:`split_pdfs`."""
+    return split_pdfs(list_pdfs(path), chunk_size, overlap, workers, unit)
+
+
+def memory_path(store: VectorStoreSettings) -> Path:
+    """Get the folder of the vector store of the backend and the collection."""
+    paths = collection_paths(store.collection)
+    return paths.vectors if store.backend == "compact" else paths.chroma
+
+
+def get_memory(
+    embeddings: Embeddings,
+    store: VectorStoreSettings | None = None,
+) -> MemoryStore:
+    """Get the vector store of the chunks, a chroma database by default."""
+    if store is None:
+        store = VectorStoreSettings()
+    if store.backend == "compact":
+        return CompactVectorStore(
+            memory_path(store),
+            embeddings,
+            store.dtype,
+            store.dimensions,
+        )
+    return Chroma(
+        CHROMA_COLLECTION,
+        embedding_function=embeddings,
+        persist_directory=str(memory_path(store)),
     )
 
-    chunks = text_splitter.split_documents(documents)
-    print(f"Number of docs: {len(documents)}")
-    print(f"Number of chunks: {len(chunks)}")
 
-    return chunks
+def chroma_collection(path: Path) -> Collection:
+    """Open the collection of the chunks of a chroma database.
+
+    The collection is opened with the public client of chroma, which shares
+    the database with the :class:`Chroma` stores of the same folder. It
+    upserts vectors computed elsewhere, which a :class:`Chroma` store cannot.
+    """
+    client = chromadb.PersistentClient(str(path))
+    return client.get_or_create_collection(CHROMA_COLLECTION, embedding_function=None)
 
 
-def get_memory(embeddings: Embeddings) -> Chroma:
-    """Get the chroma database."""
-    return Chroma(embedding_function=embeddings, persist_directory=str(CHROMA_PATH))
+def _vector_sink(db: MemoryStore, store: VectorStoreSettings) -> VectorSink:
+    if isinstance(db, CompactVectorStore):
+        return db
+    return chroma_collection(memory_path(store))
 
 
-def create_database_from_docs(docs: list[Document], model: Embeddings) -> Chroma:
+def convert_chroma(
+    source: Path,
+    store: VectorStoreSettings,
+    batch_size: int = 1000,
+) -> int:
+    """Copy the vectors of a chroma database into a new compact vector store.
+
+    The chunks keep their ids, so the manifest and the lexical index are still
+    valid once the compact store is configured.
+
+    Parameters
+    ----------
+    source : Path
+        The folder of the chroma database.
+    store : VectorStoreSettings
+        The collection and the type and dimensions of the stored vectors.
+    batch_size : int
+        The number of vectors read from chroma at a time.
+
+    Returns
+    -------
+    int
+        The number of copied vectors.
+
+    """
+    target_path = collection_paths(store.collection).vectors
+    if target_path.exists():
+        msg = f"{STORE_NAMES['compact']} already exists."
+        raise Exception(msg)
+    if not source.is_dir():
+        msg = f"There is no chroma database at {source}."
+        raise Exception(msg)
+
+    collection = chroma_collection(source)
+    target = CompactVectorStore(target_path, None, store.dtype, store.dimensions)
+    for offset in range(0, collection.count(), batch_size):
+        batch = collection.get(
+            include=["embeddings", "documents", "metadatas"],
+            limit=batch_size,
+            offset=offset,
+        )
+        target.upsert(
+            batch["ids"],
+            np.asarray(batch["embeddings"]),
+            [dict(metadata or {}) for metadata in batch["metadatas"] or []],
+            batch["documents"] or [],
+        )
+    return len(target)
+
+
+def _open_store(store: VectorStoreSettings) -> VectorSink:
+    if store.backend == "compact":
+        return CompactVectorStore(
+            memory_path(store),
+            None,
+            store.dtype,
+            store.dimensions,
+        )
+    return chroma_collection(memory_path(store))
+
+
+def export_snapshot(
+    target: Path,
+    store: VectorStoreSettings,
+    batch_size: int = 1000,
+) -> int:
+    """Write the collection of ``store`` to a snapshot file.
+
+    The snapshot holds the vectors, the chunks and the manifest, see
+    :mod:`chatbot.snapshot`, and is read by :func:`import_snapshot`.
+
+    Returns
+    -------
+    int
+        The number of exported chunks.
+
+    """
+    manifest = load_manifest(collection_paths(store.collection).manifest)
+    if manifest is None or not memory_path(store).exists():
+        msg = f"There is no {STORE_NAMES[store.backend].lower()} to export."
+        raise Exception(msg)
+    return write_snapshot(target, manifest, _open_store(store), batch_size)
+
+
+def import_snapshot(
+    source: Path,
+    store: VectorStoreSettings,
+    batch_size: int = 1000,
+) -> int:
+    """Create the collection of ``store`` from a snapshot file.
+
+    The chunks are upserted ``batch_size`` at a time with their vectors, so
+    nothing is embedded, and the lexical index and the manifest are written
+    too. The vectors are stored with the type and dimensions of ``store``.
+
+    Returns
+    -------
+    int
+        The number of imported chunks.
+
+    """
+    if memory_path(store).exists():
+        msg = f"{STORE_NAMES[store.backend]} already exists."
+        raise Exception(msg)
+    header = read_header(source)
+    paths = collection_paths(store.collection)
+    # left behind by a deleted database
+    paths.lexical.unlink(missing_ok=True)
+    collection = _open_store(store)
+    lexical = LexicalIndex(paths.lexical)
+    try:
+        for batch in read_chunks(source, batch_size):
+            collection.upsert(
+                batch.ids,
+                batch.embeddings,
+                # chroma types the values of the metadata, json does not
+                batch.metadatas,  # type: ignore[arg-type]
+                batch.documents,
+            )
+            lexical.add(
+                {
+                    id_: Document(page_content=text, metadata=metadata)
+                    for id_, text, metadata in zip(
+                        batch.ids,
+                        batch.documents,
+                        batch.metadatas,
+                        strict=True,
+                    )
+                },
+            )
+    finally:
+        lexical.close()
+    save_manifest(header.manifest, paths.manifest)
+    return header.count
+
+
+def check_embedding(model: str, store: VectorStoreSettings) -> None:
+    """Check that the collection of ``store`` was embedded with ``model``.
+
+    Collections ingested before the model was recorded are not checked.
+
+    Raises
+    ------
+    Exception
+        If the collection was embedded with another model, so its vectors
+        cannot be compared with those of the queries.
+
+    """
+    manifest = load_manifest(collection_paths(store.collection).manifest)
+    if manifest is not None and manifest.embedding not in ("", model):
+        msg = (
+            f"The collection {store.collection} was embedded with "
+            f"{manifest.embedding}, not {model}."
+        )
+        raise Exception(msg)
+
+
+def open_retriever(
+    embeddings: Embeddings,
+    mode: RetrievalMode,
+    k: int,
+    store: VectorStoreSettings,
+    model: str = "",
+) -> BaseRetriever:
+    """Open the retriever of the collection of ``store``, see :func:`get_retriever`."""
+    if model and mode != "lexical":
+        check_embedding(model, store)
+    db = get_memory(embeddings, store)
+    if mode == "vector":
+        return db.as_retriever(search_kwargs={"k": k})
+
+    lexical = LexicalIndex(collection_paths(store.collection).lexical)
+    if len(lexical) == 0:
+        logger.warning("The lexical index is empty, ingest again to build it.")
+        lexical.close()
+        return db.as_retriever(search_kwargs={"k": k})
+    return HybridRetriever(vectorstore=db, lexical=lexical, mode=mode, k=k)
+
+
+def close_retriever(retriever: BaseRetriever) -> None:
+    """Release the lexical index of a retriever.
+
+    The chroma client of a folder is shared by every handle of the process
+    and reused when the collection is opened again, so it is not stopped.
+    """
+    if isinstance(retriever, HybridRetriever):
+        retriever.lexical.close()
+
+
+def check_collections(names: list[str], store: VectorStoreSettings) -> None:
+    """Check that the collections have been ingested in the vector store.
+
+    Raises
+    ------
+    ValueError
+        If a collection is unknown or its name is invalid.
+
+    """
+    for name in names:
+        if not memory_path(replace(store, collection=name)).exists():
+            msg = f"Unknown collection: {name}."
+            raise ValueError(msg)
+
+
+def create_pool(
+    embeddings: Embeddings,
+    mode: RetrievalMode = "hybrid",
+    k: int = 4,
+    store: VectorStoreSettings | None = None,
+    model: str = "",
+) -> RetrieverPool:
+    """Create a pool opening the retrievers of the collections on demand.
+
+    Returns
+    -------
+    RetrieverPool
+        The pool, keeping at most ``store.max_open`` collections open.
+
+    """
+    if store is None:
+        store = VectorStoreSettings()
+    settings = store
+
+    def open_collection(name: str) -> BaseRetriever:
+        check_collections([name], settings)
+        collection = replace(settings, collection=name)
+        return open_retriever(embeddings, mode, k, collection, model)
+
+    def close_collection(name: str, retriever: BaseRetriever) -> None:
+        close_retriever(retriever)
+
+    return RetrieverPool(open_collection, close_collection, store.max_open)
+
+
+def get_retriever(  # noqa: PLR0913
+    embeddings: Embeddings,
+    mode: RetrievalMode = "hybrid",
+    k: int = 4,
+    store: VectorStoreSettings | None = None,
+    context: ContextSettings | None = None,
+    collections: list[str] | None = None,
+    pool: RetrieverPool | None = None,
+    model: str = "",
+    rerank: RerankSettings | None = None,
+) -> BaseRetriever:
+    """Get the retriever of the chunks stored in the memory.
+
+    Parameters
+    ----------
+    embeddings : Embeddings
+        The embedding model of the queries.
+    mode : RetrievalMode
+        "vector" for a dense search, "lexical" for a BM25 search that needs no
+        embedding call, "hybrid" to fuse the two.
+    k : int
+        The number of chunks retrieved.
+    store : VectorStoreSettings | None
+        The vector store of the chunks, chroma by default.
+    context : ContextSettings | None
+        How the retrieved chunks are compressed, their ``k`` replacing the
+        argument. ``None`` to return the chunks as they are retrieved.
+    collections : list[str] | None
+        The collections searched, the collection of ``store`` by default.
+    pool : RetrieverPool | None
+        The pool of the collections, a new one when several are searched.
+    model : str
+        The id of the embedding model, see :func:`chatbot.backends.embedding_id`,
+        checked against the model of every collection. Empty to skip the check.
+    rerank : RerankSettings | None
+        How the retrieved chunks are reranked by a cross-encoder, its ``k``
+        replacing the argument, before they are compressed. ``None`` to keep
+        the order of the retrieval.
+
+    Returns
+    -------
+    BaseRetriever
+        The retriever, a dense one when the lexical index has not been built.
+
+    """
+    if store is None:
+        store = VectorStoreSettings()
+    if context is not None:
+        retriever = get_retriever(
+            embeddings,
+            mode,
+            context.candidates,
+            store,
+            collections=collections,
+            pool=pool,
+            model=model,
+            rerank=rerank,
+        )
+        return CompressedRetriever(retriever=retriever, settings=context)
+    if rerank is not None:
+        retriever = get_retriever(
+            embeddings,
+            mode,
+            rerank.candidates,
+            store,
+            collections=collections,
+            pool=pool,
+            model=model,
+        )
+        scorer = CrossEncoderScorer(rerank.model, rerank.device)
+        # loaded now, since loading it would exceed the budget of a retrieval
+        scorer.load()
+        return RerankingRetriever(retriever=retriever, scorer=scorer, settings=rerank)
+
+    names = collections or [store.collection]
+    if pool is None and names == [store.collection]:
+        return open_retriever(embeddings, mode, k, store, model)
+    if pool is None:
+        pool = create_pool(embeddings, mode, k, store, model)
+    return RoutingRetriever(pool=pool, collections=names, k=k)
+
+
+def index_version(collections: list[str] | None = None) -> str:
+    """Fingerprint the searched collections, the result changes at every ingest."""
+    manifests = [
+        collection_paths(name).manifest for name in collections or [DEFAULT_COLLECTION]
+    ]
+    if not any(path.exists() for path in manifests):
+        return ""
+    if len(manifests) == 1:
+        return file_hash(manifests[0])
+    return text_hash(
+        "\0".join(file_hash(path) if path.exists() else "" for path in manifests),
+    )
+
+
+def create_database_from_docs(
+    docs: list[Document],
+    model: Embeddings,
+    ids: list[str] | None = None,
+) -> Chroma:
     """Create a chroma database from the documents."""
     # save to chroma
     db = Chroma.from_documents(
         documents=docs,
         embedding=model,
+        ids=ids,
         persist_directory=str(CHROMA_PATH),
     )
 
     return db
 
 
-def create_memory(
-    api_key: str,
-    resource: Path,
+def update_memory(  # noqa: PLR0913
+    model: Embeddings,
+    manifest: Manifest,
     file_format: str,
+    source_hashes: dict[str, str],
+    chunks: Iterable[Document],
+    batching: BatchSettings,
+    store: VectorStoreSettings | None = None,
+    progress: IngestProgress | None = None,
+) -> None:
+    """Bring the vector store in sync with the current sources.
+
+    Only the chunks that are not already stored are embedded, in batches as
+    described by ``batching``, and the vectors of the chunks that disappeared
+    are deleted. The lexical index is kept in sync with the same chunks, and
+    the manifest is updated in place.
+
+    The chunks are consumed lazily, one source at a time, so the memory used
+    does not grow with the number of chunks.
+
+    Parameters
+    ----------
+    model : Embeddings
+        The embedding model.
+    manifest : Manifest
+        The manifest of the ingested sources.
+    file_format : str
+        The format of the sources, either "pdf" or "web".
+    source_hashes : dict[str, str]
+        The hash of every current source of the format. The hash of a source
+        may be added until its first chunk is consumed.
+    chunks : Iterable[Document]
+        The chunks of the new and changed sources, grouped by source.
+    batching : BatchSettings
+        How the new chunks are sent to the embedding model.
+    store : VectorStoreSettings | None
+        The vector store of the chunks, chroma by default.
+    progress : IngestProgress | None
+        Where the stored chunks are counted, as the "embed" stage.
+
+    """
+    stale: set[str] = set()
+    for source in manifest.removed(file_format, set(source_hashes)):
+        stale.update(manifest.sources.pop(source).chunks)
+
+    if store is None:
+        store = VectorStoreSettings()
+    paths = collection_paths(store.collection)
+    if not memory_path(store).exists():
+        # left behind by a deleted database
+        paths.lexical.unlink(missing_ok=True)
+    db = get_memory(model, store)
+    lexical = LexicalIndex(paths.lexical)
+    # built for the first time, from every stored chunk at the end
+    rebuild = len(lexical) == 0
+    diff = _SourceDiff(manifest, file_format, source_hashes)
+    diff.see_changed()
+
+    def stored(batch: Batch) -> None:
+        # only the chunks whose vectors are stored are searchable
+        if not rebuild:
+            lexical.add(dict(batch))
+        if progress is not None:
+            progress.advance("embed", len(batch), unit="chunks")
+
+    try:
+        with profiling.span("embed_and_store") as attrs:
+            attrs["chunks"] = embed_and_store(
+                _vector_sink(db, store),
+                model,
+                diff.new_chunks(chunks),
+                batching,
+                paths.checkpoint,
+                stored,
+                _chunking(manifest.chunk_size, manifest.overlap, manifest.length_unit),
+            )
+        if progress is not None:
+            progress.finish("embed")
+        stale.update(diff.stale())
+        logger.info("Added %d chunks, deleting %d chunks.", diff.added, len(stale))
+        if stale:
+            with profiling.span("delete", chunks=len(stale)):
+                db.delete(ids=sorted(stale))
+        with profiling.span("lexical_index"):
+            if rebuild:
+                _index_stored(db, lexical)
+            else:
+                lexical.delete(stale)
+    finally:
+        lexical.close()
+
+
+class _SourceDiff:
+    """Compare the chunks of the sources with the ingested ones.
+
+    The manifest entry of a source is replaced as soon as its chunks are
+    seen, and the ids of its ingested chunks are kept to find the stale ones.
+    A changed source may split into no chunks at all, so every source whose
+    hash changed is seen, with or without chunks. The manifest is saved only
+    once every chunk is stored.
+    """
+
+    def __init__(
+        self,
+        manifest: Manifest,
+        file_format: str,
+        source_hashes: dict[str, str],
+    ) -> None:
+        self.manifest = manifest
+        self.file_format = file_format
+        self.source_hashes = source_hashes
+        self.ingested: dict[str, set[str]] = {}
+        self.added = 0
+
+    def new_chunks(self, chunks: Iterable[Document]) -> Iterator[tuple[str, Document]]:
+        """Yield the chunks not ingested yet."""
+        for source, group in itertools.groupby(chunks, key=_source):
+            source_chunks = list(group)
+            ids = [chunk_id(chunk) for chunk in source_chunks]
+            if source not in self.ingested:
+                self._see(source)
+            self.manifest.sources[source].chunks.extend(ids)
+            new = {
+                id_: chunk
+                for id_, chunk in zip(ids, source_chunks, strict=True)
+                if id_ not in self.ingested[source]
+            }
+            self.added += len(new)
+            yield from new.items()
+
+    def see_changed(self) -> None:
+        """See the changed sources known so far, before any of their chunks."""
+        for source, source_hash in list(self.source_hashes.items()):
+            if source not in self.ingested and self.manifest.is_changed(
+                source,
+                source_hash,
+            ):
+                self._see(source)
+
+    def stale(self) -> set[str]:
+        """Get the ingested chunks of the seen sources that are gone."""
+        # the hashes of the web pages are known once they are downloaded
+        self.see_changed()
+        stale: set[str] = set()
+        for source, old_ids in self.ingested.items():
+            stale.update(old_ids.difference(self.manifest.sources[source].chunks))
+        return stale
+
+    def _see(self, source: str) -> None:
+        old = self.manifest.sources.get(source)
+        self.ingested[source] = set(old.chunks) if old is not None else set()
+        self.manifest.sources[source] = SourceEntry(
+            file_format=self.file_format,
+            hash=self.source_hashes[source],
+        )
+
+
+def _source(chunk: Document) -> str:
+    return str(chunk.metadata["source"])
+
+
+def _index_stored(db: MemoryStore, lexical: LexicalIndex) -> None:
+    offset = 0
+    while True:
+        stored = db.get(
+            include=["documents", "metadatas"],
+            limit=LEXICAL_BATCH,
+            offset=offset,
+        )
+        if not stored["ids"]:
+            return
+        lexical.add(
+            {
+                id_: Document(page_content=content, metadata=metadata or {})
+                for id_, content, metadata in zip(
+                    stored["ids"],
+                    stored["documents"],
+                    stored["metadatas"],
+                    strict=True,
+                )
+            },
+        )
+        offset += len(stored["ids"])
+
+
+def _chunking(chunk_size: int, overlap: int, unit: str) -> dict[str, Any]:
+    return {"chunk_size": chunk_size, "overlap": overlap, "length_unit": unit}
+
+
+def _check_resumed(
     chunk_size: int,
     overlap: int,
+    unit: LengthUnit,
+    checkpoint: Path,
 ) -> None:
-    """Create a chroma database from the documents."""
-    if CHROMA_PATH.exists():
-        msg = "Chroma database already exists."
+    # the stored chunks of another split would be in no manifest
+    params = checkpoint_params(checkpoint)
+    if params and params != _chunking(chunk_size, overlap, unit):
+        msg = (
+            "The interrupted ingest split the chunks with chunk size "
+            f"{params['chunk_size']}, overlap {params['overlap']} and length "
+            f"unit {params['length_unit']}, resume it with the same parameters."
+        )
         raise Exception(msg)
 
-    embeddings = OpenAIEmbeddings(
-        model="text-embedding-3-large",
-        api_key=api_key,  # type: ignore
-    )
 
-    # load documents
-    chunks = []
+def _open_manifest(
+    chunk_size: int,
+    overlap: int,
+    unit: LengthUnit,
+    incremental: bool,
+    store: VectorStoreSettings,
+) -> Manifest:
+    manifest = Manifest(chunk_size=chunk_size, overlap=overlap, length_unit=unit)
+    paths = collection_paths(store.collection)
+    resume = paths.checkpoint.exists()
+    if resume:
+        _check_resumed(chunk_size, overlap, unit, paths.checkpoint)
+    if not memory_path(store).exists():
+        return manifest
+    name = STORE_NAMES[store.backend]
+    if not incremental and not resume:
+        msg = f"{name} already exists."
+        raise Exception(msg)
+
+    stored = load_manifest(paths.manifest)
+    if stored is None:
+        if not resume:
+            msg = f"The {name.lower()} has no manifest, it must be recreated."
+            raise Exception(msg)
+    elif (stored.chunk_size, stored.overlap, stored.length_unit) == (
+        chunk_size,
+        overlap,
+        unit,
+    ):
+        manifest = stored
+    else:
+        logger.info("Chunking parameters changed, every source is re-split.")
+        manifest.embedding = stored.embedding
+        manifest.sources = {
+            source: SourceEntry(entry.file_format, "", entry.chunks)
+            for source, entry in stored.sources.items()
+        }
+    return manifest
+
+
+def create_memory(  # noqa: PLR0913
+    embeddings: Embeddings,
+    resource: Path,
+    file_format: str,
+    chunk_size: int,
+    overlap: int,
+    workers: int = 1,
+    incremental: bool = False,
+    batching: BatchSettings | None = None,
+    fetching: FetchSettings | None = None,
+    store: VectorStoreSettings | None = None,
+    unit: LengthUnit = "chars",
+    model: str = "",
+    progress: IngestProgress | None = None,
+) -> None:
+    """Create the vector store of the documents, a chroma database by default.
+
+    With ``incremental`` an existing database is updated: only new or changed
+    sources are parsed, only their new chunks are embedded and the vectors of
+    removed chunks are deleted. An interrupted ingest is resumed, without
+    embedding again the chunks stored before the interruption.
+
+    The web pages are listed in the ``PAGES_FILE`` of the resource folder, and
+    only the pages modified since the last ingest are downloaded and parsed.
+
+    The id of the embedding ``model`` is stored in the manifest, and an
+    existing database embedded with another model is not updated.
+
+    The sources are loaded, split, embedded and stored in a pipeline: every
+    stage runs ahead of the next by a bounded queue, so the memory used does
+    not grow with the number of sources. The throughput of the stages is
+    shown by ``progress``.
+    """
+    if batching is None:
+        batching = BatchSettings()
+    if fetching is None:
+        fetching = FetchSettings()
+    if store is None:
+        store = VectorStoreSettings()
+
+    manifest = _open_manifest(chunk_size, overlap, unit, incremental, store)
+    if model and manifest.embedding not in ("", model):
+        msg = (
+            f"The collection {store.collection} was embedded with "
+            f"{manifest.embedding}, not {model}, it must be recreated."
+        )
+        raise Exception(msg)
+    manifest.embedding = model or manifest.embedding
 
     if not resource.is_dir():
         msg = "È stato inserito un file come fonte di risorse."
         raise Exception(msg)
 
+    hashes: dict[str, str] = {}
+    chunks: Iterable[Document] = []
+
     if file_format == "web":
-        docs = load_documents()
-        chunks.extend(split_text(docs, chunk_size, overlap))
+        hashes, changed = load_changed_pages(resource / PAGES_FILE, manifest, fetching)
+        chunks = split_stages(changed, chunk_size, overlap, unit, workers, progress)
 
     if file_format == "pdf":
-        pdfs = load_pdfs(resource)
-        chunks.extend(split_text(pdfs, chunk_size, overlap))
+        pdfs = list_pdfs(resource.resolve())
+        hashes = {str(pdf): file_hash(pdf) for pdf in pdfs}
+        changed_pdfs = [
+            pdf for pdf in pdfs if manifest.is_changed(str(pdf), hashes[str(pdf)])
+        ]
+        logger.info("%d of %d pdf files to parse.", len(changed_pdfs), len(pdfs))
+        chunks = stage(
+            split_pdfs(changed_pdfs, chunk_size, overlap, workers, unit),
+            "parse",
+            progress,
+            "chunks",
+        )
 
-    # save to chroma
-    create_database_from_docs(chunks, embeddings)
+    # save to the vector store
+    update_memory(
+        embeddings,
+        manifest,
+        file_format,
+        hashes,
+        chunks,
+        batching,
+        store,
+        progress,
+    )
+    paths = collection_paths(store.collection)
+    save_manifest(manifest, paths.manifest)
+    paths.checkpoint.unlink(missing_ok=True)
@@ -0,0 +1,166 @@
+"""Stages of the ingest pipeline, connected by bounded queues."""
+
+import queue
+import threading
+from collections.abc import Iterable, Iterator
+from types import TracebackType
+from typing import TypeVar
+
+from rich.console import Console
+from rich.progress import (
+    Progress,
+    ProgressColumn,
+    SpinnerColumn,
+    Task,
+    TaskID,
+    TextColumn,
+    TimeElapsedColumn,
+)
+from rich.text import Text
+
+# The items buffered between two stages, which bounds the memory of a stage
+# running ahead of the next.
+QUEUE_SIZE = 256
+
+_T = TypeVar("_T")
+
+_DONE = object()
+
+
+class _SpeedColumn(ProgressColumn):
+    """The items processed per second."""
+
+    def render(self, task: Task) -> Text:
+        speed = task.finished_speed or task.speed
+        return Text(f"{speed or 0:>8.1f}/s", style="progress.data.speed")
+
+
+class IngestProgress:
+    """The progress of the stages of an ingest, shown with ``rich.progress``.
+
+    Every stage shows the items it processed and its throughput. When not
+    ``enabled``, the counts are kept but nothing is shown.
+
+    Parameters
+    ----------
+    console : Console | None
+        The console where the progress is shown.
+    enabled : bool
+        Show the progress.
+
+    """
+
+    def __init__(self, console: Console | None = None, enabled: bool = True) -> None:
+        self.progress = Progress(
+            SpinnerColumn(),
+            TextColumn("{task.description:<8}"),
+            TextColumn("{task.completed:>9,.0f}"),
+            TextColumn("{task.fields[unit]:<10}"),
+            _SpeedColumn(),
+            TimeElapsedColumn(),
+            console=console,
+            disable=not enabled,
+        )
+        self._stages: dict[str, TaskID] = {}
+
+    def __enter__(self) -> "IngestProgress":
+        """Start showing the progress."""
+        self.progress.start()
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        tb: TracebackType | None,
+    ) -> None:
+        """Stop showing the progress."""
+        self.progress.stop()
+
+    def advance(self, stage: str, count: int = 1, unit: str = "items") -> None:
+        """Count the items processed by a stage, adding the stage if new."""
+        if stage not in self._stages:
+            self._stages[stage] = self.progress.add_task(stage, total=None, unit=unit)
+        self.progress.advance(self._stages[stage], count)
+
+    def finish(self, stage: str) -> None:
+        """Mark a stage as complete."""
+        if stage in self._stages:
+            task = self._stages[stage]
+            completed = self.progress.tasks[task].completed
+            self.progress.update(task, total=completed)
+
+    def completed(self, stage: str) -> int:
+        """Get the number of items processed by a stage."""
+        if stage not in self._stages:
+            return 0
+        return int(self.progress.tasks[self._stages[stage]].completed)
+
+
+class _Producer(threading.Thread):
+    """Put the items in a bounded queue, followed by ``_DONE``."""
+
+    def __init__(self, items: Iterable[object], name: str, maxsize: int) -> None:
+        super().__init__(name=f"ingest-{name}", daemon=True)
+        self.items = iter(items)
+        self.buffer: queue.Queue[object] = queue.Queue(maxsize)
+        self.stopped = threading.Event()
+        self.failure: BaseException | None = None
+
+    def _put(self, item: object) -> bool:
+        while not self.stopped.is_set():
+            try:
+                self.buffer.put(item, timeout=0.1)
+            except queue.Full:
+                continue
+            return True
+        return False
+
+    def run(self) -> None:
+        try:
+            for item in self.items:
+                if not self._put(item):
+                    return
+        except BaseException as e:  # noqa: BLE001
+            self.failure = e
+        finally:
+            # release the resources of a generator stopped early
+            close = getattr(self.items, "close", None)
+            if close is not None:
+                close()
+        self._put(_DONE)
+
+
+def stage(
+    items: Iterable[_T],
+    name: str,
+    progress: IngestProgress | None = None,
+    unit: str = "items",
+    maxsize: int = QUEUE_SIZE,
+) -> Iterator[_T]:
+    """Produce the items in a thread of their own, ahead of the consumer.
+
+    The items are passed through a queue of at most ``maxsize`` items, so the
+    producer blocks when it is that far ahead. The errors of the producer are
+    raised in the consumer, and closing the iterator stops the producer.
+
+    Yields
+    ------
+    _T
+        The items, in order.
+
+    """
+    producer = _Producer(items, name, maxsize)
+    producer.start()
+    try:
+        while (item := producer.buffer.get()) is not _DONE:
+            if progress is not None:
+                progress.advance(name, unit=unit)
+            yield item  # type: ignore[misc]
+        if producer.failure is not None:
+            raise producer.failure
+        if progress is not None:
+            progress.finish(name)
+    finally:
+        producer.stopped.set()
+        producer.join()
@@ -0,0 +1,324 @@
+"""Lightweight timing of the stages of the chat turns and of the ingest.
+
+Profiling is off until :func:`enable` is called, and until then every
+:func:`span` is a no-op context, so the instrumented code pays a single
+function call per stage.
+"""
+
+import json
+import os
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import AbstractContextManager, contextmanager, nullcontext
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.embeddings import Embeddings
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import LLMResult
+from rich.console import Console
+from rich.table import Table
+
+from chatbot.utils import estimate_tokens
+
+# The runs of the chains that are recorded by the callbacks, by run name.
+CHAIN_STAGES = {"format_docs": "format_docs", "ChatPromptTemplate": "prompt"}
+
+
+@dataclass
+class Span:
+    """A timed stage.
+
+    Attributes
+    ----------
+    name : str
+        The name of the stage.
+    start : float
+        The start time, in seconds of :func:`time.perf_counter`.
+    duration : float
+        The duration in seconds.
+    thread : int
+        The id of the thread that ran the stage.
+    attrs : dict[str, Any]
+        Counts describing the stage, e.g. tokens or retrieved chunks.
+
+    """
+
+    name: str
+    start: float
+    duration: float = 0.0
+    thread: int = 0
+    attrs: dict[str, Any] = field(default_factory=dict)
+
+
+def _format_attrs(attrs: dict[str, Any]) -> str:
+    return ", ".join(f"{key}={value}" for key, value in attrs.items())
+
+
+class Profiler:
+    """The spans recorded while profiling is enabled."""
+
+    def __init__(self) -> None:
+        self.spans: list[Span] = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name: str, **attrs: Any) -> Iterator[dict[str, Any]]:
+        """Time a stage, yielding its attributes to be filled in."""
+        span = Span(name, time.perf_counter(), thread=threading.get_ident())
+        span.attrs.update(attrs)
+        try:
+            yield span.attrs
+        finally:
+            span.duration = time.perf_counter() - span.start
+            self.add(span)
+
+    def add(self, span: Span) -> None:
+        """Record a completed span."""
+        with self._lock:
+            self.spans.append(span)
+
+    def mark(self) -> int:
+        """Get a mark to report only the spans recorded after it."""
+        with self._lock:
+            return len(self.spans)
+
+    def report(self, console: Console, since: int = 0, title: str = "") -> None:
+        """Print the spans recorded after the mark ``since``, nested by time."""
+        with self._lock:
+            spans = sorted(self.spans[since:], key=lambda span: span.start)
+
+        table = Table(title=title or None, title_justify="left")
+        table.add_column("stage")
+        table.add_column("ms", justify="right")
+        table.add_column("details")
+        stack: list[float] = []
+        for span in spans:
+            while stack and stack[-1] <= span.start:
+                stack.pop()
+            table.add_row(
+                "  " * len(stack) + span.name,
+                f"{1000 * span.duration:.1f}",
+                _format_attrs(span.attrs),
+            )
+            stack.append(span.start + span.duration)
+        console.print(table)
+
+    def summary(self, console: Console, title: str = "") -> None:
+        """Print the total time and counts of every stage, over all its spans."""
+        totals: dict[str, Span] = {}
+        calls: dict[str, int] = {}
+        with self._lock:
+            for span in self.spans:
+                total = totals.setdefault(span.name, Span(span.name, span.start))
+                total.duration += span.duration
+                calls[span.name] = calls.get(span.name, 0) + 1
+                for key, value in span.attrs.items():
+                    if isinstance(value, int | float) and not isinstance(value, bool):
+                        total.attrs[key] = total.attrs.get(key, 0) + value
+
+        table = Table(title=title or None, title_justify="left")
+        table.add_column("stage")
+        table.add_column("calls", justify="right")
+        table.add_column("total ms", justify="right")
+        table.add_column("details")
+        for name, total in sorted(totals.items(), key=lambda item: item[1].start):
+            table.add_row(
+                name,
+                str(calls[name]),
+                f"{1000 * total.duration:.1f}",
+                _format_attrs(total.attrs),
+            )
+        console.print(table)
+
+    def write_trace(self, path: Path) -> None:
+        """Write the spans as a trace for chrome://tracing or Perfetto."""
+        with self._lock:
+            spans = list(self.spans)
+        origin = min((span.start for span in spans), default=0.0)
+        events = [
+            {
+                "name": span.name,
+                "cat": "chatbot",
+                "ph": "X",
+                "ts": 1e6 * (span.start - origin),
+                "dur": 1e6 * span.duration,
+                "pid": os.getpid(),
+                "tid": span.thread,
+                "args": span.attrs,
+            }
+            for span in spans
+        ]
+        with path.open("w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, default=str)
+
+
+_active: Profiler | None = None
+
+
+def enable() -> Profiler:
+    """Start recording the spans."""
+    global _active  # noqa: PLW0603
+    _active = Profiler()
+    return _active
+
+
+def disable() -> None:
+    """Stop recording the spans."""
+    global _active  # noqa: PLW0603
+    _active = None
+
+
+def active() -> Profiler | None:
+    """Get the profiler recording the spans, if profiling is enabled."""
+    return _active
+
+
+def span(name: str, **attrs: Any) -> AbstractContextManager[dict[str, Any]]:
+    """Time a stage when profiling is enabled.
+
+    Yields
+    ------
+    dict[str, Any]
+        The attributes of the span, where counts can be added.
+
+    """
+    if _active is None:
+        return nullcontext({})
+    return _active.span(name, **attrs)
+
+
+class ProfilingCallbackHandler(BaseCallbackHandler):
+    """Record the prompt assembly and the model calls of a chain as spans."""
+
+    def __init__(self, profiler: Profiler) -> None:
+        self.profiler = profiler
+        self._running: dict[UUID, Span] = {}
+
+    def _start(self, run_id: UUID, name: str, **attrs: Any) -> None:
+        span = Span(name, time.perf_counter(), thread=threading.get_ident())
+        span.attrs.update(attrs)
+        self._running[run_id] = span
+
+    def _end(self, run_id: UUID) -> Span | None:
+        span = self._running.pop(run_id, None)
+        if span is not None:
+            span.duration = time.perf_counter() - span.start
+            self.profiler.add(span)
+        return span
+
+    def on_chain_start(
+        self,
+        serialized: dict[str, Any],
+        inputs: dict[str, Any],
+        *,
+        run_id: UUID,
+        **kwargs: Any,
+    ) -> None:
+        """Start timing the prompt assembly stages."""
+        stage = CHAIN_STAGES.get(kwargs.get("name") or "")
+        if stage is not None:
+            self._start(run_id, stage)
+
+    def on_chain_end(
+        self,
+        outputs: dict[str, Any],
+        *,
+        run_id: UUID,
+        **kwargs: Any,
+    ) -> None:
+        """Stop timing a prompt assembly stage."""
+        self._end(run_id)
+
+    def on_chain_error(
+        self,
+        error: BaseException,
+        *,
+        run_id: UUID,
+        **kwargs: Any,
+    ) -> None:
+        """Stop timing a failed prompt assembly stage."""
+        self._end(run_id)
+
+    def on_chat_model_start(
+        self,
+        serialized: dict[str, Any],
+        messages: list[list[BaseMessage]],
+        *,
+        run_id: UUID,
+        **kwargs: Any,
+    ) -> None:
+        """Start timing a model call, counting the prompt tokens."""
+        tokens = sum(
+            estimate_tokens(str(message.content))
+            for batch in messages
+            for message in batch
+        )
+        self._start(run_id, "llm", prompt_tokens=tokens)
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any) -> None:
+        """Record the time to the first token."""
+        span = self._running.get(run_id)
+        if span is not None and "first_token_ms" not in span.attrs:
+            span.attrs["first_token_ms"] = round(
+                1000 * (time.perf_counter() - span.start),
+                1,
+            )
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        """Stop timing a model call, counting the completion tokens."""
+        span = self._running.get(run_id)
+        if span is not None:
+            text = "".join(
+                generation.text
+                for batch in response.generations
+                for generation in batch
+            )
+            span.attrs["completion_tokens"] = estimate_tokens(text)
+        self._end(run_id)
+
+    def on_llm_error(
+        self,
+        error: BaseException,
+        *,
+        run_id: UUID,
+        **kwargs: Any,
+    ) -> None:
+        """Stop timing a failed model call."""
+        self._end(run_id)
+
+
+def callbacks() -> list[BaseCallbackHandler]:
+    """Get the callbacks recording the stages of a chain, if profiling."""
+    if _active is None:
+        return []
+    return [ProfilingCallbackHandler(_active)]
+
+
+class ProfiledEmbeddings(Embeddings):
+    """Embeddings timing every call to the wrapped model."""
+
+    def __init__(self, embeddings: Embeddings) -> None:
+        self.embeddings = embeddings
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        """Embed search docs."""
+        tokens = sum(estimate_tokens(text) for text in texts)
+        with span("embed_documents", texts=len(texts), tokens=tokens):
+            return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> list[float]:
+        """Embed query text."""
+        with span("embed_query", tokens=estimate_tokens(text)):
+            return self.embeddings.embed_query(text)
+
+
+def profile_embeddings(embeddings: Embeddings) -> Embeddings:
+    """Time the calls to the embeddings, if profiling."""
+    if _active is None:
+        return embeddings
+    return ProfiledEmbeddings(embeddings)
@@ -0,0 +1,167 @@
+"""Reranking of the retrieved chunks with a cross-encoder."""
+
+import functools
+import logging
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable
+from typing import Any
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.pydantic_v1 import PrivateAttr
+from langchain_core.retrievers import BaseRetriever
+
+from chatbot import profiling
+from chatbot.backends import import_sentence_transformers
+from chatbot.manifest import chunk_id
+from chatbot.settings import RerankSettings
+
+logger = logging.getLogger("app_logger")
+
+# Score pairs of question and chunk text, higher is more relevant.
+Scorer = Callable[[list[tuple[str, str]]], list[float]]
+
+_models_lock = threading.Lock()
+
+
+@functools.cache
+def _load_cross_encoder(model: str, device: str) -> Any:
+    module = import_sentence_transformers("reranker")
+    return module.CrossEncoder(model, device=device)
+
+
+class CrossEncoderScorer:
+    """Score pairs of question and chunk with a sentence-transformers model.
+
+    The model is loaded once per process, by :meth:`load` or at the first
+    call, and every call scores its pairs in a single batch.
+
+    Parameters
+    ----------
+    model : str
+        The name of the cross-encoder on the Hugging Face hub, or its folder.
+    device : str
+        The device running the model, e.g. "cpu" or "cuda".
+
+    """
+
+    def __init__(self, model: str, device: str = "cpu") -> None:
+        self.model = model
+        self.device = device
+
+    def load(self) -> Any:
+        """Load the model, so that the first reranking does not wait for it.
+
+        Returns
+        -------
+        Any
+            The ``CrossEncoder`` of the model.
+
+        """
+        with _models_lock:
+            return _load_cross_encoder(self.model, self.device)
+
+    def __call__(self, pairs: list[tuple[str, str]]) -> list[float]:
+        """Score the pairs."""
+        scores = self.load().predict(
+            pairs,
+            batch_size=len(pairs),
+            convert_to_numpy=True,
+            show_progress_bar=False,
+        )
+        return [float(score) for score in scores]
+
+
+class RerankingRetriever(BaseRetriever):
+    """Retrieve many candidate chunks and keep the best by a cross-encoder.
+
+    The wrapped retriever should return ``settings.candidates`` chunks. Their
+    scores are cached by question and chunk id, and the others are computed
+    ``settings.batch_size`` at a time. A batch is scored only if it is
+    expected to end within the budget, as long as the previous ones took, and
+    otherwise the chunks keep the order of the retrieval.
+
+    Attributes
+    ----------
+    retriever : BaseRetriever
+        The retriever of the candidate chunks.
+    scorer : Scorer
+        The cross-encoder scoring the pairs of question and chunk.
+    settings : RerankSettings
+        How many chunks are reranked and kept, and the budget.
+    reranked : int
+        The number of reranked retrievals.
+    fallbacks : int
+        The number of retrievals that ran out of budget.
+
+    """
+
+    retriever: BaseRetriever
+    scorer: Scorer
+    settings: RerankSettings
+    reranked: int = 0
+    fallbacks: int = 0
+    _cache: OrderedDict[tuple[str, str], float] = PrivateAttr(
+        default_factory=OrderedDict,
+    )
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    def _cached(self, keys: list[tuple[str, str]]) -> dict[tuple[str, str], float]:
+        with self._lock:
+            found = {key: self._cache[key] for key in keys if key in self._cache}
+            for key in found:
+                self._cache.move_to_end(key)
+        return found
+
+    def _store(self, scores: dict[tuple[str, str], float]) -> None:
+        with self._lock:
+            self._cache.update(scores)
+            while len(self._cache) > self.settings.cache_size:
+                self._cache.popitem(last=False)
+
+    def _score(self, query: str, candidates: list[Document]) -> list[float] | None:
+        keys = [(query, chunk_id(doc)) for doc in candidates]
+        scores = self._cached(keys)
+        missing = [i for i, key in enumerate(keys) if key not in scores]
+        budget = self.settings.budget_ms / 1000
+        start = time.perf_counter()
+        size = self.settings.batch_size
+        for batches, offset in enumerate(range(0, len(missing), size)):
+            elapsed = time.perf_counter() - start
+            # the next batch takes as long as the previous ones on average
+            if budget and elapsed + (elapsed / batches if batches else 0) > budget:
+                return None
+            batch = missing[offset : offset + size]
+            computed = self.scorer(
+                [(query, candidates[i].page_content) for i in batch],
+            )
+            new = {keys[i]: score for i, score in zip(batch, computed, strict=True)}
+            self._store(new)
+            scores.update(new)
+        return [scores[key] for key in keys]
+
+    def _get_relevant_documents(
+        self,
+        query: str,
+        *,
+        run_manager: CallbackManagerForRetrieverRun,
+    ) -> list[Document]:
+        candidates = self.retriever.invoke(
+            query,
+            config={"callbacks": run_manager.get_child()},
+        )
+        with profiling.span("rerank", candidates=len(candidates)) as attrs:
+            scores = self._score(query, candidates)
+            attrs["fallback"] = scores is None
+        if scores is None:
+            logger.info("Reranking exceeded its budget, kept the retrieval order.")
+            with self._lock:
+                self.fallbacks += 1
+            return candidates[: self.settings.k]
+
+        with self._lock:
+            self.reranked += 1
+        order = sorted(range(len(candidates)), key=lambda i: -scores[i])
+        return [candidates[i] for i in order[: self.settings.k]]
@@ -0,0 +1,189 @@
+"""Retrieval from several named collections, kept open in a bounded pool."""
+
+import logging
+import threading
+from collections import OrderedDict
+from collections.abc import Callable, Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from chatbot.manifest import chunk_id
+
+logger = logging.getLogger("app_logger")
+
+
+@dataclass
+class _Entry:
+    retriever: Future[BaseRetriever]
+    users: int = 0
+    evicted: bool = False
+
+
+class RetrieverPool:
+    """The retrievers of the named collections, opened when first used.
+
+    At most ``max_open`` collections are kept open: opening another one closes
+    the least recently used, as soon as no search is running on it. A
+    collection is opened outside the lock of the pool, so a slow one does not
+    block the others, and the searches of the same collection wait for it.
+
+    Parameters
+    ----------
+    open_retriever : Callable[[str], BaseRetriever]
+        Open the retriever of a collection, by name.
+    close_retriever : Callable[[str, BaseRetriever], None]
+        Release the resources of the retriever of a collection.
+    max_open : int
+        The maximum number of collections kept open.
+
+    """
+
+    def __init__(
+        self,
+        open_retriever: Callable[[str], BaseRetriever],
+        close_retriever: Callable[[str, BaseRetriever], None],
+        max_open: int = 4,
+    ) -> None:
+        self._open = open_retriever
+        self._close = close_retriever
+        self.max_open = max_open
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        """Count the open collections."""
+        with self._lock:
+            return len(self._entries)
+
+    def __contains__(self, name: object) -> bool:
+        """Check if a collection is open."""
+        with self._lock:
+            return name in self._entries
+
+    @contextmanager
+    def acquire(self, name: str) -> Iterator[BaseRetriever]:
+        """Use the retriever of a collection, opening it if needed.
+
+        Yields
+        ------
+        BaseRetriever
+            The retriever, which stays open until it is released.
+
+        """
+        entry, opening = self._enter(name)
+        try:
+            if opening:
+                self._open_entry(name, entry)
+            yield entry.retriever.result()
+        finally:
+            with self._lock:
+                entry.users -= 1
+                done = entry.evicted and entry.users == 0
+            if done:
+                self._release([(name, entry)])
+
+    def _enter(self, name: str) -> tuple[_Entry, bool]:
+        closed: list[tuple[str, _Entry]] = []
+        with self._lock:
+            entry = self._entries.get(name)
+            opening = entry is None
+            if entry is None:
+                entry = _Entry(Future())
+                self._entries[name] = entry
+                while len(self._entries) > self.max_open:
+                    evicted = self._entries.popitem(last=False)
+                    evicted[1].evicted = True
+                    if evicted[1].users == 0:
+                        closed.append(evicted)
+            else:
+                self._entries.move_to_end(name)
+            entry.users += 1
+        self._release(closed)
+        return entry, opening
+
+    def _open_entry(self, name: str, entry: _Entry) -> None:
+        try:
+            entry.retriever.set_result(self._open(name))
+        except BaseException as e:
+            entry.retriever.set_exception(e)
+            # the next search opens the collection again
+            with self._lock:
+                if self._entries.get(name) is entry:
+                    del self._entries[name]
+                entry.evicted = True
+            raise
+
+    def _release(self, entries: list[tuple[str, _Entry]]) -> None:
+        for name, entry in entries:
+            if entry.retriever.exception() is not None:
+                continue
+            logger.debug("Closing the collection %s.", name)
+            self._close(name, entry.retriever.result())
+
+    def close(self) -> None:
+        """Close every open collection."""
+        with self._lock:
+            entries = list(self._entries.items())
+            self._entries.clear()
+            for _, entry in entries:
+                entry.evicted = True
+            idle = [item for item in entries if item[1].users == 0]
+        self._release(idle)
+
+
+class RoutingRetriever(BaseRetriever):
+    """Retrieve chunks from several collections and fuse their rankings.
+
+    The collections are searched at the same time, and their rankings are
+    combined with reciprocal rank fusion.
+
+    Attributes
+    ----------
+    pool : RetrieverPool
+        The pool opening the retrievers of the collections.
+    collections : list[str]
+        The names of the searched collections.
+    k : int
+        The number of chunks retrieved.
+    rrf_k : int
+        The rank constant of the reciprocal rank fusion.
+
+    """
+
+    pool: RetrieverPool
+    collections: list[str]
+    k: int = 4
+    rrf_k: int = 60
+
+    def _search(self, name: str, query: str) -> list[Document]:
+        with self.pool.acquire(name) as retriever:
+            return retriever.invoke(query)
+
+    def _get_relevant_documents(
+        self,
+        query: str,
+        *,
+        run_manager: CallbackManagerForRetrieverRun,
+    ) -> list[Document]:
+        if len(self.collections) == 1:
+            return self._search(self.collections[0], query)[: self.k]
+
+        with ThreadPoolExecutor(max_workers=len(self.collections)) as pool:
+            rankings = list(
+                pool.map(lambda name: self._search(name, query), self.collections),
+            )
+
+        scores: dict[str, float] = {}
+        found: dict[str, Document] = {}
+        for ranking in rankings:
+            for rank, doc in enumerate(ranking, start=1):
+                id_ = chunk_id(doc)
+                found.setdefault(id_, doc)
+                scores[id_] = scores.get(id_, 0.0) + 1 / (self.rrf_k + rank)
+        best = sorted(scores, key=lambda id_: -scores[id_])[: self.k]
+        return [found[id_] for id_ in best]
@@ -0,0 +1,352 @@
+"""Serve the chatbot over HTTP, to many concurrent sessions."""
+
+import asyncio
+import functools
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from typing import Any
+
+import httpx
+from aiohttp import web
+from langchain.memory import ChatMessageHistory
+from langchain_chroma import Chroma
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models import BaseChatModel
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.runnables import Runnable
+
+from chatbot.backends import create_chat_model, embedding_id
+from chatbot.chat import create_chain
+from chatbot.embeddings import get_embeddings
+from chatbot.fakes import FakeChatModel, FakeEmbeddings, fake_documents
+from chatbot.history import HistoryWindow
+from chatbot.memory import (
+    EMBEDDING_CACHE,
+    check_collections,
+    create_pool,
+    get_retriever,
+)
+from chatbot.routing import RetrieverPool
+from chatbot.settings import (
+    BackendSettings,
+    ContextSettings,
+    HistorySettings,
+    RerankSettings,
+    RetrievalMode,
+    ServeSettings,
+    VectorStoreSettings,
+)
+
+logger = logging.getLogger("app_logger")
+
+# The documents indexed by the fake memory.
+FAKE_DOCUMENTS = 200
+
+# The retrievers of the combinations of collections kept for the requests.
+MAX_ROUTES = 64
+
+
+@dataclass
+class _Session:
+    window: HistoryWindow
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+
+
+class ChatServer:
+    """The HTTP handlers sharing a retriever and a chain across sessions.
+
+    Every session has its own history window, kept in memory and dropped when
+    more than ``max_sessions`` sessions are active. The requests of a session
+    are answered one at a time, while at most ``max_in_flight`` answers of
+    different sessions are generated at the same time.
+
+    Parameters
+    ----------
+    chain : Runnable
+        The chain answering the messages with the context, see
+        :func:`chatbot.chat.create_chain`.
+    retriever : BaseRetriever
+        The retriever of the context.
+    history_settings : HistorySettings
+        The size of the history window of every session.
+    settings : ServeSettings
+        The limits of the server.
+    route : Callable[[list[str]], BaseRetriever] | None
+        Get the retriever of the collections named by a request, which are
+        otherwise searched with ``retriever``.
+
+    """
+
+    def __init__(
+        self,
+        chain: Runnable[dict[str, Any], str],
+        retriever: BaseRetriever,
+        history_settings: HistorySettings,
+        settings: ServeSettings,
+        route: Callable[[list[str]], BaseRetriever] | None = None,
+    ) -> None:
+        self.chain = chain
+        self.retriever = retriever
+        self.route = route
+        self.history_settings = history_settings
+        self.settings = settings
+        self.in_flight = 0
+        self._slots = asyncio.Semaphore(settings.max_in_flight)
+        self._sessions: OrderedDict[str, _Session] = OrderedDict()
+
+    def _session(self, session_id: str) -> _Session:
+        session = self._sessions.get(session_id)
+        if session is None:
+            session = _Session(
+                HistoryWindow(ChatMessageHistory(), self.history_settings),
+            )
+            self._sessions[session_id] = session
+            if len(self._sessions) > self.settings.max_sessions:
+                evicted, _ = self._sessions.popitem(last=False)
+                logger.debug("Dropped the session %s.", evicted)
+        else:
+            self._sessions.move_to_end(session_id)
+        return session
+
+    async def chat(self, request: web.Request) -> web.StreamResponse:
+        """Answer a question, streaming the answer as plain text.
+
+        The request body is a JSON object with the ``question`` and optionally
+        the ``session`` id, a new session is started without it, and the list
+        of ``collections`` searched. The session id is returned in the
+        ``X-Session-Id`` header.
+        """
+        try:
+            data = await request.json()
+        except ValueError:
+            msg = "The body must be a JSON object."
+            raise web.HTTPBadRequest(text=msg) from None
+        question = data.get("question") if isinstance(data, dict) else None
+        if not isinstance(question, str) or not question.strip():
+            msg = "The question must be a non empty string."
+            raise web.HTTPBadRequest(text=msg)
+        session_id = str(data.get("session") or uuid.uuid4().hex)
+        retriever = self._retriever(data.get("collections"))
+
+        session = self._session(session_id)
+        async with session.lock:
+            context = await retriever.ainvoke(question)
+            session.window.add_user_message(question)
+
+            response = web.StreamResponse(
+                headers={
+                    "Content-Type": "text/plain; charset=utf-8",
+                    "X-Session-Id": session_id,
+                },
+            )
+            await response.prepare(request)
+
+            answer = ""
+            try:
+                async with self._slots:
+                    self.in_flight += 1
+                    start = time.perf_counter()
+                    try:
+                        async for token in self.chain.astream(
+                            {"context": context, "messages": session.window.messages},
+                        ):
+                            answer += token
+                            await response.write(token.encode())
+                    finally:
+                        self.in_flight -= 1
+                logger.debug(
+                    "Answered in %.3f s, session %s.",
+                    time.perf_counter() - start,
+                    session_id,
+                )
+            finally:
+                # keep the turn even when the client went away
+                session.window.add_ai_message(answer)
+            await response.write_eof()
+        return response
+
+    def _retriever(self, collections: Any) -> BaseRetriever:
+        if collections is None:
+            return self.retriever
+        if (
+            not isinstance(collections, list)
+            or not collections
+            or not all(isinstance(name, str) for name in collections)
+        ):
+            msg = "The collections must be a non empty list of names."
+            raise web.HTTPBadRequest(text=msg)
+        if self.route is None:
+            msg = "The server cannot search other collections."
+            raise web.HTTPBadRequest(text=msg)
+        try:
+            return self.route(collections)
+        except ValueError as e:
+            raise web.HTTPBadRequest(text=str(e)) from None
+
+    async def health(self, _request: web.Request) -> web.Response:
+        """Report the number of sessions and of answers being generated."""
+        return web.json_response(
+            {"sessions": len(self._sessions), "in_flight": self.in_flight},
+        )
+
+    def app(self) -> web.Application:
+        """Create the web application routing to the handlers."""
+        app = web.Application()
+        app.add_routes(
+            [web.post("/chat", self.chat), web.get("/health", self.health)],
+        )
+        return app
+
+
+def create_router(
+    embeddings: Embeddings,
+    retrieval: RetrievalMode,
+    store: VectorStoreSettings,
+    pool: RetrieverPool,
+    context: ContextSettings | None = None,
+    rerank: RerankSettings | None = None,
+) -> Callable[[list[str]], BaseRetriever]:
+    """Create the function building the retriever of the named collections.
+
+    The retrievers of the last ``MAX_ROUTES`` combinations of collections are
+    kept, so the requests naming the same collections share the cache of the
+    scores of the reranker, and only the first one loads it.
+
+    Returns
+    -------
+    Callable[[list[str]], BaseRetriever]
+        The function, raising ``ValueError`` for unknown collections.
+
+    """
+
+    @functools.lru_cache(maxsize=MAX_ROUTES)
+    def routed(names: tuple[str, ...]) -> BaseRetriever:
+        return get_retriever(
+            embeddings,
+            retrieval,
+            store=store,
+            context=context,
+            collections=list(names),
+            pool=pool,
+            rerank=rerank,
+        )
+
+    def route(names: list[str]) -> BaseRetriever:
+        check_collections(names, store)
+        return routed(tuple(names))
+
+    return route
+
+
+def create_app(  # noqa: PLR0913
+    model: str,
+    embedding: str,
+    temperature: float,
+    sys_prompt: str,
+    api_key: str,
+    embedding_cache_size: int,
+    history_settings: HistorySettings,
+    settings: ServeSettings,
+    *,
+    retrieval: RetrievalMode = "hybrid",
+    store: VectorStoreSettings | None = None,
+    context: ContextSettings | None = None,
+    collections: list[str] | None = None,
+    backends: BackendSettings | None = None,
+    rerank: RerankSettings | None = None,
+    fake: bool = False,
+) -> web.Application:
+    """Create the application serving the chatbot.
+
+    The language model and the embedding model are created once by
+    ``backends``, and their requests share a connection pool sized on
+    ``settings.max_in_flight``.
+    With ``fake``, they are replaced by :mod:`chatbot.fakes` and the memory by
+    an in-memory index of fake documents, so the server can be load tested
+    offline.
+
+    The requests search ``collections``, by default the collection of
+    ``store``, or the collections they name. The collections are opened on
+    demand, at most ``store.max_open`` at a time.
+
+    Returns
+    -------
+    web.Application
+        The web application, closing the connection pools on cleanup.
+
+    """
+    clients: list[httpx.Client | httpx.AsyncClient] = []
+    llm: BaseChatModel
+    retriever: BaseRetriever
+    route = None
+    pool = None
+    if fake:
+        llm = FakeChatModel(token_latency=0.02)
+        retriever = Chroma.from_documents(
+            fake_documents(FAKE_DOCUMENTS),
+            FakeEmbeddings(),
+            collection_name="fake",
+        ).as_retriever()
+    else:
+        limits = httpx.Limits(
+            max_connections=settings.max_in_flight,
+            max_keepalive_connections=settings.max_in_flight,
+        )
+        llm_client = httpx.AsyncClient(limits=limits)
+        embedding_client = httpx.Client(limits=limits)
+        clients = [llm_client, embedding_client]
+        llm = create_chat_model(
+            model,
+            temperature,
+            api_key,
+            backends,
+            http_async_client=llm_client,
+        )
+        embeddings = get_embeddings(
+            embedding,
+            api_key,
+            EMBEDDING_CACHE,
+            embedding_cache_size,
+            embedding_client,
+            backends,
+        )
+        if store is None:
+            store = VectorStoreSettings()
+        candidates = context.candidates if context is not None else 4
+        if rerank is not None:
+            candidates = rerank.candidates
+        pool = create_pool(
+            embeddings,
+            retrieval,
+            candidates,
+            store,
+            embedding_id(embedding, backends),
+        )
+
+        route = create_router(embeddings, retrieval, store, pool, context, rerank)
+        retriever = route(collections or [store.collection])
+
+    server = ChatServer(
+        create_chain(llm, sys_prompt),
+        retriever,
+        history_settings,
+        settings,
+        route,
+    )
+    app = server.app()
+
+    async def close_clients(_app: web.Application) -> None:
+        for client in clients:
+            if isinstance(client, httpx.AsyncClient):
+                await client.aclose()
+            else:
+                client.close()
+        if pool is not None:
+            pool.close()
+
+    app.on_cleanup.append(close_clients)
+    return app
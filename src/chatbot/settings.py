@@ -0,0 +1,256 @@
+"""Settings of the chatbot components.
+
+They are kept apart from the components, which import heavy dependencies,
+so that the command line can use them as defaults without loading those.
+"""
+
+from dataclasses import dataclass
+from typing import Literal
+
+RetrievalMode = Literal["vector", "hybrid", "lexical"]
+VectorBackend = Literal["chroma", "compact"]
+VectorDtype = Literal["float32", "float16", "int8"]
+LengthUnit = Literal["chars", "tokens"]
+
+# The collection stored in the memory folder itself.
+DEFAULT_COLLECTION = "default"
+
+# The maximum number of embeddings cached on disk.
+EMBEDDING_CACHE_SIZE = 20000
+
+
+@dataclass
+class BatchSettings:
+    """How the chunks are grouped and sent to the embedding model.
+
+    Attributes
+    ----------
+    batch_size : int
+        The maximum number of chunks per request.
+    batch_tokens : int
+        The maximum number of tokens per request.
+    concurrency : int
+        The maximum number of requests in flight.
+    tokens_per_minute : int
+        The rate limit of the embedding model, 0 for no limit.
+
+    """
+
+    batch_size: int = 100
+    batch_tokens: int = 100000
+    concurrency: int = 4
+    tokens_per_minute: int = 0
+
+
+@dataclass
+class HistorySettings:
+    """How much of the chat history is sent to the model.
+
+    Attributes
+    ----------
+    max_turns : int
+        The maximum number of question and answer turns sent verbatim.
+    max_tokens : int
+        The maximum number of tokens of the turns sent verbatim.
+    summary_model : str
+        The model of the chat backend that summarizes the older turns, empty
+        to drop them instead.
+
+    """
+
+    max_turns: int = 10
+    max_tokens: int = 3000
+    summary_model: str = ""
+
+
+@dataclass
+class AnswerCacheSettings:
+    """When a stored answer is served again.
+
+    Attributes
+    ----------
+    threshold : float
+        The minimum cosine similarity between the questions.
+    ttl : int
+        The number of seconds an answer is served for.
+    max_entries : int
+        The maximum number of stored answers.
+
+    """
+
+    threshold: float = 0.95
+    ttl: int = 7 * 24 * 60 * 60
+    max_entries: int = 1000
+
+
+@dataclass
+class ServeSettings:
+    """How the chatbot is served.
+
+    Attributes
+    ----------
+    host : str
+        The interface the server listens on.
+    port : int
+        The port the server listens on.
+    max_in_flight : int
+        The maximum number of answers generated at the same time.
+    max_sessions : int
+        The maximum number of chat sessions kept in memory.
+
+    """
+
+    host: str = "127.0.0.1"
+    port: int = 8080
+    max_in_flight: int = 8
+    max_sessions: int = 1000
+
+
+@dataclass
+class FetchSettings:
+    """How the web pages are downloaded.
+
+    Attributes
+    ----------
+    concurrency : int
+        The maximum number of requests in flight.
+    per_host : int
+        The maximum number of requests in flight to the same host.
+    timeout : float
+        The seconds a request may take.
+
+    """
+
+    concurrency: int = 8
+    per_host: int = 2
+    timeout: float = 30.0
+
+
+@dataclass
+class VectorStoreSettings:
+    """Where the vectors of the chunks are stored.
+
+    Attributes
+    ----------
+    backend : VectorBackend
+        "chroma", or "compact" for memory mapped NumPy files.
+    dtype : VectorDtype
+        The type of the vectors stored by the compact backend.
+    dimensions : int
+        The leading dimensions of the vectors kept by the compact backend,
+        0 to keep all of them.
+    collection : str
+        The name of the collection of the chunks.
+    max_open : int
+        The maximum number of collections kept open by a process.
+
+    """
+
+    backend: VectorBackend = "chroma"
+    dtype: VectorDtype = "float16"
+    dimensions: int = 0
+    collection: str = DEFAULT_COLLECTION
+    max_open: int = 4
+
+
+@dataclass
+class ContextSettings:
+    """How the retrieved chunks are compressed before filling the prompt.
+
+    Attributes
+    ----------
+    candidates : int
+        The number of chunks retrieved before the compression.
+    k : int
+        The maximum number of chunks kept.
+    max_tokens : int
+        The maximum number of tokens of the context, 0 for no limit.
+    duplicate_threshold : float
+        The share of the words of a chunk found in a better one above which
+        the chunk is dropped as a near duplicate.
+    mmr_lambda : float
+        The weight of the relevance against the diversity of the chunks.
+
+    """
+
+    candidates: int = 8
+    k: int = 4
+    max_tokens: int = 3000
+    duplicate_threshold: float = 0.8
+    mmr_lambda: float = 0.7
+
+
+@dataclass
+class RerankSettings:
+    """How the retrieved chunks are reranked by a cross-encoder.
+
+    Attributes
+    ----------
+    candidates : int
+        The number of chunks retrieved before the reranking.
+    k : int
+        The number of best reranked chunks kept.
+    model : str
+        The cross-encoder scoring the pairs of question and chunk.
+    device : str
+        The device running the cross-encoder.
+    batch_size : int
+        The number of pairs scored at a time.
+    budget_ms : int
+        The milliseconds the reranking may take, after which the chunks keep
+        the order of the retrieval. 0 for no limit.
+    cache_size : int
+        The maximum number of scores cached, by question and chunk.
+
+    """
+
+    candidates: int = 20
+    k: int = 4
+    model: str = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+    device: str = "cpu"
+    batch_size: int = 16
+    budget_ms: int = 500
+    cache_size: int = 10000
+
+
+@dataclass
+class AskSettings:
+    """How a batch of questions is answered.
+
+    Attributes
+    ----------
+    concurrency : int
+        The maximum number of questions answered at the same time.
+    batch_size : int
+        The number of questions embedded by a single request.
+
+    """
+
+    concurrency: int = 8
+    batch_size: int = 64
+
+
+@dataclass
+class BackendSettings:
+    """Which backends serve the embedding and the chat models.
+
+    Attributes
+    ----------
+    embedding_backend : str
+        "openai", or "local" for a sentence-transformers model on the CPU.
+    chat_backend : str
+        "openai", or "local" for an OpenAI compatible server.
+    chat_base_url : str
+        The url of the api of the local chat server.
+    device : str
+        The device running the local embedding model.
+    batch_size : int
+        The number of texts encoded at a time by the local embedding model.
+
+    """
+
+    embedding_backend: str = "openai"
+    chat_backend: str = "openai"
+    chat_base_url: str = "http://localhost:11434/v1"
+    device: str = "cpu"
+    batch_size: int = 32
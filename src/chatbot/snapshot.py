@@ -0,0 +1,249 @@
+"""Portable snapshots of a collection, to deploy an index built elsewhere.
+
+A snapshot is a single zip file, compressed with deflate, holding:
+
+- ``snapshot.json``: the version of the format, the number of chunks, the
+  dimensions of the vectors and the manifest of the collection, with the
+  embedding model and the chunking parameters;
+- ``vectors.npy``: the float32 vectors of the chunks, in one contiguous array;
+- ``chunks.jsonl``: the id, text and metadata of every chunk, in the order of
+  the vectors.
+
+It depends neither on the version of Chroma nor on the vector store, and it
+is written and read a batch of chunks at a time. The header is written last,
+once the ids of the vectors are checked to match those of the chunks.
+"""
+
+import hashlib
+import io
+import json
+import zipfile
+from collections.abc import Iterator
+from dataclasses import dataclass
+from pathlib import Path
+from typing import IO, Any
+
+import numpy as np
+import numpy.typing as npt
+from chromadb.api.models.Collection import Collection
+from chromadb.api.types import Include
+
+from chatbot.manifest import Manifest, manifest_data, parse_manifest
+from chatbot.vectorstore import CompactVectorStore
+
+SNAPSHOT_VERSION = 1
+HEADER_FILE = "snapshot.json"
+VECTORS_FILE = "vectors.npy"
+CHUNKS_FILE = "chunks.jsonl"
+
+_DTYPE = np.dtype(np.float32)
+
+
+@dataclass
+class SnapshotHeader:
+    """The description of the chunks of a snapshot.
+
+    Attributes
+    ----------
+    manifest : Manifest
+        The manifest of the collection.
+    count : int
+        The number of chunks.
+    dimensions : int
+        The dimensions of the vectors.
+
+    """
+
+    manifest: Manifest
+    count: int
+    dimensions: int
+
+
+@dataclass
+class ChunkBatch:
+    """The chunks read from a snapshot, as the arguments of an upsert."""
+
+    ids: list[str]
+    embeddings: npt.NDArray[np.float32]
+    metadatas: list[dict[str, Any]]
+    documents: list[str]
+
+
+# The stores a snapshot is written from: a chroma collection or a compact store.
+SnapshotSource = Collection | CompactVectorStore
+
+
+def _count(store: SnapshotSource) -> int:
+    if isinstance(store, CompactVectorStore):
+        return len(store)
+    return store.count()
+
+
+def _batches(
+    store: SnapshotSource,
+    include: Include,
+    batch_size: int,
+) -> Iterator[dict[str, Any]]:
+    for offset in range(0, _count(store), batch_size):
+        yield dict(store.get(include=include, limit=batch_size, offset=offset))
+
+
+def _hash_ids(digest: Any, ids: list[str]) -> None:
+    for id_ in ids:
+        digest.update(id_.encode() + b"\0")
+
+
+def _write_npy_header(f: IO[bytes], shape: tuple[int, int]) -> None:
+    header = {"descr": _DTYPE.str, "fortran_order": False, "shape": shape}
+    np.lib.format.write_array_header_1_0(f, header)  # type: ignore[no-untyped-call]
+
+
+def _read_npy_header(f: IO[bytes]) -> tuple[tuple[int, ...], np.dtype[Any]]:
+    np.lib.format.read_magic(f)  # type: ignore[no-untyped-call]
+    shape, _, dtype = np.lib.format.read_array_header_1_0(f)  # type: ignore[no-untyped-call]
+    return shape, dtype
+
+
+def _write_archive(
+    path: Path,
+    header: dict[str, Any],
+    store: SnapshotSource,
+    batch_size: int,
+) -> None:
+    written = 0
+    vector_ids, chunk_ids = hashlib.sha256(), hashlib.sha256()
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+        with archive.open(VECTORS_FILE, "w", force_zip64=True) as f:
+            _write_npy_header(f, (header["count"], header["dimensions"]))
+            for batch in _batches(store, ["embeddings"], batch_size):
+                vectors = np.asarray(batch["embeddings"], dtype=_DTYPE)
+                f.write(vectors.reshape(-1, header["dimensions"]).tobytes())
+                written += len(vectors)
+                _hash_ids(vector_ids, batch["ids"])
+        with archive.open(CHUNKS_FILE, "w", force_zip64=True) as f:
+            chunks = io.TextIOWrapper(f, encoding="utf-8")
+            for batch in _batches(store, ["documents", "metadatas"], batch_size):
+                _hash_ids(chunk_ids, batch["ids"])
+                for id_, text, metadata in zip(
+                    batch["ids"],
+                    batch["documents"],
+                    batch["metadatas"],
+                    strict=True,
+                ):
+                    record = {"id": id_, "text": text, "metadata": metadata or {}}
+                    chunks.write(json.dumps(record, ensure_ascii=False) + "\n")
+            chunks.flush()
+            chunks.detach()
+        # the vectors are matched with the chunks by position
+        if written != header["count"] or vector_ids.digest() != chunk_ids.digest():
+            msg = "The vector store changed while it was exported."
+            raise Exception(msg)
+        archive.writestr(HEADER_FILE, json.dumps(header))
+
+
+def write_snapshot(
+    path: Path,
+    manifest: Manifest,
+    store: SnapshotSource,
+    batch_size: int = 1000,
+) -> int:
+    """Write the chunks of a vector store and its manifest to a snapshot.
+
+    The store is read twice, ``batch_size`` chunks at a time: once for the
+    vectors and once for the texts and metadata, and the ids of both reads
+    must match.
+
+    Returns
+    -------
+    int
+        The number of chunks written.
+
+    Raises
+    ------
+    Exception
+        If the store changed while it was written.
+
+    """
+    count = _count(store)
+    first = next(_batches(store, ["embeddings"], 1), None)
+    dimensions = len(first["embeddings"][0]) if first is not None else 0
+    header = {
+        "version": SNAPSHOT_VERSION,
+        "count": count,
+        "dimensions": dimensions,
+        "manifest": manifest_data(manifest),
+    }
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    try:
+        _write_archive(tmp, header, store, batch_size)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    tmp.replace(path)
+    return count
+
+
+def read_header(path: Path) -> SnapshotHeader:
+    """Read the description of the chunks of a snapshot.
+
+    Raises
+    ------
+    ValueError
+        If the file is not a snapshot, or of another version.
+
+    """
+    if not zipfile.is_zipfile(path):
+        msg = f"{path} is not a snapshot."
+        raise ValueError(msg)
+    with zipfile.ZipFile(path) as archive:
+        if HEADER_FILE not in archive.namelist():
+            msg = f"{path} is not a snapshot."
+            raise ValueError(msg)
+        header = json.loads(archive.read(HEADER_FILE))
+    if header.get("version") != SNAPSHOT_VERSION:
+        msg = f"Unsupported snapshot version: {header.get('version')}."
+        raise ValueError(msg)
+    return SnapshotHeader(
+        parse_manifest(header["manifest"]),
+        header["count"],
+        header["dimensions"],
+    )
+
+
+def read_chunks(path: Path, batch_size: int = 1000) -> Iterator[ChunkBatch]:
+    """Read the chunks of a snapshot, ``batch_size`` at a time.
+
+    Raises
+    ------
+    ValueError
+        If the vectors do not match the header or the chunks.
+
+    """
+    header = read_header(path)
+    with (
+        zipfile.ZipFile(path) as archive,
+        archive.open(VECTORS_FILE) as vectors,
+        archive.open(CHUNKS_FILE) as f,
+    ):
+        shape, dtype = _read_npy_header(vectors)
+        if shape != (header.count, header.dimensions) or dtype != _DTYPE:
+            msg = f"The vectors of {path} do not match its header."
+            raise ValueError(msg)
+        chunks = io.TextIOWrapper(f, encoding="utf-8")
+        row_size = header.dimensions * _DTYPE.itemsize
+        for offset in range(0, header.count, batch_size):
+            size = min(batch_size, header.count - offset)
+            data = vectors.read(size * row_size)
+            lines = [chunks.readline() for _ in range(size)]
+            if len(data) != size * row_size or not all(lines):
+                msg = f"The snapshot {path} is truncated."
+                raise ValueError(msg)
+            records = [json.loads(line) for line in lines]
+            yield ChunkBatch(
+                [record["id"] for record in records],
+                np.frombuffer(data, dtype=_DTYPE).reshape(size, header.dimensions),
+                [record["metadata"] for record in records],
+                [record["text"] for record in records],
+            )
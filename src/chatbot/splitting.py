@@ -0,0 +1,112 @@
+"""Splitting of the documents in chunks, optionally in a pool of processes."""
+
+import functools
+import itertools
+from collections import deque
+from collections.abc import Iterable, Iterator
+from concurrent.futures import Future, ProcessPoolExecutor
+
+import tiktoken
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_core.documents import Document
+
+from chatbot.settings import LengthUnit
+
+# The encoding of the OpenAI chat and embedding models.
+ENCODING = "cl100k_base"
+
+# The documents sent to a worker process at a time.
+BATCH_SIZE = 32
+
+
+@functools.cache
+def _encoding(name: str) -> tiktoken.Encoding:
+    return tiktoken.get_encoding(name)
+
+
+@functools.lru_cache(maxsize=65536)
+def count_tokens(text: str) -> int:
+    """Count the tokens of a text in the encoding of the OpenAI models.
+
+    The splitter measures the same pieces of text many times while it merges
+    them, so the counts are cached.
+    """
+    return len(_encoding(ENCODING).encode(text, disallowed_special=()))
+
+
+def get_text_splitter(
+    chunk_size: int,
+    overlap: int,
+    unit: LengthUnit = "chars",
+) -> RecursiveCharacterTextSplitter:
+    """Get the splitter of the chunks, measuring them in chars or in tokens."""
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=overlap,
+        length_function=count_tokens if unit == "tokens" else len,
+        add_start_index=True,
+    )
+
+
+def _split_batch(
+    documents: list[Document],
+    chunk_size: int,
+    overlap: int,
+    unit: LengthUnit,
+) -> list[Document]:
+    return get_text_splitter(chunk_size, overlap, unit).split_documents(documents)
+
+
+def iter_split(
+    documents: Iterable[Document],
+    chunk_size: int,
+    overlap: int,
+    unit: LengthUnit = "chars",
+    workers: int = 1,
+    batch_size: int = BATCH_SIZE,
+) -> Iterator[Document]:
+    """Split the documents, yielding their chunks as they are ready.
+
+    With more than one worker, batches of ``batch_size`` documents are split
+    by a pool of processes, at most two batches per worker ahead of the
+    consumer. The chunks are always yielded in the order of the documents, so
+    the result is the same as a serial run.
+
+    Parameters
+    ----------
+    documents : Iterable[Document]
+        The documents, consumed lazily.
+    chunk_size : int
+        The maximum length of each chunk.
+    overlap : int
+        The length each chunk overlaps with the previous.
+    unit : LengthUnit
+        "chars" or "tokens", how the lengths are measured.
+    workers : int
+        The number of processes splitting the documents.
+    batch_size : int
+        The number of documents sent to a process at a time.
+
+    Yields
+    ------
+    Document
+        The chunks of each document.
+
+    """
+    if workers <= 1:
+        splitter = get_text_splitter(chunk_size, overlap, unit)
+        for document in documents:
+            yield from splitter.split_documents([document])
+        return
+
+    docs = iter(documents)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending: deque[Future[list[Document]]] = deque()
+        while batch := list(itertools.islice(docs, batch_size)):
+            pending.append(
+                pool.submit(_split_batch, batch, chunk_size, overlap, unit),
+            )
+            if len(pending) >= 2 * workers:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
@@ -3,6 +3,9 @@
 from collections.abc import Mapping, MutableMapping, Sequence
 from typing import Any
 
+# OpenAI documents about four characters per token for english text.
+CHARS_PER_TOKEN = 4
+
 
 def flatten_dict(
     d: Mapping[str, Any],
@@ -34,3 +37,13 @@ def depth_set(d: MutableMapping[str, Any], keys: Sequence[str], value: Any) -> N
         d[keys[0]] = {}
 
     depth_set(d[keys[0]], keys[1:], value)
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the number of tokens of a text."""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def split_names(names: str) -> list[str]:
+    """Split a comma separated list of names, dropping the empty ones."""
+    return [name.strip() for name in names.split(",") if name.strip()]
@@ -0,0 +1,433 @@
+"""A compact vector store, memory mapped from binary files."""
+
+import json
+import logging
+import threading
+import uuid
+from collections.abc import Iterable, Sequence
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+import numpy.typing as npt
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+from chatbot.settings import VectorDtype
+
+logger = logging.getLogger("app_logger")
+
+INDEX_VERSION = 1
+INDEX_FILE = "index.json"
+VECTORS_FILE = "vectors.bin"
+SCALES_FILE = "scales.bin"
+CHUNKS_FILE = "chunks.jsonl"
+
+# The number of vectors scored at a time, bounding the memory of a search.
+_BLOCK = 4096
+
+_INT8_MAX = 127
+
+Vectors = npt.NDArray[Any]
+
+
+def truncate(vectors: Vectors, dimensions: int) -> npt.NDArray[np.float32]:
+    """Keep the leading dimensions of the vectors and normalize them again.
+
+    Models trained with Matryoshka representation learning, like the
+    ``text-embedding-3`` family, keep most of their quality when truncated.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if 0 < dimensions < vectors.shape[1]:
+        vectors = vectors[:, :dimensions]
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    normalized: npt.NDArray[np.float32] = vectors / np.where(norms > 0, norms, 1)
+    return normalized
+
+
+def quantize(
+    vectors: npt.NDArray[np.float32],
+    dtype: VectorDtype,
+) -> tuple[Vectors, npt.NDArray[np.float32] | None]:
+    """Convert the vectors to the stored type.
+
+    Returns
+    -------
+    tuple[Vectors, npt.NDArray[np.float32] | None]
+        The converted vectors and, for int8, the scale of every vector.
+
+    """
+    if dtype != "int8":
+        return vectors.astype(dtype), None
+    scales = np.abs(vectors).max(axis=1) / _INT8_MAX
+    scales = np.where(scales > 0, scales, 1).astype(np.float32)
+    quantized = np.round(vectors / scales[:, None]).astype(np.int8)
+    return quantized, scales
+
+
+def _chunk_line(id_: str, text: str, metadata: dict[str, Any]) -> bytes:
+    record = {"id": id_, "text": text, "metadata": metadata}
+    return (json.dumps(record, ensure_ascii=False) + "\n").encode()
+
+
+class CompactVectorStore(VectorStore):
+    """Vectors stored in a binary file and searched by brute force.
+
+    The vectors are normalized, optionally truncated to their leading
+    ``dimensions`` and stored as float32, float16 or int8 with a scale per
+    vector. The file is memory mapped, so opening the store reads only the
+    chunks, and a search scores every vector against the query in blocks.
+
+    An upsert overwrites the replaced vectors in place, appends the new ones
+    and appends the chunks to a log, so it writes only its batch. The index
+    records the rows and the bytes of the log that are complete, and a
+    delete rewrites the files without the deleted chunks.
+
+    Parameters
+    ----------
+    path : Path
+        The folder of the store.
+    embedding_function : Embeddings | None
+        The model embedding the queries.
+    dtype : VectorDtype
+        The type of the stored vectors, when the store is created.
+    dimensions : int
+        The number of dimensions kept, 0 for all, when the store is created.
+
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        embedding_function: Embeddings | None = None,
+        dtype: VectorDtype = "float16",
+        dimensions: int = 0,
+    ) -> None:
+        self.path = path
+        self._embedding_function = embedding_function
+        self.dtype = dtype
+        self.dimensions = dimensions
+        self._lock = threading.Lock()
+        self._ids: list[str] = []
+        self._texts: list[str] = []
+        self._metadatas: list[dict[str, Any]] = []
+        self._positions: dict[str, int] = {}
+        self._log_size = 0
+        self._vectors: Vectors = np.zeros((0, dimensions), dtype=dtype)
+        self._scales: npt.NDArray[np.float32] | None = None
+        if (path / INDEX_FILE).exists():
+            self._load(dtype, dimensions)
+
+    @property
+    def embeddings(self) -> Embeddings | None:
+        """The model embedding the queries."""
+        return self._embedding_function
+
+    def __len__(self) -> int:
+        """Count the stored vectors."""
+        return len(self._ids)
+
+    def _load(self, dtype: VectorDtype, dimensions: int) -> None:
+        with (self.path / INDEX_FILE).open() as f:
+            index = json.load(f)
+        if index.get("version") != INDEX_VERSION:
+            msg = f"Unsupported vector store version: {index.get('version')}."
+            raise ValueError(msg)
+        self.dtype = index["dtype"]
+        self.dimensions = index["dimensions"]
+        if dtype != self.dtype or dimensions not in (0, self.dimensions):
+            logger.warning(
+                "The vector store keeps %s vectors of %d dimensions.",
+                self.dtype,
+                self.dimensions,
+            )
+        self._log_size = index["log_size"]
+        with (self.path / CHUNKS_FILE).open("rb") as f:
+            log = f.read(self._log_size)
+        for line in log.splitlines():
+            self._add_chunk(json.loads(line))
+        if len(log) != self._log_size or len(self._ids) != index["rows"]:
+            msg = f"The vector store at {self.path} is corrupted."
+            raise ValueError(msg)
+        self._map()
+
+    def _add_chunk(self, chunk: dict[str, Any]) -> None:
+        row = self._positions.get(chunk["id"])
+        if row is None:
+            self._positions[chunk["id"]] = len(self._ids)
+            self._ids.append(chunk["id"])
+            self._texts.append(chunk["text"])
+            self._metadatas.append(chunk["metadata"])
+        else:
+            self._texts[row] = chunk["text"]
+            self._metadatas[row] = chunk["metadata"]
+
+    def _map_file(self, name: str, dtype: Any, shape: tuple[int, ...]) -> Any:
+        if shape[0] == 0:
+            return np.zeros(shape, dtype=dtype)
+        path = self.path / name
+        if path.stat().st_size < np.dtype(dtype).itemsize * int(np.prod(shape)):
+            msg = f"The vector store at {self.path} is corrupted."
+            raise ValueError(msg)
+        return np.memmap(path, dtype=dtype, mode="r", shape=shape)
+
+    def _map(self) -> None:
+        rows = len(self._ids)
+        self._vectors = self._map_file(
+            VECTORS_FILE,
+            self.dtype,
+            (rows, self.dimensions),
+        )
+        if self.dtype == "int8":
+            self._scales = self._map_file(SCALES_FILE, np.float32, (rows,))
+
+    def _write_index(self) -> None:
+        index = {
+            "version": INDEX_VERSION,
+            "dtype": self.dtype,
+            "dimensions": self.dimensions,
+            "rows": len(self._ids),
+            "log_size": self._log_size,
+        }
+        tmp = self.path / (INDEX_FILE + ".tmp")
+        with tmp.open("w") as f:
+            json.dump(index, f)
+        tmp.replace(self.path / INDEX_FILE)
+
+    def _save(self) -> None:
+        self.path.mkdir(parents=True, exist_ok=True)
+        arrays = {VECTORS_FILE: self._vectors}
+        if self._scales is not None:
+            arrays[SCALES_FILE] = self._scales
+        for name, array in arrays.items():
+            tmp = self.path / (name + ".tmp")
+            np.ascontiguousarray(array).tofile(tmp)
+            tmp.replace(self.path / name)
+
+        tmp = self.path / (CHUNKS_FILE + ".tmp")
+        with tmp.open("wb") as f:
+            for id_, text, metadata in zip(
+                self._ids,
+                self._texts,
+                self._metadatas,
+                strict=True,
+            ):
+                f.write(_chunk_line(id_, text, metadata))
+            self._log_size = f.tell()
+        tmp.replace(self.path / CHUNKS_FILE)
+        self._write_index()
+        self._map()
+
+    def _write_rows(
+        self,
+        name: str,
+        values: npt.NDArray[Any],
+        replaced: dict[int, int],
+        new: list[int],
+    ) -> None:
+        # the rows past the index are left by an interrupted upsert
+        row_size = values[:1].nbytes
+        path = self.path / name
+        with path.open("r+b" if path.exists() else "wb") as f:
+            for row, i in replaced.items():
+                f.seek(row * row_size)
+                f.write(values[i].tobytes())
+            f.seek(len(self._ids) * row_size)
+            f.write(values[new].tobytes())
+            f.truncate()
+
+    def upsert(
+        self,
+        ids: list[str],
+        embeddings: list[list[float]] | Vectors,
+        metadatas: list[dict[str, Any]],
+        documents: list[str],
+    ) -> None:
+        """Store the vectors of the chunks, replacing those with the same id.
+
+        The arguments are those of the ``upsert`` of a Chroma collection.
+        """
+        if not ids:
+            return
+        if self.dimensions == 0:
+            self.dimensions = len(embeddings[0])
+        quantized, scales = quantize(
+            truncate(np.asarray(embeddings), self.dimensions),
+            self.dtype,
+        )
+
+        with self._lock:
+            self.path.mkdir(parents=True, exist_ok=True)
+            # the last vector of an id repeated in the batch wins
+            latest = {id_: i for i, id_ in enumerate(ids)}
+            replaced = {
+                self._positions[id_]: i
+                for id_, i in latest.items()
+                if id_ in self._positions
+            }
+            new = [i for id_, i in latest.items() if id_ not in self._positions]
+            self._write_rows(VECTORS_FILE, quantized, replaced, new)
+            if scales is not None:
+                self._write_rows(SCALES_FILE, scales, replaced, new)
+
+            with (self.path / CHUNKS_FILE).open("ab") as f:
+                f.truncate(self._log_size)
+                for i in latest.values():
+                    f.write(_chunk_line(ids[i], documents[i], metadatas[i]))
+                    self._add_chunk(
+                        {"id": ids[i], "text": documents[i], "metadata": metadatas[i]},
+                    )
+                self._log_size = f.tell()
+            self._write_index()
+            self._map()
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: list[dict[str, Any]] | None = None,
+        **kwargs: Any,
+    ) -> list[str]:
+        """Embed the texts and store their vectors.
+
+        Returns
+        -------
+        list[str]
+            The ids of the texts, from the ``ids`` keyword or random ones.
+
+        """
+        if self._embedding_function is None:
+            msg = "The vector store has no embedding function."
+            raise ValueError(msg)
+        texts = list(texts)
+        ids = kwargs.get("ids") or [uuid.uuid4().hex for _ in texts]
+        self.upsert(
+            ids,
+            self._embedding_function.embed_documents(texts),
+            metadatas or [{} for _ in texts],
+            texts,
+        )
+        return list(ids)
+
+    def delete(self, ids: list[str] | None = None, **kwargs: Any) -> bool | None:
+        """Remove the vectors of the chunks, rewriting the files."""
+        if not ids:
+            return False
+        with self._lock:
+            removed = set(ids)
+            keep = [i for i, id_ in enumerate(self._ids) if id_ not in removed]
+            self._vectors = np.asarray(self._vectors)[keep]
+            if self._scales is not None:
+                self._scales = np.asarray(self._scales)[keep]
+            self._ids = [self._ids[i] for i in keep]
+            self._texts = [self._texts[i] for i in keep]
+            self._metadatas = [self._metadatas[i] for i in keep]
+            self._positions = {id_: i for i, id_ in enumerate(self._ids)}
+            self._save()
+        return True
+
+    def get(
+        self,
+        include: Sequence[str] | None = None,
+        limit: int | None = None,
+        offset: int = 0,
+    ) -> dict[str, Any]:
+        """Get the stored chunks, shaped like the result of ``Chroma.get``.
+
+        With "embeddings" in ``include`` the float32 vectors are returned too,
+        as stored: truncated, and approximated by float16 and int8.
+        """
+        end = None if limit is None else offset + limit
+        with self._lock:
+            result: dict[str, Any] = {
+                "ids": self._ids[offset:end],
+                "documents": self._texts[offset:end],
+                "metadatas": self._metadatas[offset:end],
+            }
+            vectors, scales = self._vectors, self._scales
+        if include is not None and "embeddings" in include:
+            rows = np.asarray(vectors[offset:end], dtype=np.float32)
+            if scales is not None:
+                rows = rows * scales[offset:end, None]
+            result["embeddings"] = rows
+        return result
+
+    def _search(self, embedding: list[float], k: int) -> list[tuple[Document, float]]:
+        with self._lock:
+            vectors, scales = self._vectors, self._scales
+            texts, metadatas = self._texts, self._metadatas
+        if len(vectors) == 0 or k <= 0:
+            return []
+
+        query = truncate(np.asarray([embedding]), self.dimensions)[0]
+        scores = np.empty(len(vectors), dtype=np.float32)
+        for start in range(0, len(vectors), _BLOCK):
+            block = np.asarray(vectors[start : start + _BLOCK], dtype=np.float32)
+            scores[start : start + len(block)] = block @ query
+        if scales is not None:
+            scores *= scales
+
+        k = min(k, len(scores))
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best], kind="stable")]
+        return [
+            (
+                Document(page_content=texts[i], metadata=dict(metadatas[i])),
+                float(scores[i]),
+            )
+            for i in best
+        ]
+
+    def _embed_query(self, query: str) -> list[float]:
+        if self._embedding_function is None:
+            msg = "The vector store has no embedding function."
+            raise ValueError(msg)
+        return self._embedding_function.embed_query(query)
+
+    def similarity_search(
+        self,
+        query: str,
+        k: int = 4,
+        **kwargs: Any,
+    ) -> list[Document]:
+        """Find the chunks most similar to the query."""
+        return [doc for doc, _ in self._search(self._embed_query(query), k)]
+
+    def similarity_search_with_score(
+        self,
+        query: str,
+        k: int = 4,
+        **kwargs: Any,
+    ) -> list[tuple[Document, float]]:
+        """Find the chunks most similar to the query, with their cosine similarity."""
+        return self._search(self._embed_query(query), k)
+
+    def similarity_search_by_vector(
+        self,
+        embedding: list[float],
+        k: int = 4,
+        **kwargs: Any,
+    ) -> list[Document]:
+        """Find the chunks most similar to the vector."""
+        return [doc for doc, _ in self._search(embedding, k)]
+
+    def _select_relevance_score_fn(self) -> Any:
+        return lambda score: score
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: list[str],
+        embedding: Embeddings,
+        metadatas: list[dict[str, Any]] | None = None,
+        **kwargs: Any,
+    ) -> "CompactVectorStore":
+        """Create a store in the ``path`` keyword from the texts."""
+        store = cls(
+            kwargs["path"],
+            embedding,
+            kwargs.get("dtype", "float16"),
+            kwargs.get("dimensions", 0),
+        )
+        store.add_texts(texts, metadatas, ids=kwargs.get("ids"))
+        return store
@@ -1,9 +1,21 @@
+import hashlib
 import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
 
 import pytest
+from langchain.chains.combine_documents import create_stuff_documents_chain
+from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain_community.embeddings import DeterministicFakeEmbedding
+from langchain_core.documents import Document
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.retrievers import BaseRetriever
 
-from chatbot import config
+from chatbot import config, memory
+from chatbot.fakes import write_pdf
 
 
 @pytest.fixture()
@@ -17,3 +29,149 @@ def tmp_config():
 def default_config_fixture(tmp_config):
     config.create_default(tmp_config)
     return tmp_config
+
+
+@pytest.fixture()
+def pdf_writer():
+    return write_pdf
+
+
+@pytest.fixture()
+def pdf_folder(tmp_path):
+    for i in range(4):
+        write_pdf(
+            tmp_path / f"doc_{i}.pdf",
+            [f"Document {i} page {page} " + "lorem ipsum " * 20 for page in range(3)],
+        )
+    return tmp_path
+
+
+class CountingEmbeddings(DeterministicFakeEmbedding):
+    """Deterministic fake embeddings that count the embedded texts."""
+
+    calls: int = 0
+    texts: int = 0
+    fail_at_call: int = 0
+    queries: int = 0
+
+    def embed_documents(self, texts):
+        if self.calls + 1 == self.fail_at_call:
+            msg = "Embedding failed"
+            raise RuntimeError(msg)
+        self.calls += 1
+        self.texts += len(texts)
+        return super().embed_documents(texts)
+
+    def embed_query(self, text):
+        self.queries += 1
+        return super().embed_query(text)
+
+
+class ListRetriever(BaseRetriever):
+    """A retriever returning the same documents for every query."""
+
+    docs: list[Document]
+
+    def _get_relevant_documents(self, query, *, run_manager):
+        return self.docs
+
+
+@pytest.fixture()
+def list_retriever():
+    return ListRetriever
+
+
+@pytest.fixture()
+def fake_embeddings():
+    return CountingEmbeddings(size=32)
+
+
+@pytest.fixture()
+def memory_dir(tmp_path, monkeypatch):
+    folder = tmp_path / "memory"
+    monkeypatch.setattr(memory, "MEMORY", folder)
+    monkeypatch.setattr(memory, "CHROMA_PATH", folder / "chroma")
+    monkeypatch.setattr(memory, "MANIFEST_PATH", folder / "manifest.json")
+    monkeypatch.setattr(memory, "CHECKPOINT_PATH", folder / "ingest.checkpoint")
+    monkeypatch.setattr(memory, "CHAT_MEMORY", folder / "history.pkl")
+    monkeypatch.setattr(memory, "CHAT_LOG", folder / "history.jsonl")
+    monkeypatch.setattr(memory, "CHAT_SUMMARY", folder / "summary.json")
+    monkeypatch.setattr(memory, "LEXICAL_INDEX", folder / "lexical.sqlite")
+    monkeypatch.setattr(memory, "WEB_CACHE", folder / "web_cache.sqlite")
+    monkeypatch.setattr(memory, "EMBEDDING_CACHE", folder / "embedding_cache.sqlite")
+    monkeypatch.setattr(memory, "ANSWER_CACHE", folder / "answer_cache.sqlite")
+    monkeypatch.setattr(memory, "VECTOR_PATH", folder / "vectors")
+    monkeypatch.setattr(memory, "COLLECTIONS", folder / "collections")
+    return folder
+
+
+@pytest.fixture()
+def fake_chain():
+    def build(*answers):
+        llm = FakeListChatModel(responses=list(answers))
+        prompt = ChatPromptTemplate.from_messages(
+            [("system", "{context}"), MessagesPlaceholder(variable_name="messages")],
+        )
+        return create_stuff_documents_chain(llm, prompt) | StrOutputParser()
+
+    return build
+
+
+class PageServer(ThreadingHTTPServer):
+    """A local web server answering conditional requests with an ETag."""
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), PageHandler)
+        self.pages = {}
+        self.delay = 0.0
+        self.requests = []
+        self.not_modified = 0
+        self.active = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+
+    def url(self, path):
+        return f"http://127.0.0.1:{self.server_port}{path}"
+
+
+class PageHandler(BaseHTTPRequestHandler):
+    def do_GET(self):  # noqa: N802
+        server = self.server
+        with server.lock:
+            server.requests.append(self.path)
+            server.active += 1
+            server.peak = max(server.peak, server.active)
+        time.sleep(server.delay)
+        with server.lock:
+            server.active -= 1
+
+        if self.path not in server.pages:
+            self.send_error(404)
+            return
+        body = server.pages[self.path].encode()
+        etag = '"' + hashlib.sha256(body).hexdigest()[:16] + '"'
+        if self.headers.get("If-None-Match") == etag:
+            with server.lock:
+                server.not_modified += 1
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture()
+def web_server():
+    server = PageServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
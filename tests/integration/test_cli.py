@@ -1,9 +1,19 @@
 from pathlib import Path
 
+import pytest
 import toml
 from click.testing import CliRunner
 
-from chatbot.cli.app import chatbot
+from chatbot.cli import app
+from chatbot.cli.app import _context_settings, _rerank_settings, chatbot
+from chatbot.config import load_chat_config
+
+
+@pytest.fixture(autouse=True)
+def app_dir(tmp_path, monkeypatch):
+    folder = tmp_path / "app"
+    monkeypatch.setattr(app, "APP_DIR", folder)
+    return folder
 
 
 class TestCLI:
@@ -36,7 +46,37 @@ class TestCLI:
         assert "Usage: chatbot configure [OPTIONS]" in result.output
 
     def test_show_configure(self):
-        result = self.runner.invoke(chatbot, ["configure", "show"])
+        result = self.runner.invoke(
+            chatbot,
+            ["--openai-api-key", "key", "configure", "show"],
+        )
         assert result.exit_code == 0
         assert "chatbot.chat.sys-prompt" in result.output
         assert "{context}" in result.output
+
+    def test_show_cache(self, memory_dir):
+        result = self.runner.invoke(
+            chatbot,
+            ["--openai-api-key", "key", "cache", "show"],
+        )
+        assert result.exit_code == 0, result.output
+        assert "hits" in result.output
+        assert "misses" in result.output
+        assert (memory_dir / "embedding_cache.sqlite").exists()
+
+
+def test_rerank_configured_as_string():
+    # as stored by ``configure set chatbot.chat.rerank false``
+    assert (
+        _rerank_settings(load_chat_config({"chat": {"rerank": "false"}}), "cpu") is None
+    )
+    rerank = _rerank_settings(load_chat_config({"chat": {"rerank": "true"}}), "cpu")
+    assert rerank is not None
+    assert rerank.device == "cpu"
+
+
+def test_compression_configured_as_string():
+    config = load_chat_config({"chat": {"compress_context": "false"}})
+    assert _context_settings(config) is None
+    config = load_chat_config({"chat": {"compress_context": "true"}})
+    assert _context_settings(config) is not None
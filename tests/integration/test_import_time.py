@@ -0,0 +1,55 @@
+import subprocess
+import sys
+
+# The seconds `chatbot --help` may spend importing modules, about twice the
+# time it takes on a laptop.
+IMPORT_BUDGET = 1.5
+
+HEAVY_MODULES = {
+    "aiohttp",
+    "bs4",
+    "chromadb",
+    "langchain",
+    "langchain_chroma",
+    "langchain_community",
+    "langchain_core",
+    "langchain_openai",
+    "numpy",
+    "openai",
+    "pypdf",
+}
+
+
+def import_times(*args):
+    """Run the cli with -X importtime, returning the cumulative us by module."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-m", "chatbot", *args],
+        capture_output=True,
+        check=True,
+        text=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        times[name.rstrip()] = int(cumulative)
+    return times
+
+
+def test_help_import_budget():
+    times = import_times("--help")
+
+    imported = {name.strip().split(".")[0] for name in times}
+    assert not imported & HEAVY_MODULES
+    # nested imports are indented, their time is in the cumulative of the parent
+    total = sum(us for name, us in times.items() if not name.startswith("  "))
+    assert total / 1e6 < IMPORT_BUDGET
+
+
+def test_configure_show_is_light():
+    imported = {
+        name.strip().split(".")[0] for name in import_times("configure", "show")
+    }
+
+    assert not imported & HEAVY_MODULES
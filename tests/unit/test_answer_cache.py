@@ -0,0 +1,55 @@
+import time
+
+from langchain_core.documents import Document
+
+from chatbot.answer_cache import AnswerCache
+from chatbot.settings import AnswerCacheSettings
+
+CONTEXT = [Document(page_content="CSC", metadata={"source": "a"})]
+OTHER_CONTEXT = [Document(page_content="DEI", metadata={"source": "b"})]
+
+
+def make_cache(tmp_path, embeddings, version="v1", **settings):
+    return AnswerCache(
+        tmp_path / "answers.sqlite",
+        embeddings,
+        AnswerCacheSettings(**settings),
+        version,
+    )
+
+
+def test_hit_and_miss(tmp_path, fake_embeddings):
+    cache = make_cache(tmp_path, fake_embeddings)
+    assert cache.lookup("who is X?", CONTEXT) is None
+
+    cache.store("who is X?", CONTEXT, "X is a researcher.")
+    assert cache.lookup("who is X?", CONTEXT) == "X is a researcher."
+    assert cache.lookup("who is X?", OTHER_CONTEXT) is None
+    assert cache.lookup("where is the CSC?", CONTEXT) is None
+
+    assert cache.report() == "Answer cache: 1/4 hits (25%)."
+
+
+def test_persistence_and_invalidation(tmp_path, fake_embeddings):
+    make_cache(tmp_path, fake_embeddings).store("q", CONTEXT, "a")
+
+    assert make_cache(tmp_path, fake_embeddings).lookup("q", CONTEXT) == "a"
+    assert make_cache(tmp_path, fake_embeddings, "v2").lookup("q", CONTEXT) is None
+
+
+def test_ttl(tmp_path, fake_embeddings, monkeypatch):
+    cache = make_cache(tmp_path, fake_embeddings, ttl=60)
+    cache.store("q", CONTEXT, "a")
+
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 120)
+    assert cache.lookup("q", CONTEXT) is None
+
+
+def test_size_cap(tmp_path, fake_embeddings):
+    cache = make_cache(tmp_path, fake_embeddings, max_entries=2)
+    for i in range(3):
+        cache.store(f"q{i}", CONTEXT, f"a{i}")
+
+    assert cache.lookup("q0", CONTEXT) is None
+    assert cache.lookup("q2", CONTEXT) == "a2"
@@ -0,0 +1,120 @@
+import asyncio
+import io
+import json
+
+from langchain_chroma import Chroma
+from langchain_core.retrievers import BaseRetriever
+
+from chatbot.ask import BatchAsker, Question, read_questions
+from chatbot.chat import create_chain
+from chatbot.embeddings import PrimedEmbeddings
+from chatbot.fakes import FAKE_ANSWER, FakeChatModel, fake_documents
+from chatbot.manifest import chunk_id
+from chatbot.settings import AskSettings
+
+
+class CountingChatModel(FakeChatModel):
+    running: int = 0
+    peak: int = 0
+
+    async def _agenerate(self, *args, **kwargs):
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        try:
+            return await super()._agenerate(*args, **kwargs)
+        finally:
+            self.running -= 1
+
+
+class FailingRetriever(BaseRetriever):
+    def _get_relevant_documents(self, query, *, run_manager):
+        if query == "fail":
+            msg = "The index is gone."
+            raise RuntimeError(msg)
+        return []
+
+
+def test_read_questions():
+    lines = ['{"question": "Who?", "id": "q1"}\n', "\n", '{"question": "Where?"}\n']
+
+    assert list(read_questions(lines)) == [
+        Question("q1", "Who?"),
+        Question("3", "Where?"),
+    ]
+    assert list(read_questions(['{"id": 1}', "[]"])) == [
+        Question("1", "", "Line 1 has no question."),
+        Question("2", "", "Line 2 has no question."),
+    ]
+    [malformed] = read_questions(['{"question": '])
+    assert malformed.id == "1"
+    assert malformed.error.startswith("Line 1 is not valid JSON:")
+
+
+def test_batch_answers(fake_embeddings):
+    docs = fake_documents(10)
+    db = Chroma.from_documents(docs, fake_embeddings, collection_name="ask")
+    primed = PrimedEmbeddings(fake_embeddings)
+    db._embedding_function = primed
+    llm = CountingChatModel(token_latency=0.001)
+    asker = BatchAsker(
+        create_chain(llm, "{context}"),
+        db.as_retriever(search_kwargs={"k": 2}),
+        AskSettings(concurrency=3, batch_size=4),
+        primed,
+    )
+    questions = [Question(str(i), f"Question {i}?") for i in range(10)]
+    calls = fake_embeddings.calls
+    output = io.StringIO()
+
+    asyncio.run(asker.run(questions, output))
+
+    records = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert sorted(record["id"] for record in records) == [str(i) for i in range(10)]
+    assert all(record["answer"] == FAKE_ANSWER for record in records)
+    ids = {chunk_id(doc) for doc in docs}
+    assert all(len(record["chunks"]) == 2 for record in records)
+    assert all(set(record["chunks"]) <= ids for record in records)
+    assert set(records[0]["timings"]) == {"retrieve_ms", "generate_ms"}
+    assert fake_embeddings.calls - calls == 3
+    assert fake_embeddings.queries == 0
+    assert 1 < llm.peak <= 3
+    assert (asker.answered, asker.failed) == (10, 0)
+
+
+def test_failed_question_is_recorded():
+    asker = BatchAsker(
+        create_chain(FakeChatModel(), "{context}"),
+        FailingRetriever(),
+        AskSettings(),
+    )
+    output = io.StringIO()
+
+    asyncio.run(asker.run([Question("1", "fail"), Question("2", "Who?")], output))
+
+    records = {
+        record["id"]: record
+        for record in map(json.loads, output.getvalue().splitlines())
+    }
+    assert records["1"]["error"] == "The index is gone."
+    assert records["2"]["answer"] == FAKE_ANSWER
+    assert (asker.answered, asker.failed) == (1, 1)
+
+
+def test_malformed_line_is_recorded():
+    asker = BatchAsker(
+        create_chain(FakeChatModel(), "{context}"),
+        FailingRetriever(),
+        AskSettings(batch_size=2),
+    )
+    lines = ['{"question": "Who?"}', "not json", '{"question": "Where?"}']
+    output = io.StringIO()
+
+    asyncio.run(asker.run(read_questions(lines), output))
+
+    records = {
+        record["id"]: record
+        for record in map(json.loads, output.getvalue().splitlines())
+    }
+    assert records["2"]["error"].startswith("Line 2 is not valid JSON:")
+    assert records["1"]["answer"] == records["3"]["answer"] == FAKE_ANSWER
+    assert (asker.answered, asker.failed) == (2, 1)
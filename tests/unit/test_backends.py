@@ -0,0 +1,70 @@
+import pytest
+from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+
+from chatbot import backends, embeddings
+from chatbot.settings import BackendSettings
+
+
+class FakeSentenceTransformer:
+    def __init__(self):
+        self.batches = []
+
+    def encode(self, texts, batch_size, normalize_embeddings, convert_to_numpy):
+        self.batches.append(batch_size)
+        return [[float(len(text)), 1.0] for text in texts]
+
+
+def test_openai_backends():
+    embeddings = backends.create_embeddings("text-embedding-3-small", "sk-test")
+    llm = backends.create_chat_model("gpt-4-turbo", 0.5, "sk-test")
+
+    assert isinstance(embeddings, OpenAIEmbeddings)
+    assert isinstance(llm, ChatOpenAI)
+    assert backends.embedding_id("text-embedding-3-small") == "text-embedding-3-small"
+
+
+def test_local_backends(monkeypatch):
+    model = FakeSentenceTransformer()
+    monkeypatch.setattr(embeddings, "_load_model", lambda name, device: model)
+    settings = BackendSettings(
+        embedding_backend="local",
+        chat_backend="local",
+        chat_base_url="http://localhost:8000/v1",
+        batch_size=2,
+    )
+
+    local = backends.create_embeddings("all-MiniLM-L6-v2", "", settings)
+    llm = backends.create_chat_model("llama3", 0.5, "", settings)
+
+    assert local.embed_documents(["a", "bcd"]) == [[1.0, 1.0], [3.0, 1.0]]
+    assert local.embed_query("ab") == [2.0, 1.0]
+    assert model.batches == [2, 2]
+    assert isinstance(llm, ChatOpenAI)
+    assert llm.openai_api_base == "http://localhost:8000/v1"
+    assert backends.embedding_id("all-MiniLM-L6-v2", settings) == (
+        "local:all-MiniLM-L6-v2"
+    )
+
+
+def test_default_models():
+    settings = BackendSettings(embedding_backend="local", chat_backend="local")
+
+    assert backends.embedding_model("", settings) == backends.EMBEDDING_MODELS["local"]
+    assert backends.embedding_model("", None) == "text-embedding-3-large"
+    assert backends.embedding_model("all-MiniLM-L6-v2", settings) == (
+        "all-MiniLM-L6-v2"
+    )
+    assert backends.create_chat_model("", 0.5, "", settings).model_name == "llama3"
+    assert backends.embedding_id("", settings) == (
+        "local:sentence-transformers/all-MiniLM-L6-v2"
+    )
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError, match="Unknown chat backend: ollama"):
+        backends.create_chat_model(
+            "llama3",
+            0.5,
+            "",
+            BackendSettings(chat_backend="ollama"),
+        )
@@ -0,0 +1,99 @@
+import time
+
+import httpx
+import openai
+import pytest
+from langchain_core.documents import Document
+
+from chatbot import batching, memory
+from chatbot.settings import BatchSettings
+
+
+def chunks(n, size=40):
+    return {
+        f"id{i}": Document(page_content="x" * size, metadata={"i": i}) for i in range(n)
+    }
+
+
+def test_token_batches():
+    settings = BatchSettings(batch_size=3, batch_tokens=25)
+    batches = list(batching.token_batches(chunks(7).items(), settings))
+
+    assert [len(batch) for batch in batches] == [2, 2, 2, 1]
+    assert [id_ for batch in batches for id_, _ in batch] == list(chunks(7))
+
+    settings = BatchSettings(batch_size=3, batch_tokens=1000)
+    batches = list(batching.token_batches(chunks(7).items(), settings))
+    assert [len(batch) for batch in batches] == [3, 3, 1]
+
+
+def test_token_bucket():
+    bucket = batching.TokenBucket(rate=1000, capacity=100)
+    start = time.monotonic()
+    bucket.acquire(100)
+    bucket.acquire(50)
+    assert time.monotonic() - start >= 0.04
+
+
+def test_embed_and_store(tmp_path, memory_dir, fake_embeddings):
+    db = memory.get_memory(fake_embeddings)
+    settings = BatchSettings(batch_size=4, concurrency=2)
+    stored = batching.embed_and_store(
+        memory.chroma_collection(memory.CHROMA_PATH),
+        fake_embeddings,
+        chunks(10),
+        settings,
+        tmp_path / "checkpoint",
+    )
+
+    assert stored == 10
+    assert fake_embeddings.calls == 3
+    assert sorted(db.get()["ids"]) == sorted(chunks(10))
+
+
+def test_resume_from_checkpoint(tmp_path, memory_dir, fake_embeddings):
+    db = memory.get_memory(fake_embeddings)
+    sink = memory.chroma_collection(memory.CHROMA_PATH)
+    settings = BatchSettings(batch_size=2, concurrency=1)
+    checkpoint = tmp_path / "checkpoint"
+    params = {"chunk_size": 100}
+
+    fake_embeddings.fail_at_call = 4
+    with pytest.raises(RuntimeError, match="Embedding failed"):
+        batching.embed_and_store(
+            sink,
+            fake_embeddings,
+            chunks(10),
+            settings,
+            checkpoint,
+            params=params,
+        )
+    fake_embeddings.fail_at_call = 0
+
+    assert len(batching.load_checkpoint(checkpoint)) == 6
+    assert batching.checkpoint_params(checkpoint) == params
+    batching.embed_and_store(sink, fake_embeddings, chunks(10), settings, checkpoint)
+    assert fake_embeddings.texts == 10
+    assert sorted(db.get()["ids"]) == sorted(chunks(10))
+
+
+class FlakyEmbeddings:
+    def __init__(self, errors):
+        self.errors = errors
+
+    def embed_documents(self, texts):
+        if self.errors:
+            raise self.errors.pop()
+        return [[1.0, 0.0] for _ in texts]
+
+
+def test_connection_errors_are_retried(monkeypatch):
+    request = httpx.Request("POST", "https://api.openai.com/v1/embeddings")
+    model = FlakyEmbeddings(
+        [openai.APITimeoutError(request), openai.APIConnectionError(request=request)],
+    )
+    delays = []
+    monkeypatch.setattr(batching.time, "sleep", delays.append)
+
+    assert len(batching._embed_batch(model, list(chunks(3).items()), None)) == 3
+    assert len(delays) == 2
@@ -0,0 +1,206 @@
+import asyncio
+import signal
+import threading
+import time
+
+import httpx
+import pytest
+from langchain.memory import ChatMessageHistory
+from langchain_chroma import Chroma
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.retrievers import BaseRetriever
+from rich.console import Console
+
+from chatbot import chat, memory
+from chatbot.answer_cache import AnswerCache
+from chatbot.embeddings import PrimedEmbeddings
+from chatbot.history import HistoryWindow
+from chatbot.settings import AnswerCacheSettings, HistorySettings
+
+ANSWER = "Why did the *sonologist* cross the road? To hear the other side."
+
+
+class ColdRetriever(BaseRetriever):
+    """A retriever slow on its first query, like an index loaded lazily."""
+
+    cold_delay: float = 0.3
+    queries: list = []
+    cold: list = []
+
+    def _get_relevant_documents(self, query, *, run_manager):
+        if not self.queries:
+            time.sleep(self.cold_delay)
+            self.cold.append(query)
+        self.queries.append(query)
+        return []
+
+
+@pytest.fixture()
+def retriever(memory_dir, fake_embeddings):
+    return memory.get_memory(fake_embeddings).as_retriever()
+
+
+@pytest.mark.parametrize("stream", [True, False])
+def test_loop(monkeypatch, fake_chain, retriever, stream):
+    monkeypatch.setattr(chat.Prompt, "ask", lambda *_: "Tell me a joke")
+    console = Console(record=True, width=200)
+    history = HistoryWindow(ChatMessageHistory(), HistorySettings())
+
+    chat.loop(history, fake_chain(ANSWER), retriever, console, stream=stream)
+
+    assert [message.content for message in history.messages] == [
+        "Tell me a joke",
+        ANSWER,
+    ]
+    assert "sonologist" in console.export_text()
+    assert "*sonologist*" not in console.export_text()
+
+
+def test_loop_answer_cache(tmp_path, monkeypatch, fake_chain, fake_embeddings):
+    monkeypatch.setattr(chat.Prompt, "ask", lambda *_: "Tell me a joke")
+    console = Console(record=True, width=200)
+    history = HistoryWindow(ChatMessageHistory(), HistorySettings())
+    cache = AnswerCache(
+        tmp_path / "a.sqlite",
+        fake_embeddings,
+        AnswerCacheSettings(),
+        "",
+    )
+    primed = PrimedEmbeddings(fake_embeddings)
+    retriever = Chroma(embedding_function=primed).as_retriever()
+    chain = fake_chain("first", "second")
+
+    for _ in range(2):
+        chat.loop(
+            history,
+            chain,
+            retriever,
+            console,
+            answer_cache=cache,
+            embeddings=primed,
+        )
+
+    assert [message.content for message in history.messages][1::2] == [
+        "first",
+        "first",
+    ]
+    assert (cache.hits, cache.misses) == (1, 1)
+    # once per turn, for both the cache and the retrieval
+    assert fake_embeddings.queries == 2
+
+
+def test_warm_up():
+    requests = []
+    client = httpx.AsyncClient(
+        transport=httpx.MockTransport(
+            lambda request: requests.append(request) or httpx.Response(401),
+        ),
+    )
+    retriever = ColdRetriever(queries=[])
+
+    asyncio.run(chat.warm_up(retriever, client, "https://api.example.com/v1/models"))
+
+    assert [str(request.url) for request in requests] == [
+        "https://api.example.com/v1/models",
+    ]
+    assert retriever.queries == [chat.WARM_UP_QUERY]
+    chat.retrieve(retriever, "first question")
+    # the warm up paid for loading the index, not the first question
+    assert retriever.cold == [chat.WARM_UP_QUERY]
+
+
+def test_warm_up_failure_is_ignored():
+    requests = []
+
+    def refuse(request):
+        requests.append(request)
+        msg = "Connection refused"
+        raise httpx.ConnectError(msg, request=request)
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(refuse))
+    queries = []
+
+    class BrokenRetriever(BaseRetriever):
+        def _get_relevant_documents(self, query, *, run_manager):
+            queries.append(query)
+            raise RuntimeError
+
+    asyncio.run(
+        chat.warm_up(BrokenRetriever(), client, "https://api.example.com/v1/models"),
+    )
+
+    assert len(requests) == 1
+    assert queries == [chat.WARM_UP_QUERY]
+
+
+class MeetingRetriever(BaseRetriever):
+    """A retriever waiting, during its query, for the history to be updated."""
+
+    retrieving: threading.Event
+    added: threading.Event
+    met: list = []
+
+    def _get_relevant_documents(self, query, *, run_manager):
+        self.retrieving.set()
+        self.met.append(self.added.wait(timeout=5))
+        return []
+
+
+def test_retrieval_overlaps_history(monkeypatch, fake_chain):
+    monkeypatch.setattr(chat.Prompt, "ask", lambda *_: "Tell me a joke")
+    retriever = MeetingRetriever(
+        retrieving=threading.Event(),
+        added=threading.Event(),
+        met=[],
+    )
+    add = HistoryWindow.add_user_message
+    met = []
+
+    def add_while_retrieving(self, message):
+        met.append(retriever.retrieving.wait(timeout=5))
+        add(self, message)
+        retriever.added.set()
+
+    monkeypatch.setattr(HistoryWindow, "add_user_message", add_while_retrieving)
+    history = HistoryWindow(ChatMessageHistory(), HistorySettings())
+
+    chat.loop(history, fake_chain(ANSWER), retriever, Console(width=200))
+
+    # run one after the other, the first would wait for the second in vain
+    assert met == retriever.met == [True]
+    assert [message.content for message in history.messages] == [
+        "Tell me a joke",
+        ANSWER,
+    ]
+
+
+def test_ctrl_c_cancels_the_answer(monkeypatch):
+    monkeypatch.setattr(chat.Prompt, "ask", lambda *_: "Tell me a joke")
+    llm = FakeListChatModel(responses=[ANSWER], sleep=0.1)
+    console = Console(record=True, width=200)
+    history = HistoryWindow(ChatMessageHistory(), HistorySettings())
+    event_loop = asyncio.new_event_loop()
+    add_signal_handler = event_loop.add_signal_handler
+    handled = []
+
+    def press_ctrl_c_later(sig, callback):
+        add_signal_handler(sig, callback)
+        handled.append(sig)
+        # as the signal would, without sending it to the test process
+        event_loop.call_later(0.3, callback)
+
+    monkeypatch.setattr(event_loop, "add_signal_handler", press_ctrl_c_later)
+
+    chat.loop(
+        history,
+        chat.create_chain(llm, "{context}"),
+        ColdRetriever(queries=["warm"]),
+        console,
+        stream=True,
+        event_loop=event_loop,
+    )
+    event_loop.close()
+
+    assert handled == [signal.SIGINT]
+    assert "Answer cancelled." in console.export_text()
+    assert [message.content for message in history.messages] == ["Tell me a joke"]
@@ -7,3 +7,27 @@ def test_create_default(default_config_fixture):
     with Path(default_config_fixture / config.CONFIG_FILE).open() as f:
         content = f.read()
         assert """# This is the chatbot configuration file.""" in content
+
+
+def test_load_chat_config():
+    chat = config.load_chat_config({"chat": {"temperature": 0.2}})
+
+    assert chat["temperature"] == 0.2
+    assert chat["model"] == config.DEFAULT_CONFIG["chatbot"]["chat"]["model"]
+    assert config.load_chat_config(None) == config.DEFAULT_CONFIG["chatbot"]["chat"]
+
+
+def test_cli_defaults_match_the_config():
+    from chatbot.cli.app import chatbot
+
+    defaults = config.DEFAULT_CONFIG["chatbot"]
+    commands = {None: chatbot, **chatbot.commands}
+    checked = 0
+    for name, command in commands.items():
+        section = defaults if name is None else defaults.get(name, {})
+        # the options without a default are only set by the configuration
+        for param in command.params:
+            if param.name in section and param.default is not None:
+                assert param.default == section[param.name], param.name
+                checked += 1
+    assert checked > 30
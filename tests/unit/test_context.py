@@ -0,0 +1,84 @@
+from langchain_core.documents import Document
+
+from chatbot.context import (
+    CompressedRetriever,
+    diversify,
+    drop_duplicates,
+    fit_budget,
+    merge_adjacent,
+)
+from chatbot.settings import ContextSettings
+from chatbot.utils import estimate_tokens
+
+PAGE = "Mario Rossi works in room 201. He studies sound synthesis. " * 3
+
+
+def chunk(start, end, source="csc.pdf", page=0):
+    return Document(
+        page_content=PAGE[start:end],
+        metadata={"source": source, "page": page, "start_index": start},
+    )
+
+
+def test_merge_adjacent():
+    other = Document(page_content="Spatial audio.", metadata={"source": "web"})
+    docs = [chunk(40, 100), other, chunk(0, 50), chunk(120, 150), chunk(0, 30, page=1)]
+
+    merged = merge_adjacent(docs)
+
+    assert [doc.page_content for doc in merged] == [
+        PAGE[0:100],
+        "Spatial audio.",
+        PAGE[120:150],
+        PAGE[0:30],
+    ]
+    assert merged[0].metadata["start_index"] == 0
+
+
+def test_drop_duplicates():
+    docs = [
+        Document(page_content="Mario Rossi works in room 201."),
+        Document(page_content="Rossi works in room 201"),
+        Document(page_content="The course INF-101 covers spatial audio."),
+    ]
+
+    assert drop_duplicates(docs, 0.8) == [docs[0], docs[2]]
+    assert drop_duplicates(docs, 1.1) == docs
+
+
+def test_diversify():
+    docs = [
+        Document(page_content="room 201 sound synthesis"),
+        Document(page_content="room 201 sound synthesis lab"),
+        Document(page_content="spatial audio course"),
+    ]
+
+    assert diversify(docs, 2, 1.0) == docs[:2]
+    assert diversify(docs, 2, 0.5) == [docs[0], docs[2]]
+
+
+def test_fit_budget():
+    docs = [
+        Document(page_content="a" * 400),
+        Document(page_content="b" * 400),
+        Document(page_content="c" * 40),
+    ]
+
+    assert fit_budget(docs, 0) == docs
+    assert fit_budget(docs, 120) == [docs[0], docs[2]]
+    assert estimate_tokens(fit_budget(docs, 50)[0].page_content) <= 50
+
+
+def test_compressed_retriever(list_retriever):
+    docs = [chunk(0, 60), chunk(50, 110), chunk(0, 60, source="copy.pdf")]
+    retriever = CompressedRetriever(
+        retriever=list_retriever(docs=docs),
+        settings=ContextSettings(),
+    )
+
+    context = retriever.invoke("Where is Mario Rossi?")
+
+    assert [doc.page_content for doc in context] == [PAGE[0:110]]
+    assert retriever.turns == 1
+    assert retriever.tokens_after < retriever.tokens_before
+    assert retriever.report().endswith("over 1 questions.")
@@ -0,0 +1,63 @@
+from chatbot.embeddings import CachedEmbeddings, EmbeddingCache, PrimedEmbeddings
+
+
+def test_cache_hits(tmp_path, fake_embeddings):
+    cache = EmbeddingCache(tmp_path / "cache.sqlite", 100)
+    cached = CachedEmbeddings(fake_embeddings, "fake", cache)
+
+    first = cached.embed_documents(["a", "b", "a"])
+    assert fake_embeddings.texts == 2
+    assert (cached.hits, cached.misses) == (1, 2)
+
+    assert cached.embed_documents(["b", "a"]) == [first[1], first[0]]
+    assert fake_embeddings.texts == 2
+    assert (cached.hits, cached.misses) == (3, 2)
+
+    cached.save_stats()
+    assert cache.stats() == {"entries": 2, "max_entries": 100, "hits": 3, "misses": 2}
+
+
+def test_cache_is_persistent(tmp_path, fake_embeddings):
+    path = tmp_path / "cache.sqlite"
+    CachedEmbeddings(fake_embeddings, "fake", EmbeddingCache(path, 100)).embed_query(
+        "question",
+    )
+    cached = CachedEmbeddings(fake_embeddings, "fake", EmbeddingCache(path, 100))
+
+    cached.embed_query("question")
+    assert cached.hits == 1
+
+    other_model = CachedEmbeddings(fake_embeddings, "other", EmbeddingCache(path, 100))
+    other_model.embed_query("question")
+    assert other_model.misses == 1
+
+
+def test_lru_eviction(tmp_path, fake_embeddings):
+    cache = EmbeddingCache(tmp_path / "cache.sqlite", 2)
+    cached = CachedEmbeddings(fake_embeddings, "fake", cache)
+
+    cached.embed_documents(["a"])
+    cached.embed_documents(["b"])
+    cached.embed_documents(["a"])
+    cached.embed_documents(["c"])
+
+    assert cache.stats()["entries"] == 2
+    assert set(cache.get_many("fake", [])) == set()
+    cached.embed_documents(["a", "c"])
+    assert cached.misses == 3
+    cached.embed_documents(["b"])
+    assert cached.misses == 4
+
+
+def test_primed_embeddings(fake_embeddings):
+    primed = PrimedEmbeddings(fake_embeddings)
+    primed.prime(["a", "b", "a"])
+
+    assert primed.embed_query("a") == fake_embeddings.embed_documents(["a"])[0]
+    primed.embed_query("a")
+    primed.embed_query("b")
+    assert fake_embeddings.calls == 2
+    assert fake_embeddings.queries == 0
+
+    primed.embed_query("a")
+    assert fake_embeddings.queries == 1
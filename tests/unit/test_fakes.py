@@ -0,0 +1,59 @@
+import random
+
+from chatbot import memory
+from chatbot.fakes import (
+    FAKE_ANSWER,
+    FakeChatModel,
+    FakeEmbeddings,
+    fake_text,
+    fake_web_pages,
+    write_pdf_corpus,
+)
+
+
+def test_fake_embeddings():
+    embeddings = FakeEmbeddings(size=64)
+    query = embeddings.embed_query("sound synthesis")
+    similar, other = embeddings.embed_documents(
+        ["sound synthesis at the center", "thesis proposals"],
+    )
+
+    assert query == embeddings.embed_query("sound synthesis")
+    assert len(query) == 64
+
+    def dot(a, b):
+        return sum(x * y for x, y in zip(a, b, strict=True))
+
+    assert dot(query, similar) > dot(query, other)
+
+
+def test_fake_chat_model():
+    llm = FakeChatModel()
+
+    assert "".join(chunk.content for chunk in llm.stream("Hi")) == FAKE_ANSWER
+    assert llm.invoke("Hi").content == FAKE_ANSWER
+
+
+def test_fake_text_is_deterministic():
+    text = fake_text(random.Random(1), 100)
+
+    assert text == fake_text(random.Random(1), 100)
+    assert len(text.split()) >= 100
+
+
+def test_pdf_corpus(tmp_path):
+    pdfs = write_pdf_corpus(tmp_path, 3, 2, words=50)
+
+    assert memory.list_pdfs(tmp_path) == pdfs
+    docs = memory.load_pdfs(tmp_path)
+    assert len(docs) == 6
+    assert docs[0].page_content.startswith(fake_text(random.Random(0), 50)[:20])
+
+
+def test_fake_web_pages():
+    pages = fake_web_pages(3, words=20)
+
+    assert [page.metadata["source"] for page in pages] == [
+        f"https://csc.example.org/page/{i}" for i in range(3)
+    ]
+    assert pages == fake_web_pages(3, words=20)
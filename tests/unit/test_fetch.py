@@ -0,0 +1,76 @@
+from chatbot.fetch import Page, ResponseCache, WebFetcher, parse_page
+from chatbot.settings import FetchSettings
+
+HTML = (
+    '<html lang="it"><head><title>Page {i}</title>'
+    '<meta name="description" content="About {i}"></head>'
+    "<body><p>Researcher {i} works on sound synthesis.</p></body></html>"
+)
+
+
+def serve_pages(server, count):
+    server.pages = {f"/page/{i}": HTML.format(i=i) for i in range(count)}
+    return [server.url(f"/page/{i}") for i in range(count)]
+
+
+def test_conditional_requests(web_server, tmp_path):
+    urls = serve_pages(web_server, 5)
+    cache = ResponseCache(tmp_path / "cache.sqlite")
+    fetcher = WebFetcher(FetchSettings(), cache)
+
+    first = list(fetcher.fetch(urls))
+    assert [page.url for page in first] == urls
+    assert not any(page.not_modified for page in first)
+
+    web_server.pages["/page/3"] = HTML.format(i="changed")
+    second = list(fetcher.fetch(urls))
+    fetcher.close()
+    cache.close()
+
+    assert [page.not_modified for page in second] == [True, True, True, False, True]
+    assert web_server.not_modified == 4
+    assert [page.text for page in second] == [
+        web_server.pages[f"/page/{i}"] for i in range(5)
+    ]
+
+
+def test_per_host_limit(web_server):
+    urls = serve_pages(web_server, 8)
+    web_server.delay = 0.05
+
+    fetcher = WebFetcher(FetchSettings(concurrency=8, per_host=2))
+    assert len(list(fetcher.fetch(urls))) == 8
+    assert web_server.peak == 2
+
+    web_server.peak = 0
+    fetcher = WebFetcher(FetchSettings(concurrency=8, per_host=8))
+    list(fetcher.fetch(urls))
+    assert web_server.peak > 2
+
+
+def test_failed_page(web_server, tmp_path, caplog):
+    urls = serve_pages(web_server, 2)
+    cache = ResponseCache(tmp_path / "cache.sqlite")
+    fetcher = WebFetcher(FetchSettings(), cache)
+    list(fetcher.fetch(urls))
+
+    del web_server.pages["/page/0"]
+    missing = web_server.url("/missing")
+    pages = list(fetcher.fetch([*urls, missing]))
+
+    assert [page.url for page in pages] == urls
+    assert pages[0].text == HTML.format(i=0)
+    assert "using the cache" in caplog.text
+    assert "Could not fetch " + missing in caplog.text
+
+
+def test_parse_page():
+    doc = parse_page(Page("https://csc.example.org/1", HTML.format(i=1)))
+
+    assert "Researcher 1 works on sound synthesis." in doc.page_content
+    assert doc.metadata == {
+        "source": "https://csc.example.org/1",
+        "title": "Page 1",
+        "description": "About 1",
+        "language": "it",
+    }
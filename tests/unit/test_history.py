@@ -0,0 +1,139 @@
+import pickle
+
+from langchain.memory import ChatMessageHistory
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.messages import AIMessage, SystemMessage
+
+from chatbot import history, memory
+from chatbot.history import (
+    ChatLog,
+    HistoryWindow,
+    create_summarizer,
+    load_history,
+)
+from chatbot.settings import HistorySettings
+
+
+def make_history(turns, size=10):
+    history = ChatMessageHistory()
+    for i in range(turns):
+        history.add_user_message(f"question {i} " + "q" * size)
+        history.add_ai_message(f"answer {i} " + "a" * size)
+    return history
+
+
+def test_window_turns():
+    window = HistoryWindow(make_history(5), HistorySettings(max_turns=2))
+    window.add_user_message("last question")
+
+    assert window.window_start() == 8
+    assert [m.content for m in window.messages][0].startswith("question 4")
+    assert window.messages[-1].content == "last question"
+
+
+def test_window_tokens():
+    window = HistoryWindow(make_history(5, size=400), HistorySettings(max_tokens=250))
+
+    # the budget fits one turn and the window starts with a question
+    assert window.window_start() == 8
+
+    window.add_user_message("x" * 2000)
+    assert window.window_start() == 10
+
+
+def test_summary():
+    summarizer = create_summarizer(FakeListChatModel(responses=["first", "second"]))
+    window = HistoryWindow(make_history(3), HistorySettings(max_turns=1), summarizer)
+
+    window.summarize()
+    window.close()
+
+    assert window.summarized == 4
+    assert window.summary == "first"
+    assert window.messages[0] == SystemMessage(
+        content="Summary of the earlier conversation:\nfirst",
+    )
+    assert len(window.messages) == 3
+
+
+def test_long_summary_is_truncated(caplog):
+    summarizer = create_summarizer(FakeListChatModel(responses=["first"]))
+    settings = HistorySettings(max_turns=1, max_tokens=250)
+    window = HistoryWindow(make_history(6, size=400), settings, summarizer)
+
+    window.summarize()
+    window.close()
+
+    assert window.summarized == 10
+    assert "Left 8 messages out of the summary" in caplog.text
+
+
+def test_no_summarizer_drops_older_turns():
+    window = HistoryWindow(make_history(3), HistorySettings(max_turns=1))
+    window.summarize()
+    window.close()
+
+    assert window.summary == ""
+    assert len(window.messages) == 2
+
+
+def test_chat_log(tmp_path):
+    log = ChatLog(tmp_path / "history.jsonl")
+    for message in make_history(3).messages:
+        log.append(message)
+
+    reopened = ChatLog(tmp_path / "history.jsonl")
+    assert reopened.next_seq == 6
+    assert reopened.session != log.session
+
+    tail = reopened.tail(3)
+    assert [seq for seq, _ in tail] == [3, 4, 5]
+    assert isinstance(tail[0][1], AIMessage)
+    assert tail[-1][1].content.startswith("answer 2")
+    assert len(reopened.tail(100)) == 6
+
+
+def test_chat_log_tail_across_blocks(tmp_path, monkeypatch):
+    monkeypatch.setattr(history, "_BLOCK_SIZE", 64)
+    log = ChatLog(tmp_path / "history.jsonl")
+    for message in make_history(20, size=100).messages:
+        log.append(message)
+
+    assert [seq for seq, _ in log.tail(5)] == [35, 36, 37, 38, 39]
+
+
+def test_compact(tmp_path):
+    for _ in range(3):
+        log = ChatLog(tmp_path / "history.jsonl")
+        for message in make_history(2).messages:
+            log.append(message)
+
+    assert log.compact(keep_sessions=1) == 8
+    assert [seq for seq, _ in log.tail(100)] == [8, 9, 10, 11]
+    assert ChatLog(tmp_path / "history.jsonl").next_seq == 12
+
+
+def test_migrate_pickle(memory_dir):
+    memory_dir.mkdir()
+    with memory.CHAT_MEMORY.open("wb") as f:
+        pickle.dump(make_history(2).messages, f)
+
+    log = memory.open_chat_log()
+    assert not memory.CHAT_MEMORY.exists()
+    assert len(log.tail(100)) == 4
+
+    assert len(memory.open_chat_log().tail(100)) == 4
+
+
+def test_load_history(tmp_path):
+    log = ChatLog(tmp_path / "history.jsonl")
+    for message in make_history(10).messages:
+        log.append(message)
+
+    window = load_history(log, HistorySettings(max_turns=2), None, ("summary", 14))
+    assert window.offset == 12
+    assert window.summarized == 2
+    assert len(window.history.messages) == 8
+
+    window.add_user_message("new question")
+    assert log.tail(1)[0][1].content == "new question"
@@ -0,0 +1,71 @@
+import pytest
+from langchain_chroma import Chroma
+from langchain_core.documents import Document
+
+from chatbot.lexical import HybridRetriever, LexicalIndex, tokenize
+from chatbot.manifest import chunk_id
+
+TEXTS = [
+    "Mario Rossi works in room 201 on sound synthesis.",
+    "The course INF-101 covers music information retrieval.",
+    "Spatial audio is studied by the Center for Computational Sonology.",
+    "Audio restoration of old tapes, in room 305.",
+]
+
+
+@pytest.fixture()
+def chunks():
+    docs = [
+        Document(page_content=text, metadata={"page": i})
+        for i, text in enumerate(TEXTS)
+    ]
+    return {chunk_id(doc): doc for doc in docs}
+
+
+@pytest.fixture()
+def index(tmp_path, chunks):
+    index = LexicalIndex(tmp_path / "lexical.sqlite")
+    index.add(chunks)
+    return index
+
+
+def test_tokenize():
+    assert tokenize("Room 201, INF-101!") == ["room", "201", "inf", "101"]
+
+
+def test_search(index, chunks):
+    ids = list(chunks)
+
+    assert [id_ for id_, _ in index.search("who is in room 201?", 4)][0] == ids[0]
+    assert [id_ for id_, _ in index.search("INF-101", 1)] == [ids[1]]
+    assert index.search("nothing matches", 4) == []
+
+
+def test_add_delete_persist(tmp_path, index, chunks):
+    ids = list(chunks)
+    index.delete([ids[0]])
+    index.add({ids[1]: chunks[ids[1]]})
+    index.close()
+
+    index = LexicalIndex(tmp_path / "lexical.sqlite")
+    assert len(index) == 3
+    assert index.search("Rossi", 4) == []
+    assert index.documents([ids[1], "unknown"]) == {ids[1]: chunks[ids[1]]}
+
+
+@pytest.mark.parametrize("mode", ["vector", "hybrid", "lexical"])
+def test_hybrid_retriever(index, chunks, fake_embeddings, mode):
+    db = Chroma.from_documents(
+        list(chunks.values()),
+        fake_embeddings,
+        ids=list(chunks),
+        collection_name=f"test-{mode}",
+    )
+    retriever = HybridRetriever(vectorstore=db, lexical=index, mode=mode, k=2)
+
+    docs = retriever.invoke("who is in room 201?")
+
+    assert len(docs) == 2
+    if mode != "vector":
+        assert docs[0].page_content == TEXTS[0]
+    assert fake_embeddings.queries == (mode != "lexical")
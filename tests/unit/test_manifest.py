@@ -0,0 +1,35 @@
+from langchain_core.documents import Document
+
+from chatbot import manifest
+
+
+def test_save_and_load(tmp_path):
+    path = tmp_path / "memory" / "manifest.json"
+    assert manifest.load_manifest(path) is None
+
+    saved = manifest.Manifest(chunk_size=10, overlap=2)
+    saved.sources["a.pdf"] = manifest.SourceEntry("pdf", "abc", ["1", "2"])
+    manifest.save_manifest(saved, path)
+
+    assert manifest.load_manifest(path) == saved
+
+
+def test_changed_and_removed():
+    current = manifest.Manifest(chunk_size=10, overlap=2)
+    current.sources["a.pdf"] = manifest.SourceEntry("pdf", "abc")
+    current.sources["http://x"] = manifest.SourceEntry("web", "def")
+
+    assert not current.is_changed("a.pdf", "abc")
+    assert current.is_changed("a.pdf", "abd")
+    assert current.is_changed("b.pdf", "abc")
+    assert current.removed("pdf", {"b.pdf"}) == ["a.pdf"]
+    assert current.removed("web", {"http://x"}) == []
+
+
+def test_chunk_id():
+    doc = Document(page_content="hello", metadata={"source": "a", "start_index": 0})
+    same = Document(page_content="hello", metadata={"start_index": 0, "source": "a"})
+    moved = Document(page_content="hello", metadata={"source": "a", "start_index": 5})
+
+    assert manifest.chunk_id(doc) == manifest.chunk_id(same)
+    assert manifest.chunk_id(doc) != manifest.chunk_id(moved)
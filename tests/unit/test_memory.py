@@ -0,0 +1,301 @@
+import pytest
+
+from chatbot import memory
+from chatbot.settings import BatchSettings, VectorStoreSettings
+
+
+def test_list_pdfs(pdf_folder):
+    (pdf_folder / ".hidden.pdf").write_bytes(b"")
+    (pdf_folder / "notes.txt").write_text("not a pdf")
+
+    pdfs = memory.list_pdfs(pdf_folder)
+    assert [pdf.name for pdf in pdfs] == [f"doc_{i}.pdf" for i in range(4)]
+
+
+def test_load_pdfs(pdf_folder):
+    docs = memory.load_pdfs(pdf_folder)
+    assert len(docs) == 12
+    assert "Document 0 page 0" in docs[0].page_content
+    assert docs[0].metadata["source"] == str(pdf_folder / "doc_0.pdf")
+
+
+def test_parallel_chunks_match_serial(pdf_folder):
+    serial = list(memory.iter_pdf_chunks(pdf_folder, 100, 10, workers=1))
+    parallel = list(memory.iter_pdf_chunks(pdf_folder, 100, 10, workers=3))
+
+    assert len(serial) > 12
+    assert serial == parallel
+    assert serial == memory.split_text(memory.load_pdfs(pdf_folder), 100, 10)
+
+
+def test_parse_failure_does_not_stop_batch(pdf_folder, caplog):
+    (pdf_folder / "doc_1.pdf").write_bytes(b"%PDF-1.4 broken")
+
+    chunks = list(memory.iter_pdf_chunks(pdf_folder, 100, 10, workers=2))
+
+    sources = {chunk.metadata["source"] for chunk in chunks}
+    assert str(pdf_folder / "doc_1.pdf") not in sources
+    assert len(sources) == 3
+    assert "doc_1.pdf" in caplog.text
+
+
+def test_create_memory_twice_fails(pdf_folder, memory_dir, fake_embeddings):
+    memory.create_memory(fake_embeddings, pdf_folder, "pdf", 100, 10)
+    with pytest.raises(Exception, match="Chroma database already exists."):
+        memory.create_memory(fake_embeddings, pdf_folder, "pdf", 100, 10)
+
+
+def test_incremental_ingest(pdf_folder, memory_dir, fake_embeddings, pdf_writer):
+    memory.create_memory(fake_embeddings, pdf_folder, "pdf", 100, 10)
+    total = fake_embeddings.texts
+    count = memory.get_memory(fake_embeddings)._collection.count()
+    assert count == total
+
+    memory.create_memory(fake_embeddings, pdf_folder, "pdf", 100, 10, incremental=True)
+    assert fake_embeddings.texts == total
+
+    pdf_writer(pdf_folder / "doc_0.pdf", ["Document 0 changed " + "lorem ipsum " * 20])
+    (pdf_folder / "doc_3.pdf").unlink()
+    memory.create_memory(fake_embeddings, pdf_folder, "pdf", 100, 10, incremental=True)
+
+    db = memory.get_memory(fake_embeddings)
+    stored = db.get()
+    sources = {meta["source"] for meta in stored["metadatas"]}
+    assert str(pdf_folder / "doc_3.pdf") not in sources
+    assert any("changed" in text for text in stored["documents"])
+    assert not any("Document 0 page 1" in text for text in stored["documents"])
+    assert fake_embeddings.texts - total == 3
+    assert sorted(stored["ids"]) == sorted(
+        id_
+        for entry in memory.load_manifest(memory.MANIFEST_PATH).sources.values()
+        for id_ in entry.chunks
+    )
+    lexical = memory.LexicalIndex(memory.LEXICAL_INDEX)
+    assert sorted(lexical.documents(stored["ids"])) == sorted(stored["ids"])
+    assert len(lexical) == len(stored["ids"])
+
+
+def test_source_without_chunks_is_removed(
+    pdf_folder,
+    memory_dir,
+    fake_embeddings,
+    pdf_writer,
+):
+    memory.create_memory(fake_embeddings, pdf_folder, "pdf", 100, 10)
+    emptied = pdf_folder / "doc_0.pdf"
+    pdf_writer(emptied, [" "])
+    memory.create_memory(fake_embeddings, pdf_folder, "pdf", 100, 10, incremental=True)
+
+    stored = memory.get_memory(fake_embeddings).get()
+    assert str(emptied) not in {meta["source"] for meta in stored["metadatas"]}
+    lexical = memory.LexicalIndex(memory.LEXICAL_INDEX)
+    assert len(lexical) == len(stored["ids"])
+    entry = memory.load_manifest(memory.MANIFEST_PATH).sources[str(emptied)]
+    assert entry.hash == memory.file_hash(emptied)
+    assert entry.chunks == []
+
+    texts = fake_embeddings.texts
+    memory.create_memory(fake_embeddings, pdf_folder, "pdf", 100, 10, incremental=True)
+    assert fake_embeddings.texts == texts
+
+
+def test_get_retriever(pdf_folder, memory_dir, fake_embeddings):
+    memory.create_memory(fake_embeddings, pdf_folder, "pdf", 100, 10)
+    docs = memory.get_retriever(fake_embeddings, "lexical").invoke("Document 2")
+
+    assert fake_embeddings.queries == 0
+    assert len(docs) == 4
+    assert "Document 2" in docs[0].page_content
+
+
+def test_resume_interrupted_ingest(pdf_folder, memory_dir, fake_embeddings):
+    batching = BatchSettings(batch_size=4, concurrency=1)
+    fake_embeddings.fail_at_call = 3
+    with pytest.raises(RuntimeError, match="Embedding failed"):
+        memory.create_memory(
+            fake_embeddings,
+            pdf_folder,
+            "pdf",
+            100,
+            10,
+            1,
+            False,
+            batching,
+        )
+    assert memory.CHECKPOINT_PATH.exists()
+
+    fake_embeddings.fail_at_call = 0
+    memory.create_memory(
+        fake_embeddings,
+        pdf_folder,
+        "pdf",
+        100,
+        10,
+        1,
+        False,
+        batching,
+    )
+
+    assert not memory.CHECKPOINT_PATH.exists()
+    stored = memory.get_memory(fake_embeddings)._collection.count()
+    assert fake_embeddings.texts == stored
+
+
+def test_resume_with_other_chunking_fails(pdf_folder, memory_dir, fake_embeddings):
+    batching = BatchSettings(batch_size=4, concurrency=1)
+    fake_embeddings.fail_at_call = 3
+    with pytest.raises(RuntimeError, match="Embedding failed"):
+        memory.create_memory(
+            fake_embeddings,
+            pdf_folder,
+            "pdf",
+            100,
+            10,
+            1,
+            False,
+            batching,
+        )
+    fake_embeddings.fail_at_call = 0
+
+    with pytest.raises(Exception, match="chunk size 100, overlap 10 and length"):
+        memory.create_memory(
+            fake_embeddings,
+            pdf_folder,
+            "pdf",
+            200,
+            10,
+            1,
+            False,
+            batching,
+        )
+    assert memory.CHECKPOINT_PATH.exists()
+
+
+def test_failed_ingest_indexes_only_stored_chunks(
+    pdf_folder,
+    memory_dir,
+    fake_embeddings,
+    pdf_writer,
+):
+    memory.create_memory(fake_embeddings, pdf_folder, "pdf", 100, 10)
+    for i in range(4, 7):
+        pdf_writer(pdf_folder / f"doc_{i}.pdf", [f"Document {i} " + "lorem " * 60])
+    fake_embeddings.fail_at_call = fake_embeddings.calls + 2
+    with pytest.raises(RuntimeError, match="Embedding failed"):
+        memory.create_memory(
+            fake_embeddings,
+            pdf_folder,
+            "pdf",
+            100,
+            10,
+            batching=BatchSettings(batch_size=2, concurrency=1),
+            incremental=True,
+        )
+
+    stored = memory.get_memory(fake_embeddings).get()["ids"]
+    lexical = memory.LexicalIndex(memory.LEXICAL_INDEX)
+    assert sorted(lexical.documents(stored)) == sorted(stored)
+    assert len(lexical) == len(stored)
+
+
+def test_ingest_web_pages(web_server, tmp_path, memory_dir, fake_embeddings):
+    web_server.pages = {
+        f"/page/{i}": f"<html><body>Page {i} {'lorem ipsum ' * 20}</body></html>"
+        for i in range(3)
+    }
+    folder = tmp_path / "web"
+    folder.mkdir()
+    urls = "".join(f"  - {web_server.url(f'/page/{i}')}\n" for i in range(3))
+    (folder / memory.PAGES_FILE).write_text("pages:\n" + urls)
+
+    memory.create_memory(fake_embeddings, folder, "web", 100, 10)
+    total = fake_embeddings.texts
+
+    memory.create_memory(fake_embeddings, folder, "web", 100, 10, incremental=True)
+    assert web_server.not_modified == 3
+    assert fake_embeddings.texts == total
+
+    web_server.pages["/page/1"] = "<html><body>Page 1 changed</body></html>"
+    memory.create_memory(fake_embeddings, folder, "web", 100, 10, incremental=True)
+    assert web_server.not_modified == 5
+    assert fake_embeddings.texts == total + 1
+    stored = memory.get_memory(fake_embeddings).get()
+    assert "Page 1 changed" in stored["documents"]
+
+
+def test_compact_memory(pdf_folder, memory_dir, fake_embeddings):
+    store = VectorStoreSettings("compact", "int8", 16)
+    memory.create_memory(fake_embeddings, pdf_folder, "pdf", 100, 10, store=store)
+    with pytest.raises(Exception, match="Compact vector store already exists."):
+        memory.create_memory(fake_embeddings, pdf_folder, "pdf", 100, 10, store=store)
+
+    db = memory.get_memory(fake_embeddings, store)
+    assert not memory.CHROMA_PATH.exists()
+    assert len(db) == fake_embeddings.texts
+    chunk = db.get()["documents"][5]
+    docs = memory.get_retriever(fake_embeddings, "vector", store=store).invoke(chunk)
+    assert docs[0].page_content == chunk
+
+
+def test_convert_chroma(pdf_folder, memory_dir, fake_embeddings):
+    memory.create_memory(fake_embeddings, pdf_folder, "pdf", 100, 10)
+    chroma = memory.get_memory(fake_embeddings)
+
+    store = VectorStoreSettings("compact", "float16")
+    assert memory.convert_chroma(memory.CHROMA_PATH, store, batch_size=7) == (
+        chroma._collection.count()
+    )
+
+    compact = memory.get_memory(fake_embeddings, store)
+    stored = chroma.get()
+    assert sorted(compact.get()["ids"]) == sorted(stored["ids"])
+    chunk = stored["documents"][3]
+    assert compact.similarity_search(chunk, k=1)[0].page_content == chunk
+    with pytest.raises(Exception, match="already exists"):
+        memory.convert_chroma(memory.CHROMA_PATH, store)
+
+
+def test_collections(tmp_path, memory_dir, fake_embeddings, pdf_writer):
+    for name in ("people", "theses"):
+        folder = tmp_path / name
+        folder.mkdir()
+        pdf_writer(folder / "doc.pdf", [f"The {name} of the center " + "lorem " * 20])
+        store = VectorStoreSettings(collection=name)
+        memory.create_memory(fake_embeddings, folder, "pdf", 100, 10, store=store)
+
+    assert memory.list_collections() == ["people", "theses"]
+    assert not memory.CHROMA_PATH.exists()
+    retriever = memory.get_retriever(
+        fake_embeddings,
+        "lexical",
+        collections=["people", "theses"],
+    )
+    sources = {doc.metadata["source"] for doc in retriever.invoke("center")}
+    assert sources == {
+        str(tmp_path / "people" / "doc.pdf"),
+        str(tmp_path / "theses" / "doc.pdf"),
+    }
+    with pytest.raises(ValueError, match="Unknown collection: staff."):
+        memory.get_retriever(fake_embeddings, collections=["people", "staff"]).invoke(
+            "center",
+        )
+    with pytest.raises(ValueError, match="Invalid collection name"):
+        memory.collection_paths("../people")
+
+
+def test_embedding_model_is_checked(pdf_folder, memory_dir, fake_embeddings):
+    memory.create_memory(fake_embeddings, pdf_folder, "pdf", 100, 10, model="small")
+
+    assert memory.get_retriever(fake_embeddings, "vector", model="small")
+    with pytest.raises(Exception, match="embedded with small, not local:mini"):
+        memory.get_retriever(fake_embeddings, "vector", model="local:mini")
+    with pytest.raises(Exception, match="embedded with small, not large"):
+        memory.create_memory(
+            fake_embeddings,
+            pdf_folder,
+            "pdf",
+            100,
+            10,
+            incremental=True,
+            model="large",
+        )
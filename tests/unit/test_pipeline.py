@@ -0,0 +1,35 @@
+import itertools
+
+import pytest
+
+from chatbot.pipeline import IngestProgress, stage
+
+
+def test_stage_is_bounded():
+    produced = []
+
+    def items():
+        for i in itertools.count():
+            produced.append(i)
+            yield i
+
+    progress = IngestProgress(enabled=False)
+    results = stage(items(), "count", progress, maxsize=4)
+
+    assert list(itertools.islice(results, 10)) == list(range(10))
+    assert progress.completed("count") == 10
+    assert len(produced) <= 10 + 4 + 1
+    results.close()
+
+
+def test_stage_raises_the_producer_errors():
+    def items():
+        yield 1
+        msg = "The page is gone."
+        raise RuntimeError(msg)
+
+    results = stage(stage(items(), "load"), "split")
+
+    assert next(results) == 1
+    with pytest.raises(RuntimeError, match="The page is gone."):
+        next(results)
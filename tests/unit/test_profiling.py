@@ -0,0 +1,70 @@
+import json
+
+import pytest
+from langchain.memory import ChatMessageHistory
+from rich.console import Console
+
+from chatbot import chat, memory, profiling
+from chatbot.fakes import FakeChatModel, FakeEmbeddings, fake_documents
+from chatbot.history import HistoryWindow
+from chatbot.settings import HistorySettings
+
+
+@pytest.fixture()
+def profiler():
+    yield profiling.enable()
+    profiling.disable()
+
+
+def test_span_disabled():
+    assert profiling.active() is None
+    with profiling.span("stage", chunks=1) as attrs:
+        attrs["tokens"] = 2
+
+
+def test_span_enabled(profiler, tmp_path):
+    with profiling.span("outer", chunks=1) as attrs:
+        attrs["tokens"] = 2
+        with profiling.span("inner"):
+            pass
+    with profiling.span("inner"):
+        pass
+
+    assert [span.name for span in profiler.spans] == ["inner", "outer", "inner"]
+    assert profiler.spans[1].attrs == {"chunks": 1, "tokens": 2}
+
+    console = Console(record=True, width=200)
+    profiler.report(console)
+    profiler.summary(console)
+    text = console.export_text()
+    assert "  inner" in text
+    assert "chunks=1, tokens=2" in text
+
+    profiler.write_trace(tmp_path / "trace.json")
+    events = json.loads((tmp_path / "trace.json").read_text())["traceEvents"]
+    assert {event["ph"] for event in events} == {"X"}
+    assert events[1]["args"] == {"chunks": 1, "tokens": 2}
+
+
+@pytest.mark.parametrize("stream", [True, False])
+def test_loop_breakdown(monkeypatch, memory_dir, profiler, stream):
+    monkeypatch.setattr(chat.Prompt, "ask", lambda *_: "Tell me about sonification")
+    db = memory.get_memory(profiling.profile_embeddings(FakeEmbeddings()))
+    db.add_documents(fake_documents(10))
+    history = HistoryWindow(ChatMessageHistory(), HistorySettings())
+    console = Console(record=True, width=200)
+
+    chat.loop(
+        history,
+        chat.create_chain(FakeChatModel(), "{context}"),
+        db.as_retriever(),
+        console,
+        stream=stream,
+    )
+
+    names = {span.name for span in profiler.spans}
+    assert {"turn", "retrieve", "embed_query", "generate", "prompt", "llm"} <= names
+    llm = next(span for span in profiler.spans if span.name == "llm")
+    assert llm.attrs["prompt_tokens"] > 0
+    assert llm.attrs["completion_tokens"] > 0
+    assert "Turn breakdown" in console.export_text()
@@ -0,0 +1,96 @@
+import functools
+import time
+
+from langchain_core.documents import Document
+
+from chatbot import rerank
+from chatbot.rerank import RerankingRetriever
+from chatbot.settings import RerankSettings
+
+
+class LengthScorer:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.batches = []
+
+    def __call__(self, pairs):
+        time.sleep(self.latency)
+        self.batches.append(len(pairs))
+        return [float(len(text)) for _, text in pairs]
+
+
+def documents():
+    return [
+        Document(page_content="a" * length, metadata={"source": "doc.pdf", "page": i})
+        for i, length in enumerate([3, 10, 1, 7, 5])
+    ]
+
+
+def test_rerank_by_score(list_retriever):
+    scorer = LengthScorer()
+    retriever = RerankingRetriever(
+        retriever=list_retriever(docs=documents()),
+        scorer=scorer,
+        settings=RerankSettings(candidates=5, k=3, batch_size=2),
+    )
+
+    docs = retriever.invoke("question")
+    retriever.invoke("question")
+
+    assert [len(doc.page_content) for doc in docs] == [10, 7, 5]
+    assert scorer.batches == [2, 2, 1]
+    assert (retriever.reranked, retriever.fallbacks) == (2, 0)
+
+
+def test_fallback_over_budget(list_retriever):
+    scorer = LengthScorer(latency=0.02)
+    retriever = RerankingRetriever(
+        retriever=list_retriever(docs=documents()),
+        scorer=scorer,
+        settings=RerankSettings(candidates=5, k=3, batch_size=2, budget_ms=10),
+    )
+
+    docs = retriever.invoke("question")
+
+    assert [len(doc.page_content) for doc in docs] == [3, 10, 1]
+    assert scorer.batches == [2]
+    assert (retriever.reranked, retriever.fallbacks) == (0, 1)
+
+    # the scores computed before the fallback are reused
+    retriever.settings.budget_ms = 0
+    retriever.invoke("question")
+    assert scorer.batches == [2, 2, 1]
+
+
+def test_batch_expected_over_budget_is_skipped(list_retriever):
+    scorer = LengthScorer(latency=0.02)
+    retriever = RerankingRetriever(
+        retriever=list_retriever(docs=documents()),
+        scorer=scorer,
+        settings=RerankSettings(candidates=5, k=3, batch_size=2, budget_ms=30),
+    )
+
+    docs = retriever.invoke("question")
+
+    # a second batch would end after 40 ms
+    assert scorer.batches == [2]
+    assert [len(doc.page_content) for doc in docs] == [3, 10, 1]
+
+
+def test_scorer_loads_the_model_once(monkeypatch):
+    class Encoder:
+        def predict(self, pairs, **kwargs):
+            return [float(len(text)) for _, text in pairs]
+
+    loaded = []
+
+    def load(model, device):
+        loaded.append((model, device))
+        return Encoder()
+
+    monkeypatch.setattr(rerank, "_load_cross_encoder", functools.cache(load))
+    scorer = rerank.CrossEncoderScorer("model", "cuda")
+
+    scorer.load()
+    assert scorer([("question", "ab"), ("question", "a")]) == [2.0, 1.0]
+    assert loaded == [("model", "cuda")]
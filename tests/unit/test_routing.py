@@ -0,0 +1,117 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from langchain_core.documents import Document
+
+from chatbot.routing import RetrieverPool, RoutingRetriever
+
+
+def make_pool(list_retriever, collections, max_open=2):
+    opened, closed = [], []
+
+    def open_retriever(name):
+        opened.append(name)
+        return list_retriever(docs=collections[name])
+
+    def close_retriever(name, retriever):
+        closed.append(name)
+
+    return RetrieverPool(open_retriever, close_retriever, max_open), opened, closed
+
+
+def docs(*texts):
+    return [Document(page_content=text) for text in texts]
+
+
+def test_pool_evicts_least_recently_used(list_retriever):
+    pool, opened, closed = make_pool(list_retriever, {name: [] for name in "abc"})
+
+    for name in ["a", "b", "a", "c", "a"]:
+        with pool.acquire(name):
+            pass
+
+    assert opened == ["a", "b", "c"]
+    assert closed == ["b"]
+    assert len(pool) == 2
+    assert "b" not in pool
+
+    pool.close()
+    assert sorted(closed) == ["a", "b", "c"]
+
+
+def test_pool_closes_evicted_retriever_after_use(list_retriever):
+    pool, _, closed = make_pool(
+        list_retriever,
+        {name: [] for name in "abc"},
+        max_open=1,
+    )
+
+    with pool.acquire("a"):
+        with pool.acquire("b"):
+            assert closed == []
+        assert closed == []
+    assert closed == ["a"]
+
+
+def test_routing_retriever_fuses_collections(list_retriever):
+    collections = {
+        "people": docs("Mario Rossi", "Anna Bianchi"),
+        "theses": docs("Spatial audio", "Mario Rossi"),
+    }
+    pool, _, _ = make_pool(list_retriever, collections)
+
+    retriever = RoutingRetriever(pool=pool, collections=["people", "theses"], k=3)
+    found = [doc.page_content for doc in retriever.invoke("who?")]
+
+    assert found[0] == "Mario Rossi"
+    assert sorted(found[1:]) == ["Anna Bianchi", "Spatial audio"]
+    single = RoutingRetriever(pool=pool, collections=["theses"], k=1)
+    assert single.invoke("who?") == docs("Spatial audio")
+
+
+def test_slow_open_does_not_block_other_collections(list_retriever):
+    started = threading.Event()
+    release = threading.Event()
+    opened = []
+
+    def open_retriever(name):
+        if name == "slow":
+            started.set()
+            release.wait(5)
+        opened.append(name)
+        return list_retriever(docs=[])
+
+    pool = RetrieverPool(open_retriever, lambda name, retriever: None)
+
+    def search_slow():
+        with pool.acquire("slow"):
+            pass
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        slow = executor.submit(search_slow)
+        assert started.wait(5)
+        with pool.acquire("fast"):
+            assert opened == ["fast"]
+        release.set()
+        slow.result()
+    assert opened == ["fast", "slow"]
+
+
+def test_failed_open_is_retried(list_retriever):
+    attempts = []
+
+    def open_retriever(name):
+        attempts.append(name)
+        if len(attempts) == 1:
+            msg = "The collection is locked."
+            raise RuntimeError(msg)
+        return list_retriever(docs=[])
+
+    pool = RetrieverPool(open_retriever, lambda name, retriever: None)
+    with pytest.raises(RuntimeError, match="locked"), pool.acquire("a"):
+        pass
+    assert "a" not in pool
+    with pool.acquire("a"):
+        pass
+    assert attempts == ["a", "a"]
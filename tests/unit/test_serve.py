@@ -0,0 +1,216 @@
+import asyncio
+
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+
+from chatbot import memory
+from chatbot.chat import create_chain
+from chatbot.fakes import FAKE_ANSWER, FakeChatModel, FakeEmbeddings, fake_documents
+from chatbot.serve import ChatServer, create_app, create_router
+from chatbot.settings import (
+    HistorySettings,
+    RerankSettings,
+    ServeSettings,
+    VectorStoreSettings,
+)
+
+
+class CountingChatModel(FakeChatModel):
+    running: int = 0
+    peak: int = 0
+
+    async def _astream(self, *args, **kwargs):
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        try:
+            async for chunk in super()._astream(*args, **kwargs):
+                yield chunk
+        finally:
+            self.running -= 1
+
+
+def run(app, scenario):
+    async def main():
+        async with TestClient(TestServer(app)) as client:
+            return await scenario(client)
+
+    return asyncio.run(main())
+
+
+def make_server(memory_dir, llm, **settings):
+    db = memory.get_memory(FakeEmbeddings())
+    db.add_documents(fake_documents(10))
+    return ChatServer(
+        create_chain(llm, "{context}"),
+        db.as_retriever(),
+        HistorySettings(),
+        ServeSettings(**settings),
+    )
+
+
+def test_chat_streams_answer(memory_dir):
+    server = make_server(memory_dir, FakeChatModel())
+
+    async def scenario(client):
+        response = await client.post("/chat", json={"question": "Who are you?"})
+        chunks = [chunk async for chunk in response.content.iter_any()]
+        return response, b"".join(chunks).decode()
+
+    response, body = run(server.app(), scenario)
+
+    assert response.status == 200
+    assert body == FAKE_ANSWER
+    session = server._sessions[response.headers["X-Session-Id"]]
+    assert [message.content for message in session.window.messages] == [
+        "Who are you?",
+        FAKE_ANSWER,
+    ]
+
+
+def test_chat_sessions(memory_dir):
+    server = make_server(memory_dir, FakeChatModel(), max_sessions=2)
+
+    async def scenario(client):
+        for session in ["a", "b", "a", "c"]:
+            response = await client.post(
+                "/chat",
+                json={"session": session, "question": "Hello"},
+            )
+            await response.text()
+        return await (await client.get("/health")).json()
+
+    health = run(server.app(), scenario)
+
+    assert health == {"sessions": 2, "in_flight": 0}
+    assert list(server._sessions) == ["a", "c"]
+    assert len(server._sessions["a"].window.messages) == 4
+
+
+def test_chat_max_in_flight(memory_dir):
+    llm = CountingChatModel(token_latency=0.005)
+    server = make_server(memory_dir, llm, max_in_flight=3)
+
+    async def scenario(client):
+        responses = await asyncio.gather(
+            *(
+                client.post("/chat", json={"session": str(i), "question": "Hi"})
+                for i in range(10)
+            ),
+        )
+        return [await response.text() for response in responses]
+
+    answers = run(server.app(), scenario)
+
+    assert answers == [FAKE_ANSWER] * 10
+    assert llm.peak == 3
+
+
+def test_chat_bad_request(memory_dir):
+    server = make_server(memory_dir, FakeChatModel())
+
+    async def scenario(client):
+        invalid = await client.post("/chat", data=b"not json")
+        empty = await client.post("/chat", json={"question": " "})
+        return invalid.status, empty.status
+
+    assert run(server.app(), scenario) == (400, 400)
+
+
+def test_create_app_fake():
+    app = create_app(
+        "model",
+        "embedding",
+        0.0,
+        "{context}",
+        "sk-test",
+        0,
+        HistorySettings(),
+        ServeSettings(),
+        fake=True,
+    )
+
+    async def scenario(client):
+        response = await client.post("/chat", json={"question": "Projects?"})
+        return await response.text()
+
+    assert run(app, scenario).startswith("The Center")
+
+
+def test_chat_routes_collections(memory_dir):
+    server = make_server(memory_dir, FakeChatModel())
+    routed = []
+
+    def route(names):
+        routed.append(names)
+        if "unknown" in names:
+            msg = "Unknown collection: unknown."
+            raise ValueError(msg)
+        return server.retriever
+
+    server.route = route
+
+    async def scenario(client):
+        statuses = []
+        for collections in [["people", "theses"], ["unknown"], "people"]:
+            response = await client.post(
+                "/chat",
+                json={"question": "Hello", "collections": collections},
+            )
+            await response.text()
+            statuses.append(response.status)
+        return statuses
+
+    assert run(server.app(), scenario) == [200, 400, 400]
+    assert routed == [["people", "theses"], ["unknown"]]
+
+
+class CountingScorer:
+    pairs = 0
+
+    def __init__(self, model, device):
+        pass
+
+    def load(self):
+        pass
+
+    def __call__(self, pairs):
+        CountingScorer.pairs += len(pairs)
+        return [float(len(text)) for _, text in pairs]
+
+
+def test_router_reuses_the_retrievers(
+    tmp_path,
+    memory_dir,
+    fake_embeddings,
+    pdf_writer,
+    monkeypatch,
+):
+    monkeypatch.setattr(memory, "CrossEncoderScorer", CountingScorer)
+    for name in ("people", "theses"):
+        folder = tmp_path / name
+        folder.mkdir()
+        pdf_writer(folder / "doc.pdf", [f"The {name} of the center " + "lorem " * 20])
+        store = VectorStoreSettings(collection=name)
+        memory.create_memory(fake_embeddings, folder, "pdf", 100, 10, store=store)
+    store = VectorStoreSettings()
+    pool = memory.create_pool(fake_embeddings, "lexical", 20, store)
+    route = create_router(
+        fake_embeddings,
+        "lexical",
+        store,
+        pool,
+        rerank=RerankSettings(budget_ms=0),
+    )
+
+    retriever = route(["people", "theses"])
+    assert route(["people", "theses"]) is retriever
+    assert route(["theses"]) is not retriever
+    retriever.invoke("center")
+    scored = CountingScorer.pairs
+    assert scored > 0
+    # the next request scores from the cache of the shared retriever
+    route(["people", "theses"]).invoke("center")
+    assert CountingScorer.pairs == scored
+    with pytest.raises(ValueError, match="Unknown collection: staff."):
+        route(["people", "staff"])
+    pool.close()
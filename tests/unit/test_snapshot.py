@@ -0,0 +1,90 @@
+import json
+import zipfile
+
+import numpy as np
+import pytest
+
+from chatbot import memory
+from chatbot.manifest import Manifest, load_manifest
+from chatbot.settings import VectorStoreSettings
+from chatbot.snapshot import HEADER_FILE, read_header, write_snapshot
+
+
+def test_export_and_import(pdf_folder, tmp_path, memory_dir, fake_embeddings):
+    memory.create_memory(fake_embeddings, pdf_folder, "pdf", 100, 10, model="small")
+    chroma = memory.get_memory(fake_embeddings)
+    stored = chroma.get(include=["embeddings", "documents"])
+    snapshot = tmp_path / "index.snapshot"
+
+    assert memory.export_snapshot(snapshot, VectorStoreSettings(), batch_size=7) == (
+        len(stored["ids"])
+    )
+
+    header = read_header(snapshot)
+    assert header.manifest == load_manifest(memory.MANIFEST_PATH)
+    assert (header.count, header.dimensions) == (len(stored["ids"]), 32)
+    calls = fake_embeddings.calls
+    for store in (
+        VectorStoreSettings(collection="copy"),
+        VectorStoreSettings("compact", collection="compact"),
+    ):
+        assert memory.import_snapshot(snapshot, store, batch_size=5) == header.count
+        imported = memory.get_memory(fake_embeddings, store)
+        assert sorted(imported.get()["ids"]) == sorted(stored["ids"])
+        chunk = stored["documents"][3]
+        # only the vectors find the chunk, not its words
+        retriever = memory.get_retriever(fake_embeddings, "vector", store=store)
+        assert retriever.invoke(chunk)[0].page_content == chunk
+        with pytest.raises(Exception, match="already exists"):
+            memory.import_snapshot(snapshot, store)
+    assert fake_embeddings.calls == calls
+    copy = memory.get_memory(fake_embeddings, VectorStoreSettings(collection="copy"))
+    copied = copy.get(include=["embeddings"])
+    vectors = dict(zip(copied["ids"], copied["embeddings"], strict=True))
+    for id_, vector in zip(stored["ids"], stored["embeddings"], strict=True):
+        assert np.allclose(vectors[id_], vector)
+    assert memory.list_collections() == ["default", "compact", "copy"]
+    assert load_manifest(memory.collection_paths("copy").manifest).embedding == "small"
+
+
+class ShuffledStore:
+    """A store returning its chunks in another order at every read."""
+
+    def __init__(self, ids):
+        self.ids = ids
+        self.reads = 0
+
+    def count(self):
+        return len(self.ids)
+
+    def get(self, include, limit, offset):
+        if offset == 0:
+            self.reads += 1
+        ids = self.ids if self.reads % 2 else self.ids[::-1]
+        ids = ids[offset : offset + limit]
+        return {
+            "ids": ids,
+            "embeddings": [[1.0, 0.0] for _ in ids],
+            "documents": ids,
+            "metadatas": [{} for _ in ids],
+        }
+
+
+def test_changed_store_is_not_exported(tmp_path):
+    snapshot = tmp_path / "index.snapshot"
+    store = ShuffledStore(["a", "b", "c"])
+
+    with pytest.raises(Exception, match="changed while it was exported"):
+        write_snapshot(snapshot, Manifest(100, 10), store, batch_size=2)
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_unsupported_snapshot(tmp_path):
+    snapshot = tmp_path / "index.snapshot"
+    with zipfile.ZipFile(snapshot, "w") as archive:
+        archive.writestr(HEADER_FILE, json.dumps({"version": 0}))
+
+    with pytest.raises(ValueError, match="Unsupported snapshot version: 0."):
+        read_header(snapshot)
+    with pytest.raises(ValueError, match="is not a snapshot"):
+        read_header(tmp_path)
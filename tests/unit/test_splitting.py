@@ -0,0 +1,52 @@
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from chatbot import splitting
+from chatbot.fakes import fake_web_pages
+
+
+class WordEncoding:
+    def encode(self, text, disallowed_special=()):
+        return text.split()
+
+
+def test_matches_the_splitter():
+    pages = fake_web_pages(10, words=300)
+    expected = RecursiveCharacterTextSplitter(
+        chunk_size=500,
+        chunk_overlap=50,
+        add_start_index=True,
+    ).split_documents(pages)
+
+    serial = list(splitting.iter_split(pages, 500, 50))
+    parallel = list(splitting.iter_split(pages, 500, 50, workers=2, batch_size=3))
+
+    assert serial == expected
+    assert parallel == expected
+
+
+def test_consumes_documents_lazily():
+    pages = fake_web_pages(10, words=300)
+    consumed = []
+
+    def documents():
+        for page in pages:
+            consumed.append(page)
+            yield page
+
+    chunks = splitting.iter_split(documents(), 500, 50)
+    first = next(chunks)
+
+    assert first.metadata["source"] == pages[0].metadata["source"]
+    assert len(consumed) == 1
+
+
+def test_token_lengths(monkeypatch):
+    monkeypatch.setattr(splitting, "_encoding", lambda name: WordEncoding())
+    splitting.count_tokens.cache_clear()
+    page = fake_web_pages(1, words=300)[0]
+
+    chunks = list(splitting.iter_split([page], 40, 5, unit="tokens"))
+    splitting.count_tokens.cache_clear()
+
+    assert len(chunks) > 1
+    assert all(len(chunk.page_content.split()) <= 40 for chunk in chunks)
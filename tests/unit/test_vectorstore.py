@@ -0,0 +1,130 @@
+import json
+
+import numpy as np
+import pytest
+
+from chatbot.fakes import FakeEmbeddings, fake_web_pages
+from chatbot.vectorstore import (
+    CHUNKS_FILE,
+    INDEX_FILE,
+    VECTORS_FILE,
+    CompactVectorStore,
+    quantize,
+    truncate,
+)
+
+
+@pytest.fixture()
+def pages():
+    return fake_web_pages(200, words=60)
+
+
+def build(path, pages, **kwargs):
+    return CompactVectorStore.from_texts(
+        [page.page_content for page in pages],
+        FakeEmbeddings(),
+        [page.metadata for page in pages],
+        path=path,
+        ids=[str(i) for i in range(len(pages))],
+        **kwargs,
+    )
+
+
+def test_truncate():
+    vectors = truncate(np.array([[3.0, 4.0, 12.0], [0.0, 0.0, 0.0]]), 2)
+
+    assert vectors.shape == (2, 2)
+    np.testing.assert_allclose(vectors[0], [0.6, 0.8])
+    np.testing.assert_allclose(vectors[1], [0.0, 0.0])
+
+
+def test_quantize_int8():
+    vectors = truncate(np.random.default_rng(0).normal(size=(10, 64)), 0)
+
+    quantized, scales = quantize(vectors, "int8")
+
+    assert quantized.dtype == np.int8
+    np.testing.assert_allclose(quantized * scales[:, None], vectors, atol=0.01)
+
+
+@pytest.mark.parametrize("dtype", ["float16", "int8"])
+def test_quantized_search_matches_float32(tmp_path, pages, dtype):
+    exact = build(tmp_path / "float32", pages, dtype="float32")
+    compact = build(tmp_path / dtype, pages, dtype=dtype)
+
+    for query in ["sound synthesis", "Mario Rossi", "old tapes in the studio"]:
+        expected = exact.similarity_search_with_score(query, k=5)
+        found = compact.similarity_search_with_score(query, k=5)
+        assert found[0][0] == expected[0][0]
+        np.testing.assert_allclose(
+            [score for _, score in found],
+            [score for _, score in expected],
+            atol=0.02,
+        )
+
+
+def test_reopen_is_memory_mapped(tmp_path, pages):
+    store = build(tmp_path, pages, dtype="int8", dimensions=64)
+    expected = store.similarity_search("music perception", k=3)
+
+    reopened = CompactVectorStore(tmp_path, FakeEmbeddings(), "int8", 64)
+
+    assert isinstance(reopened._vectors, np.memmap)
+    assert reopened._vectors.shape == (200, 64)
+    assert len(reopened) == 200
+    assert reopened.similarity_search("music perception", k=3) == expected
+
+
+def test_upsert_and_delete(tmp_path, pages):
+    store = build(tmp_path, pages[:3])
+    embeddings = FakeEmbeddings()
+
+    store.upsert(
+        ["1", "new"],
+        embeddings.embed_documents(["replaced text", "new text"]),
+        [{"source": "a"}, {"source": "b"}],
+        ["replaced text", "new text"],
+    )
+    store.delete(["0"])
+
+    stored = CompactVectorStore(tmp_path, embeddings).get()
+    assert stored["ids"] == ["1", "2", "new"]
+    assert stored["documents"][0] == "replaced text"
+    assert stored["metadatas"][2] == {"source": "b"}
+    assert store.similarity_search("replaced text", k=1)[0].page_content == (
+        "replaced text"
+    )
+
+
+def test_upsert_appends_the_batch(tmp_path, pages):
+    store = build(tmp_path, pages[:100], dtype="int8", dimensions=64)
+    embeddings = FakeEmbeddings()
+    texts = [page.page_content for page in pages[100:]]
+    vectors = embeddings.embed_documents(texts)
+    ids = [str(i) for i in range(100, 200)]
+
+    # left by an upsert interrupted before its index was written
+    with (tmp_path / VECTORS_FILE).open("ab") as f:
+        f.write(b"\0" * 64)
+    with (tmp_path / CHUNKS_FILE).open("ab") as f:
+        f.write(b'{"id": "lost"')
+    for start in range(0, 100, 10):
+        store.upsert(
+            ids[start : start + 10],
+            vectors[start : start + 10],
+            [{"source": "new"}] * 10,
+            texts[start : start + 10],
+        )
+
+    assert (tmp_path / VECTORS_FILE).stat().st_size == 200 * 64
+    reopened = CompactVectorStore(tmp_path, embeddings)
+    assert reopened.get()["ids"] == [str(i) for i in range(200)]
+    assert reopened.similarity_search(texts[42], k=1)[0].page_content == texts[42]
+
+
+def test_unsupported_version(tmp_path):
+    index = {"version": 0, "dtype": "float32", "dimensions": 8}
+    (tmp_path / INDEX_FILE).write_text(json.dumps(index))
+
+    with pytest.raises(ValueError, match="Unsupported vector store version: 0."):
+        CompactVectorStore(tmp_path)